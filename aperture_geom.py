@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+# Circular aperture geometry
+#
+# Pixel index sets and weights of circular apertures, computed once per
+# (shape, center, radius, method) and cached, in place of the photutils
+# aperture masks in the statistics of IRIS_ETC.  The masks follow the
+# photutils conventions (pixel centers at integer coordinates, same
+# bounding box, 'center' method: pixels whose center is inside the
+# circle), and apply to the last two axes of images or cubes.
+#
+# The 'exact' method weights every pixel by its fractional overlap with
+# the circle, so that the aperture sums vary smoothly with the radius and
+# the position.  The overlap areas are computed analytically, once per
+# (radius, subpixel offset of the center) and cached.
+
+import numpy as np
+
+from etc_cache import memoize
+
+
+def _segment(x, r):
+    # area under the upper half circle of radius r between 0 and x
+    x = np.clip(x, -r, r)
+    return 0.5*(x*np.sqrt(r**2 - x**2) + r**2*np.arcsin(x/r))
+
+
+def _below(x0, x1, y, r):
+    # area of the circle of radius r (centered on the origin) with
+    # x0 < x < x1 and below y
+    total = _segment(x1, r) - _segment(x0, r)
+    w = np.sqrt(np.maximum(r**2 - y**2, 0.))
+    a = np.maximum(x0, -w)
+    b = np.minimum(x1, w)
+    inner = np.where(b > a, _segment(b, r) - _segment(a, r), 0.)
+    return total + np.sign(y)*(total - inner) + y*np.maximum(b - a, 0.)
+
+
+@memoize(maxsize=256)
+def overlap_weights(radius, dx, dy):
+    """
+    Fractional overlap of the pixels with a circle of radius [pixels],
+    centered at (dx, dy) from the center of pixel (0, 0) (0 <= dx, dy < 1),
+    on the pixel grid (y, x) of -n..n, n = ceil(radius) + 1.
+    """
+    n = int(np.ceil(radius)) + 1
+    y, x = np.mgrid[-n:n+1, -n:n+1]
+    x0 = x - dx - 0.5
+    y0 = y - dy - 0.5
+    weights = _below(x0, x0 + 1, y0 + 1, radius) - _below(x0, x0 + 1, y0, radius)
+    weights = np.clip(weights, 0., 1.)
+    weights.flags.writeable = False
+    return weights
+
+
+class aperture_mask():
+
+    def __init__(self, shape, center, radius, method='center'):
+        """
+        shape  - (ny, nx) of the images
+        center - (x, y) of the aperture center [pixels]
+        radius - aperture radius [pixels]
+        method - 'center' or 'exact'
+        """
+        if method not in ('center', 'exact'):
+            raise ValueError("unknown aperture method %s" % method)
+        self.shape = tuple(shape)
+        self.center = tuple(center)
+        self.radius = radius
+        self.method = method
+
+        # bounding box (photutils BoundingBox.from_float)
+        xc, yc = center
+        self.x0 = int(np.floor(xc - radius + 0.5))
+        self.x1 = int(np.ceil(xc + radius + 0.5))
+        self.y0 = int(np.floor(yc - radius + 0.5))
+        self.y1 = int(np.ceil(yc + radius + 0.5))
+
+        if method == 'center':
+            dy, dx = np.mgrid[self.y0:self.y1, self.x0:self.x1]
+            dx = dx - xc
+            dy = dy - yc
+            self.weights_box = (dx**2 + dy**2 < radius**2).astype(float)
+        else:
+            ix0 = int(np.floor(xc))
+            iy0 = int(np.floor(yc))
+            weights = overlap_weights(radius, xc - ix0, yc - iy0)
+            n = weights.shape[0]//2
+            self.weights_box = weights[self.y0-iy0+n:self.y1-iy0+n,
+                                       self.x0-ix0+n:self.x1-ix0+n].copy()
+
+        # pixels of the aperture inside the image
+        ny, nx = self.shape
+        iy, ix = np.nonzero(self.weights_box)
+        w = self.weights_box[iy, ix]
+        iy = iy + self.y0
+        ix = ix + self.x0
+        inside = (iy >= 0) & (iy < ny) & (ix >= 0) & (ix < nx)
+        self.iy = iy[inside]
+        self.ix = ix[inside]
+        self.weights = w[inside]
+        self.npix = len(self.weights)
+
+        for a in [self.weights_box, self.iy, self.ix, self.weights]:
+            a.flags.writeable = False
+
+    def values(self, data):
+        # data of the aperture pixels, (..., npix)
+        return np.asarray(data)[..., self.iy, self.ix]
+
+    def sum(self, data):
+        # weighted sum over the aperture, per image of a cube
+        return np.dot(self.values(data), self.weights)
+
+    def cutout(self, data):
+        # bounding box of the aperture, zero outside the image
+        data = np.asarray(data)
+        ny, nx = data.shape[-2:]
+        if self.y0 >= 0 and self.x0 >= 0 and self.y1 <= ny and self.x1 <= nx:
+            return data[..., self.y0:self.y1, self.x0:self.x1]
+        out = np.zeros(data.shape[:-2] + self.weights_box.shape, dtype=data.dtype)
+        ys0, ys1 = max(self.y0, 0), min(self.y1, ny)
+        xs0, xs1 = max(self.x0, 0), min(self.x1, nx)
+        if ys1 > ys0 and xs1 > xs0:
+            out[..., ys0-self.y0:ys1-self.y0, xs0-self.x0:xs1-self.x0] = \
+                data[..., ys0:ys1, xs0:xs1]
+        return out
+
+    def apply(self, data):
+        # weighted cutout (photutils mask.multiply)
+        return self.cutout(data)*self.weights_box
+
+    def to_image(self, shape=None):
+        # weights on the full image
+        image = np.zeros(shape or self.shape)
+        image[self.iy, self.ix] = self.weights
+        return image
+
+
+@memoize(maxsize=256)
+def circular_aperture(shape, center, radius, method='center'):
+    """
+    Cached aperture_mask, shared between the calls (read-only).
+    """
+    return aperture_mask(shape, center, radius, method)
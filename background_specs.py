@@ -73,6 +73,14 @@ from astropy.modeling import models
 from astropy.io import fits
 
 from get_filterdat import get_filterdat
+from etc_cache import memoize
+from ohlines import sim_ohlines
+from get_psf import psf_grid
+
+# airmass of the Gemini sky spectrum (mk_skybg_zm_16_15: Mauna Kea,
+# 1.6 mm water vapour, airmass 1.5), also assumed for the filter_info.dat
+# background magnitudes
+ref_airmass = 1.5
 
 def extrap1d(interpolator):
     xs = interpolator.x
@@ -93,6 +101,140 @@ def extrap1d(interpolator):
 
     return ufunclike
 
+def planck(wave, T, h=6.626e-27, c=3.0e10, k=1.38e-16):
+    """
+    Blackbody photon spectrum [photons s^-1 m^-2 um^-1 sr^-1] at the
+    wavelengths wave [Ang] for the temperatures T [K], broadcast
+    against each other (e.g. T[:,np.newaxis] for a (nT, nwave) array).
+    """
+    wa = np.asarray(wave, dtype=float)
+    T = np.asarray(T, dtype=float)
+    # erg s^-1 cm^-2 cm^-1 sr^-1
+    bb = (2*h*c*c/(wa*1e-8)**5) / (np.exp(h*c/(wa*1e-8*k*T))-1.0)
+    # convert to photons s^-1 cm^-2 A^-1 sr-1 (conversion from table)
+    # 5.03e7*lambda photons/erg (where labmda is in angstrom)
+    bb = (bb * 5.03e7 * wa) / 1e8
+    # now convert to photon s^-1 m^-2 um^-1 sr-1
+    return bb * 1e4 * 1e4
+
+def lsf_kernel(delt):
+    # normalized Gaussian kernel of fwhm delt pixels
+    stddev = delt/2*sqrt(2*log(2))
+    psf_func = models.Gaussian1D(amplitude=1.0, stddev=stddev)
+    x = np.arange(4*int(delt)+1)-2*int(delt)
+    psf = psf_func(x)
+    psf /= psf.sum() # normaliza
+    return psf
+
+def filter_band(wavelength, specs, wi, resolution, lambdamin, lambdamax,
+                noconvolve=False):
+    """
+    Background spectra (OH, continuum, BB) of a filter, sliced from the
+    spectra specs on the log grid wavelength starting at wi [Ang], with
+    the OH lines convolved to the resolution.
+    """
+    # outer samples, so that the band covers lambdamin - lambdamax
+    imin = int(floor( log10(lambdamin/wi)/log10(1.0+1.0/(resolution)) ))
+    imax = int(ceil( log10(lambdamax/wi)/log10(1.0+1.0/(resolution)) ))
+    imin = min(max(imin, 0), len(wavelength) - 2)
+    imax = min(max(imax, imin + 1), len(wavelength) - 1)
+    waves = wavelength[imin:imax+1]
+    backspecs = np.array([spec[imin:imax+1] for spec in specs])
+    if not noconvolve:
+        delt = 2.0*waves[1]/(resolution*(waves[1]-waves[0]))
+        backspecs[0] = np.convolve(backspecs[0], lsf_kernel(delt), mode='same')
+    return waves, backspecs
+
+@memoize(maxsize=4)
+def load_gemini(simdir='~/data/iris/sim/'):
+    # Gemini sky spectrum: wavelength [Ang], ph/sec/arcsec^2/micron/m^2
+    geminifile = os.path.expanduser(simdir+'skyspectra/mk_skybg_zm_16_15_ph.fits')
+    ext = 0
+    pf = fits.open(geminifile)
+    # load gemini file and convert from  ph/sec/arcsec^2/nm/m^2 to  ph/sec/arcsec^2/micron/m^2
+    geminiSpec = pf[ext].data*1e3
+    head = pf[ext].header
+    cdelt1 = head["cdelt1"]
+    crval1 = head["crval1"]
+    pf.close()
+
+    nelem = geminiSpec.shape[0]
+    backwave = (np.arange(nelem))*cdelt1 + crval1  # compute wavelength
+    backwave /= 1e4 # nm
+    geminiWave = backwave*10.0 # nm -> Angstroms
+    geminiWave.flags.writeable = False
+    geminiSpec.flags.writeable = False
+    return geminiWave, geminiSpec
+
+def gemini_sky(wavelength, simdir='~/data/iris/sim/'):
+    """
+    Gemini sky spectrum (OH lines and atmospheric thermal emission)
+    convolved to the pixels of the grid wavelength [Ang] (pixel size at
+    its start) and interpolated on it.  Only the part of the spectrum
+    under the grid and the kernel is convolved, with the same result as
+    the whole spectrum.
+    """
+    geminiWave, geminiSpec = load_gemini(simdir)
+    dgemini = geminiWave[1]-geminiWave[0]
+    delt = 2.0*(wavelength[1]-wavelength[0])/dgemini
+    margin = (2*int(delt)+2)*dgemini
+    i0 = max(np.searchsorted(geminiWave, wavelength[0]-margin) - 1, 0)
+    i1 = min(np.searchsorted(geminiWave, wavelength[-1]+margin) + 1, len(geminiWave))
+    geminiWave = geminiWave[i0:i1]
+    geminiSpec = geminiSpec[i0:i1]
+    if delt > 1:
+        geminiSpec = np.convolve(geminiSpec, lsf_kernel(delt), mode='same')
+    R_i = interpolate.interp1d(geminiWave,geminiSpec)
+    R_x = extrap1d(R_i)
+    return R_x(wavelength)
+
+class background_band():
+    # background spectra of a filter (see background_specs3.band)
+    def __init__(self, waves, backspecs):
+        self.waves = waves
+        self.backspecs = backspecs
+
+def airmass(za):
+    # plane parallel airmass at the zenith angle za [degrees]
+    return 1.0/np.cos(np.radians(za))
+
+class airmass_table():
+    """
+    Background spectra of a filter tabulated over the zenith angles of
+    the PSF grid (za_arr of get_psf).  The sky components (OH lines with
+    the atmospheric thermal emission of the Gemini spectrum, and the
+    continuum) scale with the airmass, the telescope and AO thermal
+    emission does not.  band(za) interpolates the table linearly in
+    airmass, so that zenith angle sweeps reuse the same spectra.
+    """
+
+    def __init__(self, bkgd, za=None):
+        if za is None:
+            za = psf_grid("ifs")["za"]
+        self.waves = bkgd.waves
+        self.za = np.asarray(za, dtype=float)
+        self.airmass = airmass(self.za)
+        scale = self.airmass/ref_airmass
+        self.table = np.empty((len(self.za),) + bkgd.backspecs.shape)
+        self.table[:,0:2] = bkgd.backspecs[np.newaxis,0:2]*scale[:,np.newaxis,np.newaxis]
+        self.table[:,2] = bkgd.backspecs[2]
+        self.table.flags.writeable = False
+        self.total = bkgd.backspecs.sum()
+
+    def backspecs(self, za):
+        # linear in airmass, extrapolated beyond the grid
+        x = airmass(za)
+        i = min(max(np.searchsorted(self.airmass, x) - 1, 0), len(self.airmass) - 2)
+        w = (x - self.airmass[i])/(self.airmass[i+1] - self.airmass[i])
+        return (1.0 - w)*self.table[i] + w*self.table[i+1]
+
+    def band(self, za):
+        return background_band(self.waves, self.backspecs(za))
+
+    def flux_scale(self, za):
+        # integrated background at za relative to the reference airmass
+        return self.backspecs(za).sum()/self.total
+
 class background_specs3():
 
     def __init__(self, resolution, filter, T_tel=275, T_atm=258.0, T_aos=243.0,
@@ -108,6 +250,8 @@ class background_specs3():
                    
                     verb = 0, simdir='~/data/iris/sim/', filteronly=False):
 
+    # filter = None computes no spectra, only keeps the settings: the
+    # spectra of any filter are then computed on its own grid by band()
 
     #def background_specs2(resolution, filter, T_tel=275, T_atm=258.0, T_aos=243.0,
     #                      T_zod=5800.0, Em_tel=0.09, Em_atm=0.2, Em_aos=0.01,
@@ -138,6 +282,17 @@ class background_specs3():
 
         ## Need to define zeropoint ###
         ### READ IN DATA FOR GIVEN FILTER FOR PSF (BROADBAND) 
+        self.T_tel = T_tel
+        self.T_aos = T_aos
+        self.Em_tel = Em_tel
+        self.Em_aos = Em_aos
+        self.ohsim = ohsim
+        self.simdir = simdir
+        self.resolution = resolution
+        self.noconvolve = noconvolve
+        if filter is None:
+            return
+
         filterdat = get_filterdat(filter,simdir)
         zp = filterdat["zp"]         # units of phot/s/m2
         lambdamin = filterdat["lambdamin"]
@@ -159,144 +314,13 @@ class background_specs3():
         #print dxspectrum
         wave = np.linspace(wi,wf,dxspectrum)
         
-        ## READ IN OH Lines ( the resolving power of this OH sky lines is around R=2600)
-        #openr,ohlines_file,/get_lun,simdir+"/info/ohlineslist.dat"
-        #woh=0.0 #initialize woh for search in ohlineslist.dat
-        #	    #woh is last wavelength read in .dat
-        
-        # Generate arrays for loop below
-        bbtel = np.zeros(dxspectrum)	#telescope blackbody spectrum
-        bbaos = np.zeros(dxspectrum)	#AO blackbody spectrum
-        bbatm = np.zeros(dxspectrum)	#ATM blackbody spectrum
-        bbspec = np.zeros(dxspectrum)	#TOTAL blackbody spectrum
-        bbzod = np.zeros(dxspectrum)
-        ohspec = np.zeros(dxspectrum)	#OH lines
-        contspec = np.zeros(dxspectrum)	#continuum of sky 
-        wavelength = np.zeros(dxspectrum)
-        
-        ## Loop over the first and last pixel of the complete spectrum
-        ## i (pixel along complete spectrum)
-        #for i=0L,dxspectrum-1 do begin 
-        #print dxspectrum
-        for i in xrange(dxspectrum):
-        
-            if filteronly:
-                 wa=wave[i]	#wavelength in angstroms corresponding to pixel x
-            else:        
-                 wa=wi*(1.0+1.0/resolution)**i	#wavelength in angstroms corresponding to pixel x
-            wamin=wa*(1.0-1.0/(2.0*resolution))	#min wavelength falling in this pixel
-            wamax=wa*(1.0+1.0/(2.0*resolution))	#max pixel falling in this pixel
-            wavelength[i] = wa
-            
-            ## Generate thermal Blackbodies (Tel, AO system, atmosphere)
-            # erg s^-1 cm^-2 cm^-1 sr^-1
-            bbtel[i] = (2*h*c*c/(wa*1e-8)**5) / (exp(h*c/(wa*1e-8*k*T_tel))-1.0)
-            bbaos[i] = (2*h*c*c/(wa*1e-8)**5) / (exp(h*c/(wa*1e-8*k*T_aos))-1.0) 
-            bbatm[i] = (2*h*c*c/(wa*1e-8)**5) / (exp(h*c/(wa*1e-8*k*T_atm))-1.0)
-            bbzod[i] = (2*h*c*c/(wa*1e-8)**5) / (exp(h*c/(wa*1e-8*k*T_zod))-1.0) 
-            # convert to photons s^-1 cm^-2 A^-1 sr-1 (conversion from
-            # table) 	
-            # 5.03e7*lambda photons/erg (where labmda is in angstrom)
-            bbtel[i] = (bbtel[i] * 5.03e7 * wa) / 1e8  
-            bbaos[i] = (bbaos[i] * 5.03e7 * wa) / 1e8  
-            bbatm[i] = (bbatm[i] * 5.03e7 * wa) / 1e8 
-            bbzod[i] = (bbzod[i] * 5.03e7 * wa) / 1e8  
-            # now convert to photon s^-1 m^-2 um^-1 sr-2 (switching to meters and microns
-            # for vega conversion down below, yes it cancels above but better to see the step)
-            bbtel[i] = bbtel[i] * 1e4 * 1e4  
-            bbaos[i] = bbaos[i] * 1e4 * 1e4    
-            bbatm[i] = bbatm[i] * 1e4 * 1e4  
-            bbzod[i] = bbzod[i] * 1e4 * 1e4  
-            
-            ## Total BB together with emissivities from each component
-            ## photons s^-1 m^-2 um^-1 arcsecond^-2
-            #bbspec[i] = sterrad*(bbatm[i]*Em_atm + bbtel[i]*Em_tel + bbaos[i]*Em_aos) 
-        
-            # only use the BB for the AO system and the telescope since
-            # the Gemini observations already includes the atmosphere
-            bbspec[i] = sterrad*(bbtel[i]*Em_tel + bbaos[i]*Em_aos) 
-            #bbspec[i] = bbzod[i]*Em_Zod*sterrad
-        
-        
-        if ohsim:
-           # use the OH line simulator instead of loading the Gemini file
-           ohspec = sim_ohlines(wavelength/1e4, simdir = simdir)
-        
-           delt = 2.0 # convolve with a Gaussian of 2 pix fwhm
-        
-        
-           #psf = psf_gaussian(fwhm = delt, npixel = 4*fix(delt)+1, ndimen = 1, /normal)
-        
-           stddev = delt/2*sqrt(2*log(2))
-           psf_func = models.Gaussian1D(amplitude=1.0, stddev=stddev)
-           x = np.arange(4*int(delt)+1)-2*int(delt)
-           psf = psf_func(x)
-           psf /= psf.sum() # normaliza
-        
-           #ohspec = convol(ohspec, psf, /edge_truncate)
-           ohspec = np.convolve(ohspec, psf)
-        
+        ## wavelength in angstroms of the pixels of the complete spectrum
+        if filteronly:
+            wavelength = wave
         else:
-           # read in Gemini data
-           geminifile = os.path.expanduser(simdir+'skyspectra/mk_skybg_zm_16_15_ph.fits')
-        
-           #geminiSpec = readspec(geminifile, wave = backwave)*1e3
-        
-           ext = 0 
-           pf = fits.open(geminifile)
-           # load gemini file and convert from  ph/sec/arcsec^2/nm/m^2 to  ph/sec/arcsec^2/micron/m^2
-           geminiSpec = pf[ext].data*1e3
-           head = pf[ext].header
-           cdelt1 = head["cdelt1"]
-           crval1 = head["crval1"]
-        
-           nelem = geminiSpec.shape[0]
-           #print nelem
-        
-           backwave = (np.arange(nelem))*cdelt1 + crval1  # compute wavelength
-           backwave /= 1e4 # nm
-           geminiWave = backwave*10.0 # nm -> Angstroms
-        
-        
-        
-           delt = 2.0*(wavelength[1]-wavelength[0])/(geminiWave[1]-geminiWave[0])
-           if delt > 1:
-              #psf = psf_gaussian(fwhm = delt, npixel = 4*fix(delt)+1, ndimen = 1, /normal)
-        
-              stddev = delt/2*sqrt(2*log(2))
-              psf_func = models.Gaussian1D(amplitude=1.0, stddev=stddev)
-              x = np.arange(4*int(delt)+1)-2*int(delt)
-              psf = psf_func(x)
-              psf /= psf.sum() # normaliza
-        
-              geminiSpec = np.convolve(geminiSpec, psf,mode='same')
-        
-           #print geminiWave
-           #print wavelength
-           # interpolate Gemini data to that of IRIS
-           geminiOrig = geminiSpec
-           #geminiSpec = interpol(geminiSpec, geminiWave, wavelength)
-           #print geminiWave.shape
-           #print geminiSpec.shape
-           #print geminiWave[0:10]
-           #print geminiWave[-40:]
-           #print geminiSpec[0:40]
-           #print geminiSpec[-40:]
-           R_i = interpolate.interp1d(geminiWave,geminiSpec)
-           R_x = extrap1d(R_i)
-           geminiSpec = R_x(wavelength)
-        
-        
-        
-           # make sure that we have valid values beyond the edge of the Gemini
-           # spectrum
-           #bad = where((wavelength <= geminiWave[0]) or (geminiSpec <= 0.0), nbad)
-        
-           #if nbad > 0:
-           #   geminiSpec[bad] = np.median(geminiSpec[max(bad)+1:max(bad)+100]) # replace the uninterpolated points to the median of the next 100 points to get some sort of continuum
-        
-           # place gemini spectrum as the OH spectrum
-           ohspec = geminiSpec
+            wavelength = wi*(1.0+1.0/resolution)**np.arange(dxspectrum)
+
+        ohspec, contspec, bbspec = self.spectra(wavelength)
         
         ### Get information on the filter selection used 
         ### Using zeropoints only from broadband filters (for right now)
@@ -304,35 +328,17 @@ class background_specs3():
         
 
         
+        self.filteronly = filteronly
+        self.wi = wi
+        self.fullwaves = wavelength
+        self.fullback = np.array([ohspec, contspec, bbspec])
+
         ## normalize the spectra to mag/sq arcsec and get total flux for range of desired filter 
-        imin = int(ceil( log10(lambdamin/wi)/log10(1.0+1.0/(resolution)) ))
-        #pixel of spectrum corresponding to min
-        imax = int(floor( log10(lambdamax/wi)/log10(1.0+1.0/(resolution)) ))
-        #same for max
-        #print lambdamin,lambdamax
-        #print 'min wave',imin
-        #print 'max wave',imax
-        
         ## Define background spectra to region of desired filter
-        ohspec_filt = ohspec[imin:imax+1]
-        contspec_filt = contspec[imin:imax+1]
-        bbspec_filt = bbspec[imin:imax+1]
-        self.waves = wavelength[imin:imax+1] # (feeding plottiing of background)
-        
-        
         # convolve the OH lines to this resolution
-        if not noconvolve:
-           delt = 2.0*self.waves[1]/(resolution*(self.waves[1]-self.waves[0]))
-           #print, 'delt: ', delt
-           #psf = psf_gaussian(fwhm = delt, npixel = 4*fix(delt)+1, ndimen = 1, /normal)
-           stddev = delt/2*sqrt(2*log(2))
-           psf_func = models.Gaussian1D(amplitude=1.0, stddev=stddev)
-           x = np.arange(4*int(delt)+1)-2*int(delt)
-           psf = psf_func(x)
-           psf /= psf.sum() # normaliza
-           
-           #ohspec_filt = convol(ohspec_filt, psf, /edge_truncate)
-           ohspec_filt = np.convolve(ohspec_filt, psf, mode='same')
+        self.waves, self.backspecs = filter_band(wavelength, self.fullback, wi,
+                                                 resolution, lambdamin, lambdamax,
+                                                 noconvolve)
         
         # tot_oh = total(ohspec_filt)   #total integrated relative photon flux for OH spectrum
         # tot_cont = total(contspec_filt) #same for continuum spectrum
@@ -355,32 +361,8 @@ class background_specs3():
         # if keyword_set(nobbnorm) then bbspectrum = bbspec_filt else bbspectrum = (bbspec_filt/tot_bb) *  zp
         
         
-        # return the background in the specific filter
-        self.backspecs = np.zeros((3, ohspec_filt.shape[0]))
-        self.backspecs[0, :] = ohspec_filt
-        self.backspecs[1, :] = contspec_filt
-        self.backspecs[2, :] = bbspec_filt
-        
-        ## return the entire background array, scaled by the zero points for
-        ## the givien filter
-        #fullbb = (bbspec/tot_bb)*zp
-        
-        
-        
-        # don't normalize
-        if fullback or fulloh or fullcont or fullbb:
-           fullbb = bbspec
-           #print fullbb.shape
-        
-           fullcont = contspec
-           fulloh = ohspec
-        
-           self.fullwaves = wavelength
-        
-           self.fullback = np.zeros((3, fulloh.shape[0]))
-           self.fullback[0, :] = fulloh
-           self.fullback[1, :] = fullcont
-           self.fullback[2, :] = fullbb
+        ## return the entire background array (fullwaves, fullback), not
+        ## normalized
         
         ## write results
         #writefits,simdir+'info/tmt_oh_spectrum_m0_'+filter+'.fits',ohspectrum
@@ -389,6 +371,50 @@ class background_specs3():
         
         ## output for iris_sim.pro
 
+    def spectra(self, wavelength):
+        """
+        OH, continuum and thermal (telescope + AO) spectra on the grid
+        wavelength [Ang], photons s^-1 m^-2 um^-1 arcsecond^-2
+        """
+        sterrad = 2.35e-11 # sterradians per square arcsecond
+
+        ## Generate thermal Blackbodies (Tel, AO system)
+        ## photon s^-1 m^-2 um^-1 sr-1
+        bbtel = planck(wavelength, self.T_tel)	#telescope blackbody spectrum
+        bbaos = planck(wavelength, self.T_aos)	#AO blackbody spectrum
+
+        # only use the BB for the AO system and the telescope since
+        # the Gemini observations already includes the atmosphere
+        bbspec = sterrad*(bbtel*self.Em_tel + bbaos*self.Em_aos)	#TOTAL blackbody spectrum
+
+        contspec = np.zeros(len(wavelength))	#continuum of sky
+
+        if self.ohsim:
+           # use the OH line simulator instead of loading the Gemini file
+           # convolve with a Gaussian of 2 pix fwhm
+           ohspec = sim_ohlines(wavelength/1e4, simdir = self.simdir, lsf = lsf_kernel(2.0))
+        else:
+           # Gemini spectrum convolved to the pixels of the grid
+           ohspec = gemini_sky(wavelength, self.simdir)
+        return ohspec, contspec, bbspec
+
+    def band(self, filter, noconvolve=None):
+        """
+        Background spectra of filter, the same as with filteronly: on the
+        grid of the filter, with the Gemini spectrum convolved to its
+        pixels (read once, and convolved over the band only).
+        """
+        filterdat = get_filterdat(filter,self.simdir)
+        if noconvolve is None:
+            noconvolve = self.noconvolve
+        wi = float(filterdat["lambdamin"][0])
+        wf = float(filterdat["lambdamax"][0])
+        dxspectrum = int(ceil(log10(wf/wi)/log10(1.0+1.0/self.resolution) ) )
+        wavelength = np.linspace(wi,wf,dxspectrum)
+        waves, backspecs = filter_band(wavelength, self.spectra(wavelength), wi,
+                                       self.resolution, wi, wf, noconvolve)
+        return background_band(waves, backspecs)
+
 class background_specs2():
 
     def __init__(self, resolution, filter, T_tel=275, T_atm=258.0, T_aos=243.0,
@@ -500,21 +526,8 @@ class background_specs2():
         
         if ohsim:
            # use the OH line simulator instead of loading the Gemini file
-           ohspec = sim_ohlines(wavelength/1e4, simdir = simdir)
-        
-           delt = 2.0 # convolve with a Gaussian of 2 pix fwhm
-        
-        
-           #psf = psf_gaussian(fwhm = delt, npixel = 4*fix(delt)+1, ndimen = 1, /normal)
-        
-           stddev = delt/2*sqrt(2*log(2))
-           psf_func = models.Gaussian1D(amplitude=1.0, stddev=stddev)
-           x = np.arange(4*int(delt)+1)-2*int(delt)
-           psf = psf_func(x)
-           psf /= psf.sum() # normaliza
-        
-           #ohspec = convol(ohspec, psf, /edge_truncate)
-           ohspec = np.convolve(ohspec, psf)
+           # convolve with a Gaussian of 2 pix fwhm
+           ohspec = sim_ohlines(wavelength/1e4, simdir = simdir, lsf = lsf_kernel(2.0))
         
         else:
            # read in Gemini data
@@ -681,6 +694,73 @@ class background_specs2():
         
         ## output for iris_sim.pro
 
+def thermal_trade(resolution, filter, T, Em, component="aos", T_tel=275,
+                  T_aos=243.0, Em_tel=0.09, Em_aos=0.01,
+                  simdir='~/data/iris/sim/'):
+    """
+    Background in filter on a grid of temperatures T [K] and emissivities
+    Em of one thermal component, component = "aos" (NFIRAOS) or "tel"
+    (telescope), the other component being fixed.  The sky (OH and
+    continuum) spectrum is computed once, the thermal spectra in one
+    broadcast Planck evaluation.
+
+    Returns a dictionary of
+      waves       - wavelengths [Ang] (nwave)
+      thermal     - telescope + AO thermal background (nT, nEm, nwave)
+      background  - OH + continuum + thermal background (nT, nEm, nwave)
+                    [photons/s/m^2/um/arcsec^2]
+      mag_thermal - filter integrated thermal background (nT, nEm)
+      mag_total   - filter integrated total background (nT, nEm)
+                    [mag/arcsec^2]
+    """
+    sterrad = 2.35e-11 # sterradians per square arcsecond
+    T = np.atleast_1d(np.asarray(T, dtype=float))
+    Em = np.atleast_1d(np.asarray(Em, dtype=float))
+
+    bkgd = background_specs3(resolution, filter, T_tel=T_tel, T_aos=T_aos,
+                             Em_tel=Em_tel, Em_aos=Em_aos, simdir=simdir,
+                             filteronly=True)
+    waves = bkgd.waves
+    sky = bkgd.backspecs[0] + bkgd.backspecs[1]
+
+    if component == "aos":
+        fixed = sterrad*Em_tel*planck(waves, T_tel)
+    elif component == "tel":
+        fixed = sterrad*Em_aos*planck(waves, T_aos)
+    else:
+        raise ValueError("unknown thermal component %s" % component)
+    thermal = sterrad*Em[np.newaxis,:,np.newaxis]*planck(waves, T[:,np.newaxis])[:,np.newaxis,:]
+    thermal += fixed
+    background = thermal + sky
+
+    # integrate over the filter and scale by the zeropoint [phot/s/m^2]
+    zp = get_filterdat(filter,simdir)["zp"]
+    mag_thermal = -2.5*np.log10(np.trapz(thermal, waves/1e4, axis=-1)/zp)
+    mag_total = -2.5*np.log10(np.trapz(background, waves/1e4, axis=-1)/zp)
+
+    return {"waves": waves, "thermal": thermal, "background": background,
+            "mag_thermal": mag_thermal, "mag_total": mag_total}
+
+def test_thermal_trade(simdir='~/data/iris/sim/'):
+
+    resolution = 4000
+    filter = "Kbb"
+    T = np.arange(233.0, 283.0, 5.0)
+    Em = np.array([0.01, 0.02, 0.05, 0.09])
+    trade = thermal_trade(resolution*2.0, filter, T, Em, component="aos",
+                          simdir=simdir)
+
+    fig = plt.figure()
+    p = fig.add_subplot(111)
+    for j in xrange(len(Em)):
+        p.plot(T, trade["mag_total"][:,j], label="Em = %.2f" % Em[j])
+    p.invert_yaxis()
+    p.set_xlabel("NFIRAOS temperature (K)")
+    p.set_ylabel("Background (mag arcsec$^{-2}$)")
+    p.legend()
+
+    plt.show()
+
 def test_background_specs2(simdir='~/data/iris/sim/'):
 
     resolution = 4000
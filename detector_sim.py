@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+# Full detector imager frames
+#
+# The imager frame (4k x 4k by default) is simulated in tiles on a pool
+# of threads; the FFTs and random draws release the GIL.  Each tile is
+# rendered from the sources overlapping it, background, dark current
+# and read noise are added with a random stream of its own, and the
+# finished rows of tiles are streamed to a FITS file, so only one row
+# of float32 tiles is held in memory at a time.
+
+import os
+
+import numpy as np
+from multiprocessing.pool import ThreadPool
+
+from astropy.io import fits
+
+from field_sim import render_field
+from random_streams import spawn_rngs
+
+
+def simulate_tile(tile, rng, x, y, flux, psf, background, darkcurrent,
+                  readnoise, itime, nframes, gain):
+    """
+    Simulated tile [DN] for tile = (y0, y1, x0, x1) of the frame.
+    """
+    y0, y1, x0, x1 = tile
+    totaltime = itime*nframes
+
+    # sources whose PSF overlaps the tile
+    hy, hx = psf.shape[0]//2 + 1, psf.shape[1]//2 + 1
+    near = (x > x0 - hx) & (x < x1 + hx) & (y > y0 - hy) & (y < y1 + hy)
+
+    if near.any():
+        rate = render_field((y1-y0, x1-x0), psf, x[near]-x0, y[near]-y0,
+                            flux[near])
+        np.clip(rate, 0, None, out=rate)
+        rate += background + darkcurrent
+    else:
+        rate = np.empty((y1-y0, x1-x0))
+        rate.fill(background + darkcurrent)
+
+    # [electrons]
+    rate *= totaltime
+    tile_e = rng.poisson(lam=rate).astype(np.float32)
+    tile_e += rng.normal(0.0, readnoise*np.sqrt(nframes),
+                         size=tile_e.shape).astype(np.float32)
+    tile_e /= gain
+    return tile_e
+
+
+def simulate_detector(filename, x, y, flux, psf, background, darkcurrent,
+                      readnoise, itime, nframes, gain, shape=(4096, 4096),
+                      tile=1024, nthreads=None, seed=None, header=None):
+    """
+    Simulate a full imager frame [DN] and stream it to filename.
+
+    x, y        - source positions on the frame [pixels]
+    flux        - source fluxes through the telescope [photons/s]
+    psf         - normalized PSF image at the detector pixel scale
+    background  - background per pixel [photons/s]
+    darkcurrent - dark current [e-/s]
+    readnoise   - read noise per frame [e-]
+    tile        - tile size [pixels]
+    nthreads    - number of threads (default: number of cores)
+    seed        - seed of the per-tile random streams
+    header      - extra FITS header cards
+    """
+    ny, nx = shape
+    x = np.atleast_1d(np.asarray(x, dtype=float))
+    y = np.atleast_1d(np.asarray(y, dtype=float))
+    flux = np.atleast_1d(np.asarray(flux, dtype=float))
+    background = float(np.squeeze(background))
+
+    rows = [(y0, min(y0+tile, ny)) for y0 in range(0, ny, tile)]
+    cols = [(x0, min(x0+tile, nx)) for x0 in range(0, nx, tile)]
+    rngs = spawn_rngs(seed, len(rows)*len(cols))
+
+    hdr = fits.Header()
+    hdr["SIMPLE"] = True
+    hdr["BITPIX"] = -32
+    hdr["NAXIS"] = 2
+    hdr["NAXIS1"] = nx
+    hdr["NAXIS2"] = ny
+    hdr["BUNIT"] = "DN"
+    hdr["ITIME"] = (itime, "integration time per frame [s]")
+    hdr["NFRAMES"] = (nframes, "number of frames")
+    hdr["GAIN"] = (gain, "gain [e-/DN]")
+    hdr["NSOURCE"] = (len(flux), "number of simulated sources")
+    if seed is not None:
+        hdr["SEED"] = (seed, "seed of the per-tile random streams")
+    if header is not None:
+        hdr.extend(header)
+
+    if os.path.exists(filename):
+        os.remove(filename)
+    out = fits.StreamingHDU(filename, hdr)
+
+    pool = ThreadPool(nthreads)
+    try:
+        for i, (y0, y1) in enumerate(rows):
+            def work(j):
+                x0, x1 = cols[j]
+                return simulate_tile((y0, y1, x0, x1), rngs[i*len(cols)+j],
+                                     x, y, flux, psf, background, darkcurrent,
+                                     readnoise, itime, nframes, gain)
+            band = np.hstack(pool.map(work, range(len(cols))))
+            out.write(band)
+    finally:
+        pool.close()
+        pool.join()
+        out.close()
+
+    return filename
@@ -0,0 +1,455 @@
+#!/usr/bin/env python
+
+# Caches of IRIS_ETC
+#
+# Filter data, PSF planes, background spectra and source spectra only
+# depend on a few parameters and are reused between calculations in the
+# same process (batch mode).  memoize keeps the most recently used
+# results of a function in a thread-safe LRU dictionary.
+#
+# result_cache sits in front of IRIS_ETC itself: the results are kept in
+# memory (LRU) and in an SQLite file, keyed by the canonical parameters
+# of the calculation and a fingerprint of the data directories and
+# ancillary files, so that a change of config.ini or of the data files
+# invalidates the cached results.
+#
+# Both coalesce concurrent misses (single_flight): callers asking for a
+# key which is being computed wait for that computation instead of
+# repeating it, from threads or from asyncio coroutines (run_async).
+
+import hashlib, inspect, json, os, sqlite3, threading, time
+from collections import OrderedDict
+from functools import partial, wraps
+
+import numpy as np
+
+
+def freeze(value):
+    # hashable version of an argument (lists, arrays and dictionaries)
+    if isinstance(value, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    if hasattr(value, "tolist"):
+        return freeze(value.tolist())
+    return value
+
+
+class _call():
+    # computation in flight
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class single_flight():
+    """
+    Coalescing of concurrent calls with the same key: the first caller
+    computes the value, the callers arriving before it is done wait for
+    it and get the same value (or exception).  Nothing is kept once the
+    computation is over.  coalesced counts the calls which waited.
+    """
+
+    def __init__(self):
+        self.coalesced = 0
+        self._calls = {}
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        return self.do_shared(key, func, *args, **kwargs)[0]
+
+    def do_shared(self, key, func, *args, **kwargs):
+        # as do, the value and whether it was computed by another caller
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _call()
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = func(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def run_async(self, key, func, *args, **kwargs):
+        """
+        As do, for asyncio: returns an awaitable of the value, computed in
+        the default executor of the running loop.  The coroutines of the
+        loop asking for the same key share one executor job, which also
+        coalesces with the threads calling do.
+        """
+        import asyncio
+        loop = asyncio.get_event_loop()
+        with self._lock:
+            future = self._futures.get((loop, key))
+            if future is None:
+                future = loop.run_in_executor(None, partial(self.do, key, func,
+                                                            *args, **kwargs))
+                self._futures[(loop, key)] = future
+                future.add_done_callback(partial(self._finished, (loop, key)))
+            else:
+                self.coalesced += 1
+        # a cancelled caller does not cancel the others
+        return asyncio.shield(future)
+
+    def _finished(self, key, future):
+        with self._lock:
+            self._futures.pop(key, None)
+
+    def info(self):
+        return {"coalesced": self.coalesced, "in_flight": len(self._calls)}
+
+
+class memoize():
+    """
+    LRU cache decorator for functions of hashable (or freezable)
+    arguments.  The cached values are shared between the callers, who
+    must not modify them.  Concurrent misses of the same arguments are
+    computed once (single_flight).
+    """
+
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._flight = single_flight()
+
+    def _get(self, key):
+        # cached value and True, or None and False
+        with self._lock:
+            if key in self._cache:
+                self.hits += 1
+                value = self._cache.pop(key)
+                self._cache[key] = value
+                return value, True
+        return None, False
+
+    def _compute(self, key, func, args, kwargs):
+        # computed by the first caller of the key only
+        value, found = self._get(key)
+        if found:
+            return value
+        with self._lock:
+            self.misses += 1
+        value = func(*args, **kwargs)
+        with self._lock:
+            self._cache[key] = value
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return value
+
+    def __call__(self, func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (freeze(args), freeze(kwargs))
+            value, found = self._get(key)
+            if found:
+                return value
+            return self._flight.do(key, self._compute, key, func, args, kwargs)
+        wrapper.cache = self
+        return wrapper
+
+    def info(self):
+        return {"hits": self.hits, "misses": self.misses,
+                "coalesced": self._flight.coalesced,
+                "size": len(self._cache), "maxsize": self.maxsize}
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+# parameters which write files or plots, the calculation is not cached
+_outputs = ["png_output", "csv_output", "product_output", "detector_output",
+            "stack_output", "catalog"]
+
+# ancillary data read by IRIS_ETC, relative to simdir
+_data_dirs = ["info", "model_spectra", "skyspectra"]
+
+_hashes = {}
+
+
+def file_hash(path):
+    # content hash, recomputed only when the size or time stamp change
+    st = os.stat(path)
+    stamp = (st.st_size, st.st_mtime)
+    if _hashes.get(path, (None,))[0] != stamp:
+        sha = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha.update(block)
+        _hashes[path] = (stamp, sha.hexdigest())
+    return _hashes[path][1]
+
+
+def walk_files(top):
+    # files below top, in a reproducible order
+    files = []
+    for root, dirs, names in os.walk(top):
+        dirs.sort()
+        files += [os.path.join(root, n) for n in sorted(names)]
+    return files
+
+
+def data_fingerprint(simdir, psfdir):
+    """
+    Hash of the data directories, of the content of the ancillary files
+    (filters, model spectra, sky spectra) and of the size and time stamp
+    of the PSF files (FITS files and packed library, too large to be
+    read at every check).
+    """
+    simdir = os.path.expanduser(simdir)
+    psfdir = os.path.expanduser(psfdir)
+
+    sha = hashlib.sha1()
+    sha.update(("%s\n%s\n" % (simdir, psfdir)).encode("utf-8"))
+    for d in _data_dirs:
+        for path in walk_files(os.path.join(simdir, d)):
+            sha.update(("%s %s\n" % (path, file_hash(path))).encode("utf-8"))
+    for path in walk_files(os.path.join(psfdir, "psfs")):
+        st = os.stat(path)
+        sha.update(("%s %i %r\n" % (path, st.st_size, st.st_mtime)).encode("utf-8"))
+    return sha.hexdigest()
+
+
+def _round(value, digits=10):
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, float):
+        return float("%.*g" % (digits, value))
+    if isinstance(value, (list, tuple)):
+        return tuple(_round(v, digits) for v in value)
+    if hasattr(value, "tolist"):
+        return _round(value.tolist(), digits)
+    return value
+
+
+_filter_names = {}
+
+
+def filter_names(simdir):
+    # names of the filters in filter_info.dat
+    if simdir not in _filter_names:
+        filterfile = os.path.expanduser(simdir + "info/filter_info.dat")
+        try:
+            names = np.genfromtxt(filterfile, dtype=str, usecols=0)
+        except (IOError, OSError):
+            names = []
+        _filter_names[simdir] = [str(n) for n in np.atleast_1d(names)]
+    return _filter_names[simdir]
+
+
+def canonical_params(params, defaults, simdir):
+    """
+    Canonical form of the IRIS_ETC parameters: defaults filled in, mode,
+    filter and spectrum names in their canonical case, the content hash
+    of a user spectrum file, floats rounded to 10 significant digits, and
+    the flux density dropped when the magnitude is given.
+    """
+    out = dict(defaults)
+    out.update(params)
+    for key in ["simdir", "psfdir", "verb", "rng", "figures"]:
+        out.pop(key, None)
+
+    out["mode"] = "imager" if out["mode"].lower() == "imager" else "IFS"
+    for name in filter_names(simdir):
+        if name.lower() == str(out["filter"]).lower():
+            out["filter"] = name
+    spectrum = str(out["spectrum"])
+    if spectrum.lower() in ("vega", "flat", "emission"):
+        out["spectrum"] = spectrum.capitalize()
+    elif os.path.isfile(os.path.expanduser(spectrum)):
+        # user spectrum, identified by its content
+        out["spectrum_hash"] = file_hash(os.path.expanduser(spectrum))
+    if out["mag"] is not None:
+        out["flambda"] = None
+
+    return OrderedDict((k, _round(out[k])) for k in sorted(out))
+
+
+class result_cache():
+    """
+    Cache of IRIS_ETC results.
+
+    func     - IRIS_ETC
+    simdir, psfdir - data directories (config.ini)
+    path     - SQLite file of the persistent cache, None: memory only
+    maxsize  - number of results kept in memory
+    recheck  - interval [s] between checks of the data fingerprint
+
+    Calling the cache with the IRIS_ETC keywords returns the result of a
+    previous identical calculation or calls func.  Calculations writing
+    files or plots, and random calculations without a seed or with their
+    own generator, are not cached.  hits, disk_hits and misses count the
+    lookups, coalesced the calls which waited for an identical calculation
+    in flight.
+
+    run_async is the asyncio version of the call.
+    """
+
+    def __init__(self, func, simdir, psfdir, path=None, maxsize=256,
+                 recheck=1.0):
+        self.func = func
+        self.simdir = simdir
+        self.psfdir = psfdir
+        self.path = path
+        self.maxsize = maxsize
+        self.recheck = recheck
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.uncached = 0
+
+        try:
+            spec = inspect.getfullargspec(func)
+        except AttributeError:
+            spec = inspect.getargspec(func)   # Python 2.7
+        self.defaults = dict(zip(spec.args[-len(spec.defaults):], spec.defaults))
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._flight = single_flight()
+        self._async_flight = single_flight()
+        self._checked = 0.
+        self.fingerprint = None
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS results "
+                             "(key TEXT PRIMARY KEY, fingerprint TEXT, "
+                             "result TEXT, created REAL)")
+            self._db.commit()
+        self._check()
+
+    def _check(self):
+        # drop the cached results if the data have changed, the data
+        # directories are walked without holding the lock
+        with self._lock:
+            now = time.time()
+            if now - self._checked < self.recheck:
+                return
+            self._checked = now
+        fingerprint = data_fingerprint(self.simdir, self.psfdir)
+        with self._lock:
+            if fingerprint != self.fingerprint:
+                self.fingerprint = fingerprint
+                self._memory.clear()
+                if self._db is not None:
+                    self._db.execute("DELETE FROM results WHERE fingerprint != ?",
+                                     (fingerprint,))
+                    self._db.commit()
+
+    def cacheable(self, params):
+        if any(params.get(key) for key in _outputs):
+            return False
+        if params.get("verb", 1) > 1:
+            return False
+        if params.get("figures") is not None or params.get("rng") is not None:
+            return False
+        random = params.get("nmc") or params.get("framestack")
+        return not random or params.get("seed") is not None
+
+    def key(self, canonical):
+        text = json.dumps(canonical) + self.fingerprint
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def __call__(self, **params):
+        return self.lookup(**params)[0]
+
+    def lookup(self, **params):
+        """
+        As the call, returns the result and whether it was answered
+        without running the calculation (cached, or computed by an
+        identical call in flight).
+        """
+        verb = params.get("verb", 1)
+        if not self.cacheable(params):
+            with self._lock:
+                self.uncached += 1
+            return self.func(simdir=self.simdir, psfdir=self.psfdir, **params), False
+
+        canonical = canonical_params(params, self.defaults, self.simdir)
+        self._check()
+        with self._lock:
+            key = self.key(canonical)
+        (result, hit), shared = self._flight.do_shared(key, self._lookup, key,
+                                                       canonical, verb)
+        return OrderedDict(result), hit or shared
+
+    def run_async(self, **params):
+        """
+        Awaitable of the result, computed in the default executor of the
+        running asyncio loop; identical calculations in flight are shared
+        with the other coroutines and threads.
+        """
+        if not self.cacheable(params):
+            return self._async_flight.run_async(object(), partial(self, **params))
+        canonical = canonical_params(params, self.defaults, self.simdir)
+        self._check()
+        with self._lock:
+            key = self.key(canonical)
+        return self._async_flight.run_async(key, partial(self, **params))
+
+    def _lookup(self, key, canonical, verb):
+        # cached result, or calculation (one caller of the key at a time)
+        with self._lock:
+            result = self._memory.pop(key, None)
+            if result is not None:
+                self.hits += 1
+                self._memory[key] = result
+            elif self._db is not None:
+                row = self._db.execute("SELECT result FROM results WHERE key = ?",
+                                       (key,)).fetchone()
+                if row is not None:
+                    self.disk_hits += 1
+                    result = json.loads(row[0], object_pairs_hook=OrderedDict)
+                    self._store(key, result, disk=False)
+            if result is None:
+                self.misses += 1
+        if result is not None:
+            return result, True
+
+        params = dict((k, v) for k, v in canonical.items() if k in self.defaults)
+        params["verb"] = verb
+        result = self.func(simdir=self.simdir, psfdir=self.psfdir, **params)
+        with self._lock:
+            self._store(key, OrderedDict(result))
+        return result, False
+
+    def _store(self, key, result, disk=True):
+        self._memory[key] = result
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+        if disk and self._db is not None:
+            self._db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                             (key, self.fingerprint, json.dumps(result), time.time()))
+            self._db.commit()
+
+    def info(self):
+        return {"hits": self.hits, "disk_hits": self.disk_hits,
+                "misses": self.misses, "uncached": self.uncached,
+                "coalesced": self._flight.coalesced + self._async_flight.coalesced,
+                "size": len(self._memory)}
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
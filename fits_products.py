@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+# Multi-extension FITS product writer
+#
+# Collects the arrays produced by IRIS_ETC (cubes, S/N maps, simulated
+# images) into a single multi-extension FITS file: a primary header with
+# the provenance of the calculation followed by one (optionally tile
+# compressed, losslessly) float32 extension per product.  The extensions are
+# written by a background thread as soon as they are added, so that the
+# writing overlaps with the rest of the calculation.
+
+import os
+import time
+import threading
+try:
+    import Queue as queue   # Python 2.7
+except ImportError:
+    import queue
+
+import numpy as np
+from astropy.io import fits
+
+
+class product_writer():
+
+    def __init__(self, filename, header=None, compress=False):
+        """
+        filename - output FITS file (overwritten)
+        header   - provenance cards for the primary header, list of
+                   (keyword, value, comment) or a dictionary
+        compress - tile compress the extensions, losslessly (GZIP_2
+                   without quantization of the float32 values)
+        """
+        self.filename = filename
+        self.compress = compress
+        self.names = []
+        self.error = None
+        self._aborted = False
+        self._queue = queue.Queue()
+
+        primary = fits.PrimaryHDU()
+        primary.header["DATE"] = (time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime()),
+                                  "file creation date (UTC)")
+        primary.header["ORIGIN"] = ("IRIS_snr_sim", "TMT IRIS ETC")
+        if isinstance(header, dict):
+            header = [(key, header[key]) for key in header]
+        for card in header or []:
+            primary.header[card[0]] = tuple(card[1:]) if len(card) > 2 else card[1]
+
+        self._thread = threading.Thread(target=self._run, args=(primary,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def add(self, name, data, unit=None, comment=None):
+        """
+        Queue data as extension name.  The array must not be modified
+        afterwards, it is converted and written in the background.
+        """
+        if name in self.names:
+            raise ValueError("product %s already written" % name)
+        self.names.append(name)
+        self._queue.put((name, data, unit, comment))
+
+    def close(self):
+        """
+        Wait until every product has been written.
+        """
+        self._queue.put(None)
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.filename
+
+    def abort(self):
+        """
+        Stop writing, the queued products are discarded and the partial
+        file is removed.
+        """
+        self._aborted = True
+        self._queue.put(None)
+        self._thread.join()
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+    def _run(self, primary):
+        try:
+            if os.path.exists(self.filename):
+                os.remove(self.filename)
+            primary.writeto(self.filename)
+            while True:
+                item = self._queue.get()
+                if item is None or self._aborted:
+                    break
+                name, data, unit, comment = item
+                data = np.asarray(data, dtype=np.float32)
+                if self.compress:
+                    hdu = fits.CompImageHDU(data, name=name,
+                                            compression_type="GZIP_2",
+                                            quantize_level=0.0)
+                else:
+                    hdu = fits.ImageHDU(data, name=name)
+                if unit is not None:
+                    hdu.header["BUNIT"] = unit
+                if comment is not None:
+                    hdu.header["COMMENT"] = comment
+                with fits.open(self.filename, mode="append") as hdul:
+                    hdul.append(hdu)
+        except Exception as e:
+            self.error = e
+            # keep consuming so that close() does not block
+            while self._queue.get() is not None:
+                pass
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+# Frame stack simulation
+#
+# Instead of folding nframes analytically into sqrt(itime*nframes), the
+# individual exposures of a stack are generated one at a time, each
+# with its own Poisson and read noise, streamed to disk, and folded into
+# running co-add statistics: mean and variance (Welford), and the same
+# after online sigma clipping.  The clipping is against a fixed
+# reference, the expected noise model of the frames if known (else the
+# unclipped running statistics), never against the clipped statistics
+# themselves, which would shrink with every rejection; the clipped
+# variance is corrected for the truncation of the distribution.
+# Memory stays at a few frames whatever the number of frames.
+
+import os
+
+import numpy as np
+from scipy.special import erf
+from astropy.io import fits
+
+
+def generate_frames(rate, itime, nframes, readnoise, rng=None):
+    """
+    Yield nframes simulated exposures [electrons].
+
+    rate      - expected count rate per pixel, source + background +
+                dark current [e-/s], image or cube
+    itime     - integration time per frame [s]
+    readnoise - read noise per frame [e-]
+    """
+    if rng is None:
+        rng = np.random.RandomState()
+    lam = rate*itime
+    for i in range(nframes):
+        frame = rng.poisson(lam=lam).astype("float64")
+        frame += rng.normal(0.0, readnoise, size=frame.shape)
+        yield frame
+
+
+def frame_model(rate, itime, readnoise):
+    # expected mean and standard deviation of the frames of generate_frames
+    lam = rate*itime
+    return lam, np.sqrt(lam + readnoise**2)
+
+
+def truncated_var(nsigma):
+    # variance of a unit normal truncated at +-nsigma
+    inside = erf(nsigma/np.sqrt(2.0))
+    return 1.0 - 2.0*nsigma*np.exp(-0.5*nsigma**2)/np.sqrt(2.0*np.pi)/inside
+
+
+class stack_stats():
+    """
+    Online co-add statistics of a stack of frames.  Pixels deviating by
+    more than nsigma from the reference are rejected from the clipped
+    statistics: the expected mean and standard deviation of the frames
+    model = (mean, std) if given, else the unclipped running statistics
+    once nwarm frames have been accumulated.
+    """
+
+    def __init__(self, nsigma=3.0, nwarm=20, model=None):
+        self.nsigma = nsigma
+        self.nwarm = nwarm
+        self.model = model
+        self.n = 0
+
+    def add(self, frame):
+        if self.n == 0:
+            self.mean = np.zeros(frame.shape)
+            self.m2 = np.zeros(frame.shape)
+            self.nclip = np.zeros(frame.shape, dtype=int)
+            self.mean_clip = np.zeros(frame.shape)
+            self.m2_clip = np.zeros(frame.shape)
+        self.n += 1
+
+        if self.model is not None:
+            mean, std = self.model
+            keep = np.abs(frame - mean) <= self.nsigma*std
+        elif self.n > self.nwarm:
+            keep = np.abs(frame - self.mean) <= self.nsigma*np.sqrt(self.var())
+        else:
+            keep = np.ones(frame.shape, dtype=bool)
+
+        delta = frame - self.mean
+        self.mean += delta/self.n
+        self.m2 += delta*(frame - self.mean)
+
+        self.nclip += keep
+        delta = np.where(keep, frame - self.mean_clip, 0.)
+        self.mean_clip += delta/np.maximum(self.nclip, 1)
+        self.m2_clip += delta*np.where(keep, frame - self.mean_clip, 0.)
+
+    def var(self):
+        return self.m2/max(self.n - 1, 1)
+
+    def var_clip(self):
+        # corrected for the truncation at nsigma of the clipped frames
+        var = self.m2_clip/np.maximum(self.nclip - 1, 1)
+        if self.model is None and self.n <= self.nwarm:
+            return var
+        return var/truncated_var(self.nsigma)
+
+    def nrejected(self):
+        return self.n*self.nclip.size - self.nclip.sum()
+
+
+def stack_frames(frames, nframes, filename=None, nsigma=3.0, header=None,
+                 model=None):
+    """
+    Accumulate the co-add statistics of the frames coming from the
+    generator frames, streaming each frame to filename (a cube of
+    nframes planes) if given.  The co-add mean, standard deviation and
+    their clipped versions are appended as extensions.  model is the
+    expected (mean, std) of the frames, the reference of the clipping
+    (see frame_model).
+    """
+    stats = stack_stats(nsigma=nsigma, model=model)
+    out = None
+    for frame in frames:
+        if filename is not None and out is None:
+            hdr = fits.Header()
+            hdr["SIMPLE"] = True
+            hdr["BITPIX"] = -32
+            hdr["NAXIS"] = frame.ndim + 1
+            for i, n in enumerate(frame.shape[::-1]):
+                hdr["NAXIS%i" % (i+1)] = n
+            hdr["NAXIS%i" % (frame.ndim+1)] = nframes
+            hdr["BUNIT"] = "electrons"
+            if header is not None:
+                hdr.extend(header)
+            if os.path.exists(filename):
+                os.remove(filename)
+            out = fits.StreamingHDU(filename, hdr)
+        if out is not None:
+            out.write(frame.astype(np.float32))
+        stats.add(frame)
+    if out is not None:
+        out.close()
+        for name, data in [("MEAN", stats.mean),
+                           ("STD", np.sqrt(stats.var())),
+                           ("MEAN_CLIP", stats.mean_clip),
+                           ("STD_CLIP", np.sqrt(stats.var_clip()))]:
+            hdr = fits.Header()
+            hdr["EXTNAME"] = name
+            fits.append(filename, data.astype(np.float32), hdr)
+    return stats
+
+
+def stack_snr(stats, sky, apermask):
+    """
+    S/N of the co-added source in the aperture from the stack statistics:
+    sky-subtracted sum of the mean frame over the standard error of the
+    mean.  sky is the expected sky per pixel and frame [electrons],
+    scalar or one value per channel for a cube.
+    """
+    apermask = np.asarray(apermask, dtype=bool)
+    sky = np.asarray(sky, dtype=float)*apermask.sum()
+    signal = stats.mean[..., apermask].sum(axis=-1) - sky
+    noise = np.sqrt(stats.var()[..., apermask].sum(axis=-1)/stats.n)
+    signal_clip = stats.mean_clip[..., apermask].sum(axis=-1) - sky
+    noise_clip = np.sqrt((stats.var_clip()/np.maximum(stats.nclip, 1))[..., apermask].sum(axis=-1))
+    return (np.sum(signal)/np.sqrt(np.sum(noise**2)),
+            np.sum(signal_clip)/np.sqrt(np.sum(noise_clip**2)))
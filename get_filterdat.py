@@ -2,6 +2,20 @@
 import os
 import numpy as np
 
+from etc_cache import memoize
+
+c = 2.9979E10       # cm/s
+Ang = 1E-8          # cm
+
+# convert AB to Vega and vice versa
+         # band  eff     mAB - mVega
+ABconv = [["i",  0.7472, 0.37 ],
+          ["z",  0.8917, 0.54 ],
+          ["Y",  1.0305, 0.634],
+          ["J",  1.2355, 0.91 ],
+          ["H",  1.6458, 1.39 ],
+          ["Ks", 2.1603, 1.85 ]]
+
 def get_filterdat(filter,simdir='~/iris/sensitivity/'):
     filterfile = os.path.expanduser(simdir + "info/filter_info.dat")
 
@@ -15,3 +29,70 @@ def get_filterdat(filter,simdir='~/iris/sensitivity/'):
     
     return filterdat
 
+def ab_vega(wave):
+    """
+    mAB - mVega at the wavelengths wave [microns], linear interpolation
+    of ABconv, extrapolated linearly beyond the table.
+    """
+    ABwave  = np.array([i[1] for i in ABconv])
+    ABdelta = np.array([i[2] for i in ABconv])
+    wave = np.asarray(wave, dtype=float)
+    delta = np.interp(wave, ABwave, ABdelta)
+    lo = ABdelta[0]+(wave-ABwave[0])*(ABdelta[1]-ABdelta[0])/(ABwave[1]-ABwave[0])
+    hi = ABdelta[-1]+(wave-ABwave[-1])*(ABdelta[-1]-ABdelta[-2])/(ABwave[-1]-ABwave[-2])
+    return np.where(wave < ABwave[0], lo, np.where(wave > ABwave[-1], hi, delta))
+
+@memoize(maxsize=8)
+def photometry_table(simdir='~/iris/sensitivity/'):
+    """
+    Photometric calibration of all the filters of filter_info.dat,
+    computed once per data directory:
+      filter   - filter names
+      index    - position of every filter name in the table
+      lambdac  - central wavelength [Ang]
+      zp       - photons/s/m^2 of a Vega magnitude 0 source
+      abvega   - mAB - mVega
+      flambda0 - flux density of a Vega magnitude 0 source [erg/s/cm^2/Ang]
+    """
+    filterfile = os.path.expanduser(simdir + "info/filter_info.dat")
+    filterall = np.genfromtxt(filterfile,dtype=None,
+                   names = ["filterread", "lambdamin", "lambdamax", "lambdac",
+                            "bw", "backmag", "imagmag", "zp", "zpphot",
+                            "psfname", "psfsamp", "psfsize", "filterfiles"])
+    filterall = np.atleast_1d(filterall)
+    names = [n.decode() if isinstance(n, bytes) else str(n)
+             for n in filterall["filterread"]]
+    lambdac = np.array(filterall["lambdac"], dtype=float)
+    abvega = ab_vega(lambdac/1e4)
+    fnu = 10**(-0.4*(abvega + 48.60))                 # erg/s/cm^2/Hz
+    table = {"filter": names,
+             "index": dict((n, i) for i, n in enumerate(names)),
+             "lambdac": lambdac,
+             "zp": np.array(filterall["zp"], dtype=float),
+             "abvega": abvega,
+             "flambda0": fnu*Ang/((lambdac*Ang)**2/c)}
+    for key in ["lambdac", "zp", "abvega", "flambda0"]:
+        table[key].flags.writeable = False
+    return table
+
+def _lookup(filter, simdir, key):
+    # table values of the filter names (array of names allowed)
+    table = photometry_table(simdir)
+    index = table["index"]
+    if isinstance(filter, str):
+        return table[key][index[filter]]
+    filter = np.asarray(filter)
+    i = np.array([index[f] for f in filter.ravel()], dtype=int)
+    return table[key][i].reshape(filter.shape)
+
+def mag_to_flambda(mag, filter, simdir='~/iris/sensitivity/'):
+    # Vega magnitude -> flux density [erg/s/cm^2/Ang], arrays broadcast
+    return _lookup(filter, simdir, "flambda0")*10**(-0.4*np.asarray(mag, dtype=float))
+
+def flambda_to_mag(flambda, filter, simdir='~/iris/sensitivity/'):
+    # flux density [erg/s/cm^2/Ang] -> Vega magnitude, arrays broadcast
+    return -2.5*np.log10(np.asarray(flambda, dtype=float)/_lookup(filter, simdir, "flambda0"))
+
+def mag_to_photons(mag, filter, simdir='~/iris/sensitivity/'):
+    # Vega magnitude -> photons/s/m^2, arrays broadcast
+    return _lookup(filter, simdir, "zp")*10**(-0.4*np.asarray(mag, dtype=float))
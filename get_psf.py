@@ -1,25 +1,47 @@
 
+import os
 import numpy as np
 
-def get_psf(za,cond,mode,time,psf_loc,scale): 
+def psf_grid(mode):
+    # grid of the simulated PSF library for a given instrument mode
 
-    x,y = psf_loc
-
-    za_arr = [ 0, 30, 45] # zenith angle [degrees]
-    cond_arr = [25, 50, 75] # observing conditions
-    time_arr = [1.4, 300] # integration time [seconds]
+    grid = {}
+    grid["za"] = [ 0, 30, 45] # zenith angle [degrees]
+    grid["cond"] = [25, 50, 75] # observing conditions
+    grid["time"] = [1.4, 300] # integration time [seconds]
 
     if mode.lower() == "ifs":
-        scale_arr = [2, 4, 9, 25, 50] # plate scale [mas]
-        x_arr = y_arr = [0] # position on focal plane [arcsec]
-        ins = "ifu"
+        grid["scale"] = [2, 4, 9, 25, 50] # plate scale [mas]
+        grid["x"] = grid["y"] = [0] # position on focal plane [arcsec]
+        grid["ins"] = "ifu"
+        grid["wvl"] = [840, 928, 1026, 988, 1092, 1206, 1149, 1270, 1403, 1474,
+                       1629, 1810, 1975, 2182, 2412] # extension wavelengths [nm]
 
 
     elif mode.lower() == "imager":
-        scale_arr = [2] # plate scale [mas]
-        x_arr = y_arr = [0.6, 4.7, 8.8, 12.9, 17] # position on focal plane [arcsec]
-        ins = "im"
+        grid["scale"] = [2] # plate scale [mas]
+        grid["x"] = grid["y"] = [0.6, 4.7, 8.8, 12.9, 17] # position on focal plane [arcsec]
+        grid["ins"] = "im"
+        grid["wvl"] = [830, 876, 925, 970, 1019, 1070, 1166, 1245, 1330, 1485,
+                       1626, 1781, 2000, 2191, 2400] # extension wavelengths [nm]
+
+    return grid
+
+def psf_filename(za_s,cond_s,ins,time_s,x_s,y_s,scale_s):
+    return "za%i_%ip_%s_%ss/evlpsfcl_1_x%s_y%s_%imas.fits" % (za_s,cond_s,ins,time_s,x_s,y_s,scale_s)
+
+def get_psf(za,cond,mode,time,psf_loc,scale):
+
+    x,y = psf_loc
 
+    grid = psf_grid(mode)
+    za_arr = grid["za"]
+    cond_arr = grid["cond"]
+    time_arr = grid["time"]
+    scale_arr = grid["scale"]
+    x_arr = grid["x"]
+    y_arr = grid["y"]
+    ins = grid["ins"]
 
     # select the closest file, in case the user guesses wrong
     za_ind = np.argmin(np.abs(np.array(za_arr) - za))
@@ -36,7 +58,41 @@ def get_psf(za,cond,mode,time,psf_loc,scale):
     x_s = x_arr[x_ind]
     y_s = y_arr[y_ind]
 
-    return "za%i_%ip_%s_%ss/evlpsfcl_1_x%s_y%s_%imas.fits" % (za_s,cond_s,ins,time_s,x_s,y_s,scale_s)
+    return psf_filename(za_s,cond_s,ins,time_s,x_s,y_s,scale_s)
+
+def psf_wvl_weights(wvl, psf_wvls):
+    """
+    Linear interpolation in wavelength between the PSF extensions.
+
+    Returns, for every wavelength in wvl [nm], the extensions bracketing
+    it (lo, hi) and the weight of the hi extension.  The extensions are
+    not stored in wavelength order, and wavelengths outside the
+    tabulated range use the nearest extension.
+    """
+    order = np.argsort(psf_wvls)
+    wvls = np.asarray(psf_wvls, dtype=float)[order]
+
+    wvl = np.clip(np.asarray(wvl, dtype=float), wvls[0], wvls[-1])
+    j = np.clip(np.searchsorted(wvls, wvl, side='right') - 1, 0, len(wvls) - 2)
+    whi = (wvl - wvls[j])/(wvls[j+1] - wvls[j])
+
+    return order[j], order[j+1], whi
+
+def read_psf(psfdir, psf_file, ext=0):
+    """
+    Return a single PSF plane (extension ext of psf_file, relative to
+    psfdir/psfs/).  The packed PSF library (see psf_library.py) is used
+    when present and contains the file, otherwise the FITS file is read.
+    Planes coming from the library are read-only memory maps.
+    """
+    from psf_library import open_psf_library
+
+    lib = open_psf_library(psfdir)
+    if lib is not None and psf_file in lib:
+        return lib.plane(psf_file, ext)
+
+    from astropy.io import fits
+    return fits.getdata(os.path.expanduser(psfdir + "/psfs/" + psf_file), ext)
 
 #print get_psf(30,75,"ifu",1.4,0,0,50)
 #print get_psf(45,25,"im",300,0.6,0.6,2)
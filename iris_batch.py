@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+# Batch mode of the IRIS ETC
+#
+# Evaluates a file of queries in a single process (or a pool of worker
+# processes) instead of one iris_snr_sim.py process per query, so that
+# the filter data, PSFs, background and source spectra are read and
+# computed once and shared between the queries (see load_* in
+# iris_snr_sim.py).
+#
+# The queries are the rows of a CSV file with a header, or the lines of
+# a JSONL file with one JSON object per line.  The keys are the command
+# line options of iris_snr_sim.py without the leading dash, e.g.
+#
+#   mode,calc,filter,mag,itime,nframes
+#   imager,snr,K,20.0,10,2
+#   IFS,exptime,H,21.5,900,,
+#
+#   {"mode": "IFS", "calc": "snr", "mag": 20, "psf-loc": [0.6, 12.0]}
+#
+# Empty values take the defaults.  One JSON line is written per query, in
+# the order of the input, with the result of IRIS_ETC or the error.
+# Repeated queries are answered from the result cache (etc_cache), kept
+# in memory and, with -cache, in an SQLite file shared between runs.
+#
+# With -nthreads the queries run on a pool of threads of a single warm
+# process instead, sharing the cached data between all the threads.
+#
+# Usage:
+#   iris_batch.py queries.csv -o results.jsonl -nproc 8 -cache etc_cache.sqlite
+#   iris_batch.py queries.csv -o results.jsonl -nthreads 16
+
+import argparse, csv, json, sys, threading
+from collections import OrderedDict
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+
+from iris_snr_sim import IRIS_ETC, etc_parser, etc_kwargs, parse_etc_args, read_config
+from etc_cache import result_cache
+
+
+class query_parser(argparse.ArgumentParser):
+    # report invalid queries as errors instead of exiting
+    def error(self, message):
+        raise ValueError(message)
+
+
+_parser = etc_parser(query_parser)
+
+# result caches of the process, by (simdir, psfdir, cache file)
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(simdir, psfdir, path=None):
+    key = (simdir, psfdir, path)
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = result_cache(IRIS_ETC, simdir, psfdir, path=path)
+        return _caches[key]
+
+
+def read_queries(filename):
+    """
+    List of queries (dictionaries) from a CSV or JSONL file.
+    """
+    with open(filename) as f:
+        if filename.lower().endswith((".jsonl", ".json")):
+            return [json.loads(line, object_pairs_hook=OrderedDict)
+                    for line in f if line.strip()]
+        return [OrderedDict((k.strip(), v.strip()) for k, v in row.items()
+                            if k is not None and v is not None and v.strip() != "")
+                for row in csv.DictReader(f)]
+
+
+def query_argv(query):
+    """
+    Command line options of iris_snr_sim.py for a query.
+    """
+    options = _parser._option_string_actions
+    argv = []
+    for key, value in query.items():
+        option = "-" + key.lstrip("-")
+        if option not in options:
+            option = option.replace("_", "-")
+        if option not in options:
+            raise ValueError("unknown option %s" % key)
+        if value is None or value is False or value == "":
+            continue
+        if options[option].nargs == 0:
+            # flags, true or false in a CSV file
+            if value is True or str(value).lower() in ("1", "true", "yes", "y"):
+                argv.append(option)
+        elif isinstance(value, (list, tuple)):
+            argv += [option] + [str(v) for v in value]
+        else:
+            argv += [option] + str(value).split()
+    return argv
+
+
+def run_query(args):
+    """
+    Result of one query, {"row", "query", "result", "cached"} or
+    {"row", "query", "error"}.
+    """
+    row, query, simdir, psfdir, cache_file = args
+    out = OrderedDict([("row", row), ("query", query)])
+    try:
+        kwargs = etc_kwargs(parse_etc_args(_parser, query_argv(query)))
+        cache = get_cache(simdir, psfdir, cache_file)
+        out["result"], out["cached"] = cache.lookup(verb=0, **kwargs)
+    except Exception as e:
+        out["error"] = "%s: %s" % (type(e).__name__, e)
+    return out
+
+
+def run_batch(queries, output, simdir, psfdir, nproc=1, chunksize=8,
+              cache_file=None, nthreads=None):
+    """
+    Evaluate the queries and write the results to output (file object),
+    one JSON line per query in the order of the queries.  nproc > 1
+    spreads the queries over worker processes, each with its own caches,
+    nthreads > 1 over threads of this process, sharing the caches.
+
+    Returns the number of failed queries and of queries answered from
+    the result cache.
+    """
+    tasks = [(i, q, simdir, psfdir, cache_file) for i, q in enumerate(queries)]
+    if nthreads and nthreads > 1:
+        pool = ThreadPool(nthreads)
+        results = pool.imap(run_query, tasks, chunksize)
+    elif nproc == 1:
+        pool = None
+        results = (run_query(t) for t in tasks)
+    else:
+        pool = Pool(nproc)
+        results = pool.imap(run_query, tasks, chunksize)
+
+    nerror = 0
+    ncached = 0
+    try:
+        for out in results:
+            nerror += "error" in out
+            ncached += out.get("cached", False)
+            output.write(json.dumps(out) + "\n")
+            output.flush()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return nerror, ncached
+
+
+def main():
+    parser = argparse.ArgumentParser(description='TMT IRIS S/N exposure calculator, batch mode')
+    parser.add_argument('queries', help='CSV or JSONL file of queries')
+    parser.add_argument('-o', metavar='value', default=None,
+                        help='JSONL output file, else standard output')
+    parser.add_argument('-nproc', metavar='value', type=int, default=1,
+                        help='number of processes (0: number of cores)')
+    parser.add_argument('-nthreads', metavar='value', type=int, default=None,
+                        help='number of threads of a single process (instead of -nproc)')
+    parser.add_argument('-cache', metavar='value', default=None,
+                        help='SQLite file of cached results')
+    parser.add_argument('-config', metavar='value', default='config.ini',
+                        help='configuration file of the data directories (default: config.ini)')
+    args = parser.parse_args()
+
+    try:
+        simdir, psfdir = read_config(args.config)
+    except (IOError, ValueError) as e:
+        sys.exit(str(e))
+    queries = read_queries(args.queries)
+
+    output = open(args.o, "w") if args.o else sys.stdout
+    try:
+        nerror, ncached = run_batch(queries, output, simdir, psfdir,
+                                    nproc=args.nproc or None,
+                                    cache_file=args.cache,
+                                    nthreads=args.nthreads)
+    finally:
+        if args.o:
+            output.close()
+    sys.stderr.write("%i queries, %i from the result cache\n" % (len(queries), ncached))
+    if nerror:
+        sys.stderr.write("%i of %i queries failed\n" % (nerror, len(queries)))
+
+
+if __name__ == "__main__":
+    main()
@@ -21,18 +21,16 @@ from scipy import integrate,interpolate
 from astropy.io import fits
 from astropy.modeling import models
 
-from photutils import aperture_photometry
-from photutils import CircularAperture, SkyCircularAperture
 from photutils.background import Background2D
 
 from astropy.convolution import Tophat2DKernel
 from scipy.signal import convolve2d
 from scipy.signal import fftconvolve
 import scipy
-import photutils
-#print photutils.__version__
 
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 
 # constants
 c_km = 2.9979E5      # km/s
@@ -46,10 +44,20 @@ mu = 1E-4           # cm
 
 
 # IRIS interal packages
-from get_filterdat import get_filterdat
+from get_filterdat import get_filterdat, photometry_table, mag_to_flambda, flambda_to_mag, ABconv
 #from background_specs import background_specs2
-from background_specs import background_specs3
-from get_psf import get_psf
+from background_specs import background_specs3, airmass_table
+from get_psf import get_psf, psf_grid, psf_wvl_weights, read_psf
+from field_sim import read_catalog, simulate_field
+from detector_sim import simulate_detector
+from montecarlo import run_montecarlo, percentiles
+from framestack import generate_frames, frame_model, stack_frames, stack_snr
+from fits_products import product_writer
+from etc_cache import memoize, result_cache, filter_names
+from saturation import saturation, expected_saturated
+from spectral_bins import spectral_bins, check_bins
+from spectral_library import is_user_spectrum, resampled_spectrum, spectrum_digest, load_user_spectrum, redshift_template
+from aperture_geom import circular_aperture
 
 def extrap1d(interpolator):
     xs = interpolator.x
@@ -104,6 +112,157 @@ def binnd(ndarray, new_shape, operation='sum'):
     return ndarray
 		
 
+def prepare_psf(image, mode, source='point_source'):
+    # bin and normalize a PSF plane, convolve with the extended source
+    if mode == "imager":
+        image=binnd(image,[750,750],'sum')
+    else:
+        image = np.array(image)
+
+    image /= image.sum()
+    psf_extend=np.array(image)
+    if source=='extended':
+        window=300
+        obj=np.ones([1500,1500])
+        centerx=psf_extend.shape[0]/2
+        centery=psf_extend.shape[1]/2
+        psf_extend=psf_extend[centerx-(window/2):centerx+(window/2),centery-(window/2):centery+(window/2)]
+        image=fftconvolve(obj,psf_extend,mode='same')
+    return image
+
+def psf_interp_cube(planes, lo, hi, whi, spec, chunk=512):
+    """
+    Point source cube with a PSF varying per spectral channel.
+
+    planes - dict of PSF subimages keyed by extension
+    lo, hi - bracketing extensions per channel
+    whi    - interpolation weight of the hi extension per channel
+    spec   - spectrum per channel
+
+    The cube is filled in chunks of channels so that the temporary
+    arrays stay bounded by the chunk size.
+    """
+    ny,nx = planes[lo[0]].shape
+    cube = np.empty((len(spec),ny,nx),dtype=np.float32)
+    for i0 in xrange(0,len(spec),chunk):
+        i1 = min(i0+chunk,len(spec))
+        w = whi[i0:i1,np.newaxis,np.newaxis]
+        psf_lo = np.array([planes[e] for e in lo[i0:i1]])
+        psf_hi = np.array([planes[e] for e in hi[i0:i1]])
+        cube[i0:i1] = ((1.0-w)*psf_lo + w*psf_hi)*spec[i0:i1,np.newaxis,np.newaxis]
+    return cube
+
+def limiting_flux(signal, noise, totime, snr):
+    """
+    Factor on the source flux which reaches snr in the total integration
+    totime [s], for the source rate signal and the background + detector
+    rate noise (arrays, or sums over an aperture), from the quadratic
+
+        snr = f*signal*sqrt(totime)/sqrt(f*signal + noise)
+    """
+    with np.errstate(divide='ignore'):
+        return snr**2/(2.0*totime*signal)*(1.0 + np.sqrt(1.0 + 4.0*totime*noise/snr**2))
+
+# intermediate products shared between calculations in the same process,
+# the cached arrays must not be modified in place
+load_filterdat = memoize(maxsize=64)(get_filterdat)
+
+@memoize(maxsize=64)
+def load_psf(psfdir, psf_file, ext, mode, source='point_source'):
+    # binned and normalized PSF plane
+    image = prepare_psf(read_psf(psfdir, psf_file, ext), mode, source)
+    image.flags.writeable = False
+    return image
+
+@memoize(maxsize=16)
+def load_background(resolution, filter, simdir):
+    # OH, continuum and thermal background spectra in the filter
+    return background_specs3(resolution, filter, convolve=True, simdir=simdir,
+                             filteronly=True)
+
+@memoize(maxsize=4)
+def load_background_model(resolution, simdir):
+    # background settings shared between filters, no spectra
+    return background_specs3(resolution, None, convolve=True, simdir=simdir)
+
+@memoize(maxsize=64)
+def load_background_band(resolution, filter, simdir):
+    # background spectra of the filter with band(), the Gemini spectrum
+    # is read once for all the filters
+    return load_background_model(resolution, simdir).band(filter)
+
+@memoize(maxsize=16)
+def load_airmass_table(resolution, filter, simdir, full_background=False):
+    # background spectra of the filter over the zenith angle grid
+    if full_background:
+        bkgd = load_background_band(resolution, filter, simdir)
+    else:
+        bkgd = load_background(resolution, filter, simdir)
+    return airmass_table(bkgd)
+
+@memoize(maxsize=8)
+def load_spectrum(spectrum, simdir):
+    # model spectrum: wavelength [microns], flux [photons/s/m^2/um]
+    ext = 0
+    spec_file = os.path.expanduser(simdir + "/model_spectra/" + spectrum)
+    pf = fits.open(spec_file)
+    if spectrum == "vega_all.fits":
+        spec = pf[ext].data
+        head = pf[ext].header
+        cdelt1 = head["cdelt1"]
+        crval1 = head["crval1"]
+
+        nelem = spec.shape[0]
+        specwave = (np.arange(nelem))*cdelt1 + crval1  # Angstrom
+    else:
+        specwave = pf[ext].data[0,:] # Angstrom
+        spec = pf[ext].data[1,:]     # erg/s/cm^2/Ang
+
+        E_phot = (h*c)/(specwave*Ang) # erg
+        spec = spec*100*100*1e4/E_phot # -> photons/s/m^2/um
+    specwave = specwave/1e4 # -> microns
+    spec = np.array(spec, dtype=float)
+    specwave.flags.writeable = False
+    spec.flags.writeable = False
+    return specwave, spec
+
+@memoize(maxsize=8)
+def load_template(spectrum, simdir, resolution, digest=None):
+    # rest-frame template convolved once for all redshifts, digest: content
+    # hash of a user spectrum file
+    if is_user_spectrum(spectrum):
+        specwave, spec = load_user_spectrum(os.path.expanduser(spectrum), digest)
+    else:
+        specwave, spec = load_spectrum(spectrum, simdir)
+    return redshift_template(specwave, spec, resolution)
+
+def new_figure(figures=None):
+    # figure with its own canvas, independent of the pyplot state
+    # (thread-safe), appended to figures
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    if figures is not None:
+        figures.append(fig)
+    return fig
+
+def show_figures(figures):
+    # display the figures of IRIS_ETC with pyplot (command line only)
+    for fig in figures:
+        manager = plt.figure().canvas.manager
+        manager.canvas.figure = fig
+        fig.set_canvas(manager.canvas)
+    if figures:
+        plt.show()
+
+def ifs_wave(filter, resolution, simdir):
+    # IFS wavelength grid of the filter [microns]
+    filterdat = load_filterdat(filter, simdir)
+    wi = filterdat["lambdamin"][0]
+    wf = filterdat["lambdamax"][0]
+    dxspectrum = int(ceil( log10(wf/wi)/log10(1.0+1.0/(resolution*2.0)) ))
+    return np.linspace(wi/1e4,wf/1e4,dxspectrum)
+
+
 def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
              nframes = 1, snr = 10.0, radius = 0.024, gain = 3.04,
              readnoise = 5., darkcurrent = 0.002, scale = 0.004,
@@ -112,6 +271,14 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
              spectrum = "Vega", lam_obs = 2.22, line_width = 200.,
              png_output = None, zenith_angle = 30. , atm_cond = 50.,source='point_source',source_size=0.2,csv_output=None,
              psf_loc = [8.8, 8.8], psf_time = 1.4, verb = 1, psf_old = 0,
+             psf_interp = False, catalog = None, field_shape = [4096, 4096],
+             detector_output = None, nthreads = None, seed = None,
+             nmc = 0, nproc = None, framestack = False, stack_output = None,
+             clip_sigma = 3.0, product_output = None, compress = False,
+             bin_widths = None, velocity_window = None, line_window = None,
+             aperture_method = 'center', full_background = False,
+             airmass_background = False, redshift = None,
+             rng = None, figures = None,
              simdir='~/data/iris/sim/', psfdir='~/data/iris/sim/', test = 0):
 
     #print flambda
@@ -133,22 +300,91 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
     #           bgmag  - the background magnitude (default: sky
     #                    background corresponding to input filter)
     #           efftot - total throughput
+    #           aperture_method - 'center' (whole pixels) or 'exact'
+    #                    (fractional pixel overlap) aperture statistics
+    #           full_background - IFS background of the filter from
+    #                    band() of a background shared between filters
+    #           airmass_background - scale the sky background with the
+    #                    airmass of zenith_angle
+    #           redshift - redshift of the Vega or user template spectrum
+    #                    (IFS), normalized to mag in the filter
+    #           rng - random generator of the simulated images (default:
+    #                    a RandomState of seed, private to the call)
+    #           figures - list collecting the plots (matplotlib Figures,
+    #                    without pyplot), shown by the command line
     #           verb - verbosity level
 
     #           mode - either "imager" or "ifs"
     #           calc - either "snr" or "exptime"
 
+    # the keywords of the call, passed on to _iris_etc
+    params = locals().copy()
+
+    # products of the calculation, written in the background to a single
+    # multi-extension FITS file
+    if verb > 2 and product_output is None:
+        product_output = "iris_etc_products.fits"
+    if product_output:
+        products = product_writer(product_output, compress=compress, header=[
+            ("MODE", mode, "imager or ifs"), ("CALC", calc, "snr or exptime"),
+            ("FILTER", filter, "filter"), ("MAG", mag, "source magnitude [Vega]"),
+            ("FLAMBDA", flambda, "source flux [erg/s/cm^2/Ang]"),
+            ("ITIME", itime, "integration time per frame [s]"),
+            ("NFRAMES", nframes, "number of frames"), ("SNR", snr, "requested S/N"),
+            ("SCALE", scale, "plate scale [arcsec/spaxel]"),
+            ("RESOLUT", resolution, "spectral resolution"),
+            ("SPECTRUM", str(spectrum)[:60], "source spectrum"),
+            ("REDSHIFT", -1 if redshift is None else redshift, "redshift of the template (-1: none)"),
+            ("SOURCE", source, "source type"), ("SRCSIZE", source_size, "source size [arcsec]"),
+            ("ZENITH", zenith_angle, "zenith angle [deg]"),
+            ("ATMCOND", atm_cond, "atmospheric conditions [percentile]"),
+            ("GAIN", gain, "gain [e-/DN]"), ("RDNOISE", readnoise, "read noise [e-]"),
+            ("DARK", darkcurrent, "dark current [e-/s]"),
+            ("SEED", -1 if seed is None else seed, "random seed (-1: none)")])
+    else:
+        products = None
+
+    try:
+        jsondict = _iris_etc(products, **params)
+    except:
+        # stop the writer thread, no partial products file
+        if products:
+            products.abort()
+        raise
+    if products:
+        jsondict['Products File'] = products.close()
+    return jsondict
+
+def _iris_etc(products, filter, mag, flambda, itime, nframes, snr, radius,
+              gain, readnoise, darkcurrent, scale, resolution, collarea,
+              positions, bgmag, efftot, mode, calc, spectrum, lam_obs,
+              line_width, png_output, zenith_angle, atm_cond, source,
+              source_size, csv_output, psf_loc, psf_time, verb, psf_old,
+              psf_interp, catalog, field_shape, detector_output, nthreads,
+              seed, nmc, nproc, framestack, stack_output, clip_sigma,
+              product_output, compress, bin_widths, velocity_window,
+              line_window, aperture_method, full_background,
+              airmass_background, redshift, rng, figures, simdir, psfdir,
+              test):
+    # the calculation of IRIS_ETC, adding its arrays to products
+
     #fixed radius 0.2 arc sec
     radius=0.1
     radius /= scale
     sat_limit=50000
+
+    # random numbers of the simulated images, no global state so that
+    # calls can run concurrently
+    if rng is None:
+        rng = np.random.RandomState(seed)
+
     if spectrum.lower() == "vega":
        spectrum = "vega_all.fits"
        #spectrum = "spec_vega.fits"
 
 
     ##### READ IN FILTER INFORMATION
-    filterdat = get_filterdat(filter, simdir)
+    filterdat = load_filterdat(filter, simdir)
     lambdamin = filterdat["lambdamin"]
     lambdamax = filterdat["lambdamax"]
     lambdac = filterdat["lambdac"]
@@ -236,7 +472,12 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
     else:
        backmag = filterdat["backmag"] #background between OH lines
        imagmag = filterdat["imagmag"] #integrated BB background
-       if mode == "imager": backmag = imagmag ## use the integrated background if specified
+       if mode == "imager":
+          backmag = imagmag ## use the integrated background if specified
+          if airmass_background:
+             # only the sky part scales with the airmass, as in the IFS
+             table = load_airmass_table(resolution*2.0, filter, simdir, full_background)
+             backmag = backmag - 2.5*np.log10(table.flux_scale(zenith_angle))
     zp = filterdat["zp"]
     #print 'zp',zp
     #print 'backmag',backmag
@@ -257,7 +498,7 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
          psf_ind = np.argmin(np.abs(lambdac/10. - psf_wvls))
          psf_wvl =  psf_wvls[psf_ind]
          #psf_file = os.path.expanduser(simdir + "/psfs/" + psf_dict[psf_wvl])
-         psf_file = os.path.expanduser(psfdir + "/psfs/results_central/" + psf_dict[psf_wvl])
+         psf_file = "results_central/" + psf_dict[psf_wvl]
          ext = 0
 
          #print psf_ind
@@ -265,12 +506,7 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
          #print psf_file
 
     else:
-        if mode.lower() == "ifs":
-            psf_wvls = [840, 928, 1026, 988, 1092, 1206, 1149, 1270, 1403, 1474,
-                        1629, 1810, 1975, 2182, 2412] # nm
-        if mode.lower() == "imager":
-            psf_wvls = [830, 876, 925, 970, 1019, 1070, 1166, 1245, 1330, 1485,
-                        1626, 1781, 2000, 2191, 2400] # nm
+        psf_wvls = psf_grid(mode)["wvl"] # nm
 
         #print psf_loc
         #print zenith_angle
@@ -278,7 +514,6 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
         psf_time=itime
         psf_file = get_psf(zenith_angle, atm_cond, mode, psf_time, psf_loc, scale)
         #print psf_file
-        psf_file = os.path.expanduser(psfdir + "/psfs/" + psf_file)
 
         #print 'psf_file',psf_file
         #print os.path.isfile(psf_file)
@@ -300,24 +535,9 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
 
 
 
-    pf = fits.open(psf_file)
-    #print len(pf)
-    image = pf[ext].data
-    head = pf[ext].header
-    #print head['COMMENT']
-    if mode == "imager":
-		image=binnd(image,[750,750],'sum')
-
-    image /= image.sum()
-    psf_extend=np.array(image)
+    # PSF plane from the packed PSF library if available, else the FITS file
+    image = load_psf(psfdir, psf_file, ext, mode, source)
     #print 'imagemax',image.max()
-    if source=='extended':
-        window=300
-        obj=np.ones([1500,1500])
-        centerx=psf_extend.shape[0]/2
-        centery=psf_extend.shape[1]/2
-        psf_extend=psf_extend[centerx-(window/2):centerx+(window/2),centery-(window/2):centery+(window/2)]
-        image=fftconvolve(obj,psf_extend,mode='same')
 
     # position of center of PSF
     x_im_size,y_im_size = image.shape
@@ -333,57 +553,36 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
 
     #  mag = ABmag - 0.91 ; Vega magnitude
     ##########################################
-    # convert AB to Vega and vice versa
-             # band  eff     mAB - mVega
-    ABconv = [["i",  0.7472, 0.37 ],
-              ["z",  0.8917, 0.54 ],
-              ["Y",  1.0305, 0.634],
-              ["J",  1.2355, 0.91 ],
-              ["H",  1.6458, 1.39 ],
-              ["Ks", 2.1603, 1.85 ]]
-
-    ABwave  = [i[1] for i in ABconv]
-    ABdelta = [i[2] for i in ABconv]
-    #print
-
-    #print filter
-
+    # convert AB to Vega and vice versa, from the photometric table of
+    # the filters (get_filterdat.photometry_table)
     if verb > 1:
-        fig = plt.figure()
+        ABwave  = [i[1] for i in ABconv]
+        ABdelta = [i[2] for i in ABconv]
+        fig = new_figure(figures)
         p = fig.add_subplot(111)
         p.plot(ABwave, ABdelta)
         p.set_xlabel("Wavelength ($\mu$m)")
         p.set_ylabel("m$_{\\rm AB}$ - m$_{\\rm Vega}$")
-        plt.show()
-
-
-    R_i = interpolate.interp1d(ABwave,ABdelta)
-    R_x = extrap1d(R_i)
-    delta = R_x(lambdac/1e4)
 
-    #print delta
+    photometry = photometry_table(simdir)
+    delta = photometry["abvega"][photometry["index"][filter]]
     # delta = mAB - mVega
 
     ##########################################
 
+    if mag is None and flambda is None and calc == "limmag":
+        # reference magnitude, the limiting magnitude does not depend on it
+        mag = 20.0
+
     if mag is not None:
         # convert to flux density (flambda)
         ABmag = mag + delta
-        fnu = 10**(-0.4*(ABmag + 48.60))                 # erg/s/cm^2/Hz
-        #print "Calculated from magnitude"
-        #print fnu,"erg/s/cm^2/Hz"
-        #flambda = fnu*Ang/((lam_obs*mu)**2/c)
-        flambda = fnu*Ang/((lambdac*Ang)**2/c)
-        flambda=flambda[0]
+        flambda = float(mag_to_flambda(mag, filter, simdir))
 
     elif flambda is not None:
         # convert to Vega mag
-        fnu = flambda/(Ang/((lambdac*Ang)**2/c))
-        #print "Calculated from magnitude"
-        #print fnu,"erg/s/cm^2/Hz"
-        ABmag = -2.5* log10(fnu) - 48.60
-        mag = ABmag - delta
-        # print mag
+        mag = float(flambda_to_mag(flambda, filter, simdir))
+        ABmag = mag + delta
 
     #print flambda
     #print mag
@@ -457,7 +656,7 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
         #print specwave
         #print E_phot
 
-        fig = plt.figure()
+        fig = new_figure(figures)
         p = fig.add_subplot(111)
         p.plot(specwave, spec/E_phot) # photons/s/cm^2/Ang
         p.set_xlim(3000,11000)
@@ -475,7 +674,6 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
         p.plot(specwave,STlamb/E_phot)
         p.plot(specwave,ABnu/E_phot*(c/(specwave*Ang)**2)*Ang)
 
-        plt.show()
 
 
     #print
@@ -549,19 +747,16 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
 
     # to define apertures used throughout the calculations
     radii = np.arange(1,50,1) # pixels
-    apertures = [CircularAperture([xs,ys], r=r) for r in radii]
-    aperture = CircularAperture([xs,ys], r=radius)
 
-    masks = aperture.to_mask(method='center')
-    mask = masks[0]
+    # pixel index sets and weights of the apertures (cached, see
+    # aperture_geom.py)
+    mask = circular_aperture(subimage.shape, (xs,ys), radius, aperture_method)
 
 
 #Second Aperture lambda dependent
-    aperturel = CircularAperture([xs,ys], r=radiusl)
     #print radius
     #print radiusl
-    masksl = aperturel.to_mask(method='center')
-    maskl = masksl[0]
+    maskl = circular_aperture(subimage.shape, (xs,ys), radiusl, aperture_method)
 
 
     ###########################################################################
@@ -572,8 +767,13 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
     if mode.lower() == "ifs":
 
         #bkgd = background_specs2(resolution*2.0, filter, convolve=True, simdir = simdir)
-        bkgd = background_specs3(resolution*2.0, filter, convolve=True, simdir = simdir,
-                                 filteronly=True)
+        if airmass_background:
+            bkgd = load_airmass_table(resolution*2.0, filter, simdir,
+                                      full_background).band(zenith_angle)
+        elif full_background:
+            bkgd = load_background_band(resolution*2.0, filter, simdir)
+        else:
+            bkgd = load_background(resolution*2.0, filter, simdir)
 
         ohspec = bkgd.backspecs[0,:]
         cospec = bkgd.backspecs[1,:]
@@ -600,6 +800,29 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
         #print wave
         #print backwave
 
+        # emission line: only the channels within line_window line widths
+        # of lam_obs, padded by two resolution elements, are simulated
+        wave_full = wave
+        win = slice(None)
+        if spectrum.lower() == "emission" and line_window:
+            lam_width=lam_obs/c_km*line_width
+            instwidth = (lam_obs/resolution)
+            width = np.sqrt(instwidth**2+lam_width**2)
+            half = line_window*width + 2*instwidth
+            i0 = max(np.searchsorted(wave, lam_obs-half, side='left'), 0)
+            i1 = min(np.searchsorted(wave, lam_obs+half, side='right'), dxspectrum)
+            if i1 - i0 < 2:
+                i0 = min(max(i0 - 1, 0), dxspectrum - 2)
+                i1 = i0 + 2
+            win = slice(i0, i1)
+            wave = wave[win]
+            dxspectrum = len(wave)
+            if verb > 1: print 'Emission line window: %.5f - %.5f microns, %i channels' % (wave[0], wave[-1], dxspectrum)
+
+        # binned and windowed results, checked before the calculation
+        if calc in ("snr", "exptime"):
+            check_bins(wave, bin_widths, lam_obs, velocity_window or None)
+
         backtot_func = interpolate.interp1d(backwave,backtot)
         backtot = backtot_func(wave)
 
@@ -618,7 +841,8 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
             #print "Spec normalization = %.4e" % intNorm
 
         elif spectrum.lower() == "emission":
-            specwave = wave
+            # normalized over the full bandpass
+            specwave = wave_full
             lam_width=lam_obs/c_km*line_width
             instwidth = (lam_obs/resolution)
             width = np.sqrt(instwidth**2+lam_width**2)
@@ -629,34 +853,32 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
             spec_temp = A*np.exp(-0.5*((specwave - lam_obs)/width)**2.)
             intFlux = integrate.trapz(spec_temp,specwave)
             intNorm = flux_phot/intFlux
+            spec_temp = spec_temp[win]
             #print "Spec integration = %.1f" % intFlux
             #print "Spec normalization = %.4e" % intNorm
 
+        elif redshift is not None:
+            # rest-frame template shifted to redshift, the spectra of a
+            # redshift grid are interpolated together (run_redshifts)
+            template = load_template(spectrum, simdir, resolution,
+                                     spectrum_digest(spectrum))
+            spec_temp = template.rows(wave_full, [redshift])[0][win]
+            intFlux = integrate.trapz(spec_temp,wave)
+            if intFlux <= 0:
+                raise ValueError("template spectrum at z=%g outside the filter %s" % (redshift, filter))
+            intNorm = flux_phot/intFlux
+
+        elif is_user_spectrum(spectrum):
+            # template of the user spectral library, convolved and
+            # resampled on the full grid (cached on disk)
+            spec_temp = resampled_spectrum(spectrum, wave_full, filter, resolution)[win]
+            intFlux = integrate.trapz(spec_temp,wave)
+            if intFlux <= 0:
+                raise ValueError("template spectrum %s outside the filter %s" % (spectrum, filter))
+            intNorm = flux_phot/intFlux
+
         else:
-            if spectrum == "vega_all.fits":
-                ext = 0
-                spec_file = os.path.expanduser(simdir + "/model_spectra/" + spectrum)
-                pf = fits.open(spec_file)
-                spec = pf[ext].data
-                head = pf[ext].header
-                cdelt1 = head["cdelt1"]
-                crval1 = head["crval1"]
-
-                nelem = spec.shape[0]
-                specwave = (np.arange(nelem))*cdelt1 + crval1  # Angstrom
-                specwave /= 1e4 # -> microns
-
-            elif spectrum == "spec_vega.fits":
-                ext = 0
-                spec_file = os.path.expanduser(simdir + "/model_spectra/" + spectrum)
-                pf = fits.open(spec_file)
-                specwave = pf[ext].data[0,:] # Angstrom
-                spec = pf[ext].data[1,:]     # erg/s/cm^2/Ang
-                nelem = spec.shape[0]
-
-                E_phot = (h*c)/(specwave*Ang) # erg
-                spec *= 100*100*1e4/E_phot # -> photons/s/m^2/um
-                specwave /= 1e4 # -> microns
+            specwave, spec = load_spectrum(spectrum, simdir)
 
 
             #intFlux = integrate.trapz(spec,specwave,dx=dx)
@@ -668,12 +890,11 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
             #print
 
             if verb > 1:
-                fig = plt.figure()
+                fig = new_figure(figures)
                 p = fig.add_subplot(111)
                 p.plot(specwave, spec)
                 #p.set_xscale("log")
                 #p.set_yscale("log")
-                plt.show()
 
             ################################################
             # convolve with the resolution of the instrument
@@ -706,7 +927,17 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
 
 
         # essentially the output of mkpointsourcecube
-        cube = (subimage[np.newaxis]*spec_temp[:,np.newaxis,np.newaxis]).astype(np.float32)
+        if psf_interp and not psf_old:
+            # PSF interpolated per channel between the bracketing
+            # extensions, only the subimage of each plane is kept
+            lo,hi,whi = psf_wvl_weights(wave*1e3, psf_wvls)
+            planes = {}
+            for e in np.unique(np.concatenate([lo,hi])):
+                plane = load_psf(psfdir, psf_file, e, mode, source)
+                planes[e] = plane[yp-hwbox:yp+hwbox+1,xp-hwbox:xp+hwbox+1]
+            cube = psf_interp_cube(planes, lo, hi, whi, spec_temp)
+        else:
+            cube = (subimage[np.newaxis]*spec_temp[:,np.newaxis,np.newaxis]).astype(np.float32)
         # photons/s/m^2/um
         cube = intNorm*cube
         #print "Cube sum = %.2e photons/s/m^2/um" % cube.sum()
@@ -719,11 +950,8 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
         #print cube.shape
         #print cube.size
 
-        if verb > 2:
-            # [electrons]
-            hdu = fits.PrimaryHDU(cube)
-            hdul = fits.HDUList([hdu])
-            hdul.writeto('cube.fits',clobber=True)
+        if products:
+            products.add("CUBE", cube, "photons/s/m^2/um")
 
 
         # convert the signal and the background into photons/s observed
@@ -762,12 +990,11 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
         #filter_tput = filter_func(wave)
 
         if verb > 1:
-            fig = plt.figure()
+            fig = new_figure(figures)
             p = fig.add_subplot(111)
             #p.plot(wave, filter_tput*cube[:,ys,xs])
             p.plot(wave, cube[:,ys,xs],c="k")
             p.plot(wave, np.sum(cube,axis=(1,2)),c="b")
-            plt.show()
 
         if verb > 1:
             print 'n wavelength channels: ', len(wave)
@@ -788,6 +1015,7 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
         #readnoise = sqrt(coadds)*readnoise
         #darknoise = (sqrt(darkcurrent*itime))
         darknoise = darkcurrent       ## electrons/s
+        readnoise_frame = readnoise     ## electrons per frame
         readnoise = readnoise**2.0/itime  ## scale read noise
 
                                         # total noise per pixel
@@ -796,7 +1024,8 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
         noise = noisetot
         ### Combine detector noise and background (sky+tel+AO)
         #noisetotal = SQRT(noise*noise + background*background)
-        noisetotal = noise + backgroundCube
+        # (a broadcast view, same background in every spaxel)
+        noisetotal = np.broadcast_to(noise + backtot[:,np.newaxis,np.newaxis],cube.shape)
 
         ####################################################
         # Case 1: find s/n for a given exposure time and mag
@@ -816,10 +1045,8 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
             #snrCube = float(snrCube)
             snrCube = signal/noiseCube
 
-            if verb > 2:
-                hdu = fits.PrimaryHDU(snrCube)
-                hdul = fits.HDUList([hdu])
-                hdul.writeto('snrCube.fits',clobber=True)
+            if products:
+                products.add("SNRCUBE", snrCube)
 
 	    peakSNR=""
 	    medianSNR=""
@@ -835,86 +1062,18 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
 	    totalSNRl = ""	                                    # integrated aperture SNR at pre-defined fixed aperture
 	    totalexptimel = ""	                                    # integrated aperture exptime at pre-defined fixed aperture
 
-            flatarray=np.ones(snrCube[0,:,:].shape)
-            if photutils.__version__ == "0.4":
-                maskimg= mask.multiply(flatarray)
-                masklimg= maskl.multiply(flatarray)
-            else:
-                maskimg= mask.apply(flatarray)
-                masklimg= maskl.apply(flatarray)
-
-
-            snr_cutout = []
-            snr_cutout_aper = []
-            snr_cutout_aperselect = []
-            snr_cutoutl = []
-            snr_cutout_aperl = []
-            snr_cutout_aperlselect = []
-            for n in xrange(dxspectrum):
-                snr_cutout.append(mask.cutout(snrCube[n,:,:]))
-                if photutils.__version__ == "0.4":
-                    snr_cutout_tmp = mask.multiply(snrCube[n,:,:]) # in version 0.4 of photutils
-                    snr_cutout_tmp_select=snr_cutout_tmp[np.where(maskimg>0)]
-                else:
-                    snr_cutout_tmp = mask.apply(snrCube[n,:,:])
-                    snr_cutout_tmp_select=snr_cutout_tmp[np.where(maskimg>0)]
-                snr_cutout_aper.append(snr_cutout_tmp)
-                snr_cutout_aperselect.append(snr_cutout_tmp_select)
-            for n in xrange(dxspectrum):
-                snr_cutoutl.append(maskl.cutout(snrCube[n,:,:]))
-                if photutils.__version__ == "0.4":
-                    snr_cutout_tmp = maskl.multiply(snrCube[n,:,:]) # in version 0.4 of photutils
-                    snr_cutout_tmp_select=snr_cutout_tmp[np.where(masklimg>0)]
-                else:
-                    snr_cutout_tmp = maskl.apply(snrCube[n,:,:])
-                    snr_cutout_tmp_select=snr_cutout_tmp[np.where(masklimg>0)]
-
-                snr_cutout_aperl.append(snr_cutout_tmp)
-                snr_cutout_aperlselect.append(snr_cutout_tmp_select)
-                #if verb > 0 and n == 0:
-                #    fig = plt.figure()
-                #    p = fig.add_subplot(111)
-                #    p.imshow(snrCube[n,:,:],interpolation='none')
-                #    plt.show()
-
-            snr_cutout = np.array(snr_cutout)
-            snr_cutout_aper = np.array(snr_cutout_aper)
-            snr_cutoutl = np.array(snr_cutoutl)
-            snr_cutout_aperl = np.array(snr_cutout_aperl)
-            snr_cutout_aperselect = np.array(snr_cutout_aperselect)
-            snr_cutout_aperlselect = np.array(snr_cutout_aperlselect)
-
-            if verb > 1: print snr_cutout.shape
-            if verb > 1: print snr_cutout_aper.shape
-
-            ###########################
-            # summation of the aperture
-            ###########################
-            data_cutout_aperl = []
-            noise_cutout_aperl = []
-            for n in xrange(dxspectrum): 
-
-                if photutils.__version__ == "0.4":
-                    data_cutout_tmp = maskl.multiply(signal[n,:,:]) # in version 0.4 of photutils
-                    noise_cutout_tmp = maskl.multiply(noiseCube[n,:,:])
-                else:
-                    data_cutout_tmp = maskl.apply(signal[n,:,:])
-                    noise_cutout_tmp = maskl.apply(noiseCube[n,:,:])
-
-                data_cutout_aperl.append(data_cutout_tmp)
-                noise_cutout_aperl.append(noise_cutout_tmp)
+            # S/N of the spaxels of the apertures, (channel, spaxel)
+            snr_cutout_aperselect = mask.values(snrCube)
+            snr_cutout_aperlselect = maskl.values(snrCube)
 
-            data_cutout_aperl = np.array(data_cutout_aperl)
-            noise_cutout_aperl = np.array(noise_cutout_aperl)
+            if verb > 1: print snr_cutout_aperselect.shape
+            if verb > 1: print snr_cutout_aperlselect.shape
 
             ###########################
             # summation of the aperture
             ###########################
-            #aper_suml = data_cutout_aperl.sum()
-            #noise_suml = np.sqrt((noise_cutout_aperl**2).sum())
-
-            aper_sum_chl = np.sum(data_cutout_aperl,axis=(1,2))  # per channel
-            noise_sum_chl = np.sqrt(np.sum(noise_cutout_aperl**2,axis=(1,2)))  # per channel
+            aper_sum_chl = maskl.sum(signal)  # per channel
+            noise_sum_chl = np.sqrt(maskl.sum(noiseCube**2))  # per channel
 
             snr_chl =  aper_sum_chl/noise_sum_chl
 
@@ -925,21 +1084,28 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
 
             if verb > 1: print 'S/N (aperture = %.4f") = %.4f' % (sizel, snr_int)
 
+            # binned and windowed S/N from the per-channel aperture sums
+            bins = spectral_bins(wave, aper_sum_chl/np.sqrt(itime*nframes), variance=noise_sum_chl**2)
+            if bin_widths:
+                bin_table = bins.table(bin_widths, totime=itime*nframes)
+            if velocity_window:
+                window_value = bins.snr(*bins.window(lam_obs, velocity_window), totime=itime*nframes)
+
 	    totalSNRl = str("%0.4f" % snr_int)	                    # integrated aperture SNR at pre-defined fixed aperture
 
             ###############
             # Main S/N plot
             ###############
             if verb > 0:
-                fig = plt.figure()
+                fig = new_figure(figures)
                 p = fig.add_subplot(111)
                 #p.plot(wave, filter_tput*cube[:,ys,xs])
                 l1, = p.plot(wave, snr_chl, c="k", label="Total Flux [Aperture : "+"{:.3f}".format(sizel)+'"]')		
                 ############
                 # inset plot
                 ############
-                #p2 = plt.axes([0.2, 0.6, 0.25, 0.25])
-                p2 = plt.axes([0.17, 0.2, 0.25, 0.25]) #0.625, 0.55
+                #p2 = fig.add_axes([0.2, 0.6, 0.25, 0.25])
+                p2 = fig.add_axes([0.17, 0.2, 0.25, 0.25]) #0.625, 0.55
                 l2, = p2.plot(wave, snrCube[:,ys,xs],label="Peak Flux")
                 #p2.plot(wave, np.mean(snr_cutout_aper,axis=(1,2)),label='Mean Flux [Aperture : 0.2"]')
                 #p2.plot(wave, np.median(snr_cutout_aper,axis=(1,2)),label='Median Flux [Aperture : 0.2"]')
@@ -955,11 +1121,10 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
                 p.set_ylabel("S/N")
                 #leg = p.legend(loc=1,numpoints=1,prop={'size': 6})
                 if png_output:
-		    plt.tight_layout()
+		    fig.tight_layout()
                     fig.savefig(png_output,dpi=200)
                 else:
-		    plt.tight_layout()
-                    plt.show()
+		    fig.tight_layout()
                 if csv_output:
 		    csvarr=np.array([wave,snrCube[:,ys,xs],np.median(snr_cutout_aperlselect,axis=1),np.mean(snr_cutout_aperlselect,axis=1),snr_chl]).T
 		    np.savetxt(csv_output, csvarr, delimiter=',', header="Wavelength(microns),SNR_Peak,SNR_Median,SNR_Mean,SNR_Aperture_Total", comments="",fmt='%.4f')
@@ -989,28 +1154,36 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
             #endfor
 
             totalObservedCube = observedCube*itime*nframes + backgroundCube*itime*nframes + darkcurrent*itime*nframes + readnoise**2.0*nframes
+
+            if nmc:
+                # S/N distribution from nmc realizations, in parallel
+                skyObserved = backtot*itime*nframes + darkcurrent*itime*nframes + readnoise**2.0*nframes
+                mc = run_montecarlo(totalObservedCube, skyObserved,
+                                    maskl.to_image(observedCube.shape[1:])>0,
+                                    (ys,xs), nmc, seed=seed, nproc=nproc)
+                if verb > 1: print 'Monte-Carlo S/N (aperture = %.4f") = %.4f' % (sizel, mc["snr_empirical"])
+
+            if framestack:
+                # individual frames of the stack, one at a time
+                rateCube = observedCube + backgroundCube + darkcurrent
+                stack = stack_frames(generate_frames(rateCube, itime, nframes, readnoise_frame, rng),
+                                     nframes, stack_output, nsigma=clip_sigma,
+                                     model=frame_model(rateCube, itime, readnoise_frame))
+                stack_snrl = stack_snr(stack, (backtot + darkcurrent)*itime,
+                                       maskl.to_image(rateCube.shape[1:])>0)
+                if verb > 1: print 'Frame stack S/N (aperture = %.4f") = %.4f' % (sizel, stack_snrl[0])
+
             # model + background + noise
             # [electrons]
-            simCube_tot = np.random.poisson(lam=totalObservedCube, size=totalObservedCube.shape).astype("float64")
+            simCube_tot = rng.poisson(lam=totalObservedCube, size=totalObservedCube.shape).astype("float64")
             # divide back by total integration time to get the simulated image
             simCube = simCube_tot/(itime*nframes) # [electrons/s]
             simCube_DN = simCube_tot/gain # [DNs]
 
-            if verb > 2:
-                # [electrons]
-                hdu = fits.PrimaryHDU(simCube_tot)
-                hdul = fits.HDUList([hdu])
-                hdul.writeto('simCube_tot.fits',clobber=True)
-
-                # [electrons/s]
-                hdu = fits.PrimaryHDU(simCube)
-                hdul = fits.HDUList([hdu])
-                hdul.writeto('simCube.fits',clobber=True)
-
-                # [DNs]
-                hdu = fits.PrimaryHDU(simCube_DN)
-                hdul = fits.HDUList([hdu])
-                hdul.writeto('simCube_DN.fits',clobber=True)
+            if products:
+                products.add("SIMCUBE_TOT", simCube_tot, "electrons")
+                products.add("SIMCUBE", simCube, "electrons/s")
+                products.add("SIMCUBE_DN", simCube_DN, "DN")
 
 
             #totalObservedCube = float(totalObservedCube)
@@ -1036,7 +1209,13 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
             # snr = observedCube*np.sqrt(itime*nframes)/np.sqrt(observedCube+noisetotal)
             # itime * nframes =  (snr * np.sqrt(observedCube+noisetotal)/observedCube)**2
 
-            totime =  (snr * np.sqrt(observedCube+noisetotal)/observedCube)**2
+            # only the spaxels of the aperture are evaluated, as compact
+            # (channels x npix) arrays
+            data_aperl = maskl.values(observedCube)
+            noise_aperl = maskl.values(noisetotal)
+
+            totime_aperl =  (snr * np.sqrt(data_aperl+noise_aperl)/data_aperl)**2
+            totime_peak =  (snr * np.sqrt(observedCube[:,ys,xs]+noisetotal[:,ys,xs])/observedCube[:,ys,xs])**2
             # totime = itime * nframes
 
 	    peakSNR=""
@@ -1053,87 +1232,11 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
 	    totalSNRl = ""	                                    # integrated aperture SNR at pre-defined fixed aperture
 	    totalexptimel = ""	                                    # integrated aperture exptime at pre-defined fixed aperture
 
-            flatarray=np.ones(totime[0,:,:].shape)
-            if photutils.__version__ == "0.4":
-                maskimg= mask.multiply(flatarray)
-                masklimg= maskl.multiply(flatarray)
-            else:
-                maskimg= mask.apply(flatarray)
-                masklimg= maskl.apply(flatarray)
-
-
-            totime_cutout = []
-            totime_cutout_aper = []
-            totime_cutout_aperselect = []
-            totime_cutoutl = []
-            totime_cutout_aperl = []
-            totime_cutout_aperlselect = []
-
-
-            for n in xrange(dxspectrum):
-                totime_cutout.append(mask.cutout(totime[n,:,:]))
-
-                if photutils.__version__ == "0.4":
-                    totime_cutout_tmp = mask.multiply(totime[n,:,:]) # in version 0.4 of photutils
-                    totime_cutout_tmp_select=totime_cutout_tmp[np.where(maskimg>0)]
-                else:
-                    totime_cutout_tmp = mask.apply(totime[n,:,:])
-                    totime_cutout_tmp_select=totime_cutout_tmp[np.where(maskimg>0)]
-                totime_cutout_aper.append(totime_cutout_tmp)
-
-            for n in xrange(dxspectrum): 
-                totime_cutout_aperselect.append(totime_cutout_tmp_select)
-                totime_cutoutl.append(maskl.cutout(totime[n,:,:]))
-
-                if photutils.__version__ == "0.4":
-                    totime_cutout_tmp = maskl.multiply(totime[n,:,:]) # in version 0.4 of photutils
-                    totime_cutout_tmp_select=totime_cutout_tmp[np.where(masklimg>0)]
-                else:
-                    totime_cutout_tmp = maskl.apply(totime[n,:,:])
-                    totime_cutout_tmp_select=totime_cutout_tmp[np.where(masklimg>0)]
-                totime_cutout_aperl.append(totime_cutout_tmp)
-                totime_cutout_aperlselect.append(totime_cutout_tmp_select)
-
-                #if verb > 0 and n == 0:
-                #    fig = plt.figure()
-                #    p = fig.add_subplot(111)
-                #    p.imshow(totime[n,:,:],interpolation='none')
-                #    plt.show()
-
-            totime_cutout = np.array(totime_cutout)
-            totime_cutout_aper = np.array(totime_cutout_aper)
-            totime_cutoutl = np.array(totime_cutoutl)
-            totime_cutout_aperl = np.array(totime_cutout_aperl)
-            totime_cutout_aperselect = np.array(totime_cutout_aperselect)
-            totime_cutout_aperlselect = np.array(totime_cutout_aperlselect)
-
             ############################
             # exposure time for aperture 
             ############################
-            data_cutout_aperl = []
-            noise_cutout_aperl = []
-            for n in xrange(dxspectrum): 
-
-                if photutils.__version__ == "0.4":
-                    data_cutout_tmp = maskl.multiply(observedCube[n,:,:]) # in version 0.4 of photutils
-                    noise_cutout_tmp = maskl.multiply(noisetotal[n,:,:])
-                else:
-                    data_cutout_tmp = maskl.apply(observedCube[n,:,:])
-                    noise_cutout_tmp = maskl.apply(noisetotal[n,:,:])
-                data_cutout_aperl.append(data_cutout_tmp)
-                noise_cutout_aperl.append(noise_cutout_tmp)
-
-            data_cutout_aperl = np.array(data_cutout_aperl)
-            noise_cutout_aperl = np.array(noise_cutout_aperl)
-
-            ###########################
-            # summation of the aperture
-            ###########################
-            #aper_suml = data_cutout_aperl.sum()
-            #noise_suml = np.sqrt((noise_cutout_aperl**2).sum())
-
-            aper_sum_chl = np.sum(data_cutout_aperl,axis=(1,2))  # per channel
-            noise_sum_chl = np.sqrt(np.sum(noise_cutout_aperl**2,axis=(1,2)))  # per channel
+            aper_sum_chl = np.dot(data_aperl, maskl.weights)  # per channel
+            noise_sum_chl = np.sqrt(np.dot(noise_aperl**2, maskl.weights))  # per channel
 
             totime_chl =  (snr * np.sqrt(aper_sum_chl+noise_sum_chl)/aper_sum_chl)**2
 
@@ -1143,17 +1246,25 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
             totimel =  (snr * np.sqrt(aper_suml+noise_suml)/aper_suml)**2
 
 
-            if verb > 1: print "Min time (peak flux) = %.4f seconds" % np.min(totime)
-            if verb > 1: print "Median time (median aperture flux) = %.4f seconds" % np.median(totime_cutout_aperlselect)
-            if verb > 1: print "Mean time (mean aperture flux) = %.4f seconds" % np.mean(totime_cutout_aperlselect)
+            if verb > 1: print "Min time (peak flux) = %.4f seconds" % np.min(totime_aperl)
+            if verb > 1: print "Median time (median aperture flux) = %.4f seconds" % np.median(totime_aperl)
+            if verb > 1: print "Mean time (mean aperture flux) = %.4f seconds" % np.mean(totime_aperl)
             if verb > 1: print 'Time (aperture = %.4f") = %.4f' % (sizel, totimel)
 
+            # binned and windowed exposure times from the per-channel
+            # aperture sums, same noise model as totime_chl and totimel
+            bins = spectral_bins(wave, aper_sum_chl, noise2=noise_sum_chl**2)
+            if bin_widths:
+                bin_table = bins.table(bin_widths, snr=snr)
+            if velocity_window:
+                window_value = bins.exptime(*bins.window(lam_obs, velocity_window), snr=snr)
+
 	    totalexptimel= str("%0.4f" %totimel) # integrated aperture exptime at pre-defined fixed aperture 
             ####################
             # Main exposure plot
             ####################
             if verb > 0:
-                fig = plt.figure()
+                fig = new_figure(figures)
                 p = fig.add_subplot(111)
 
 
@@ -1165,12 +1276,10 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
                 ############
                 # inset plot
                 ############
-                p2 = plt.axes([0.175, 0.65, 0.20, 0.20])
-                l2, = p2.plot(wave, totime[:,ys,xs],label="Peak Flux")
-                #p2.plot(wave, np.mean(totime_cutout_aper,axis=(1,2)),label='Mean Flux [Aperture : 0.2"]' )
-                #p2.plot(wave, np.median(totime_cutout_aper,axis=(1,2)),label='Median Flux  [Aperture : 0.2"]')
-                l3, = p2.plot(wave, np.mean(totime_cutout_aperlselect,axis=1),label="Mean Flux  [Aperture : "+"{:.3f}".format(sizel)+'"]')
-                l4, = p2.plot(wave, np.median(totime_cutout_aperlselect,axis=1),label="Median Flux [Aperture : "+"{:.3f}".format(sizel)+'"]')		
+                p2 = fig.add_axes([0.175, 0.65, 0.20, 0.20])
+                l2, = p2.plot(wave, totime_peak,label="Peak Flux")
+                l3, = p2.plot(wave, np.mean(totime_aperl,axis=1),label="Mean Flux  [Aperture : "+"{:.3f}".format(sizel)+'"]')
+                l4, = p2.plot(wave, np.median(totime_aperl,axis=1),label="Median Flux [Aperture : "+"{:.3f}".format(sizel)+'"]')		
 
                 #leg = p.legend(loc=1,numpoints=1,prop={'size': 6})
                 leg = p.legend([l1,l2,l3,l4], ["Total Flux [Aperture : "+"{:.3f}".format(sizel)+'"]',
@@ -1179,16 +1288,63 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
 
                 if png_output:
                     fig.savefig(png_output,dpi=200)
-                else:
-                    plt.show()
                 if csv_output:    
-		    csvarr=np.array([wave,totime[:,ys,xs],np.median(totime_cutout_aperlselect,axis=1),np.mean(totime_cutout_aperlselect,axis=1),totime_chl]).T
+		    csvarr=np.array([wave,totime_peak,np.median(totime_aperl,axis=1),np.mean(totime_aperl,axis=1),totime_chl]).T
 		    np.savetxt(csv_output, csvarr, delimiter=',', header="Wavelength(microns),Int_Time_PeakFlux(s),Int_Time_MedianFlux(s),Int_Time_MeanFlux(s),Int_Time_Total_Aperture_Flux(s)", comments="",fmt='%.4f')
             if verb > 1:
-                fig = plt.figure()
+                # first channel in the aperture
+                totime_img = np.zeros(observedCube.shape[1:])
+                totime_img[maskl.iy, maskl.ix] = totime_aperl[0]
+                fig = new_figure(figures)
+                p = fig.add_subplot(111)
+                p.imshow(maskl.cutout(totime_img))
+
+        ##################################################################
+        # Case 3: find the limiting magnitude for a given s/n and time
+        ##################################################################
+        elif calc == "limmag":
+            if verb > 1: print "Case 3: find limiting magnitude for a given S/N and integration time"
+
+            # the signal scales with the source flux, closed form per
+            # pixel, per channel and for the aperture
+            totime = itime*nframes
+            aper_sum_chl = maskl.sum(observedCube)
+            noise_sum_chl = maskl.sum(noisetotal)
+
+            limmag_peak = mag - 2.5*np.log10(limiting_flux(observedCube[:,ys,xs], noisetotal[:,ys,xs], totime, snr))
+            limmag_chl = mag - 2.5*np.log10(limiting_flux(aper_sum_chl, noise_sum_chl, totime, snr))
+            limmagl = mag - 2.5*log10(limiting_flux(aper_sum_chl.sum(), noise_sum_chl.sum(), totime, snr))
+
+            if verb > 1: print 'Limiting magnitude (aperture = %.4f") = %.4f' % (sizel, limmagl)
+
+            peakSNR=""
+            medianSNR=""
+            meanSNR=""
+            medianSNRl=""
+            meanSNRl=""
+            totalSNRl=""
+            minexptime=""
+            medianexptime=""
+            meanexptime=""
+            medianexptimel=""
+            meanexptimel=""
+            totalexptimel=""
+            limmagpeak = str("%0.4f" % np.max(limmag_peak))
+            limmagtotl = str("%0.4f" % limmagl)
+
+            if verb > 0:
+                fig = new_figure(figures)
                 p = fig.add_subplot(111)
-                p.imshow(totime[0,:,:])
-                plt.show()
+                p.plot(wave, limmag_chl, c="k", label="Total Flux [Aperture : "+"{:.3f}".format(sizel)+'"]')
+                p.plot(wave, limmag_peak, label="Peak Flux")
+                p.legend(loc=1,numpoints=1,prop={'size': 6})
+                p.set_xlabel("Wavelength ($\mu$m)")
+                p.set_ylabel("Limiting magnitude [Vega]")
+                if png_output:
+                    fig.savefig(png_output,dpi=200)
+            if csv_output:
+                csvarr=np.array([wave,limmag_peak,limmag_chl]).T
+                np.savetxt(csv_output, csvarr, delimiter=',', header="Wavelength(microns),Limiting_Mag_Peak,Limiting_Mag_Aperture_Total", comments="",fmt='%.4f')
 
 
     ###########################################################################
@@ -1199,7 +1355,8 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
     else:
 
         # Scale by the zeropoint flux
-        subimage *= flux_phot
+        # (a copy, image is the shared normalized PSF)
+        subimage = subimage*flux_phot
 
         ############################# NOISE ####################################
         # Calculate total background number of photons for whole tel aperture
@@ -1222,6 +1379,7 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
         #readnoise = sqrt(coadds)*readnoise
         #darknoise = (sqrt(darkcurrent*itime))
         darknoise = darkcurrent       ## electrons/s
+        readnoise_frame = readnoise     ## electrons per frame
         readnoise = readnoise**2.0/itime  ## scale read noise
 
                                         # total noise per pixel
@@ -1245,6 +1403,53 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
         if verb > 1: print
         if verb > 1: print
 
+        ##################################################
+        # Saturation from the expected rates: per frame, and
+        # expected saturated pixels in the total integration
+        ##################################################
+        zpsat = zp*scale**2 if source == 'extended' else zp
+        psfsub = tmtImage/(flux_phot*collarea*efftot)
+        skyrate = float(np.squeeze(background))
+        sat = saturation(mag, psfsub, zpsat, collarea, efftot, skyrate,
+                         darkcurrent, itime, gain, sat_limit, readnoise=readnoise_frame)
+        saturated = int(round(float(expected_saturated(mag, psfsub, zpsat, collarea,
+                        efftot, skyrate, darkcurrent, itime*nframes, gain, sat_limit,
+                        readnoise=readnoise_frame, nframes=nframes))))
+        if verb > 1: print 'Maximum itime before saturation = %.4f seconds' % sat["max_itime"]
+
+        ##################################################
+        # Crowded field: all the catalog sources at once
+        ##################################################
+        if catalog is not None:
+            cat_x,cat_y,cat_mag = read_catalog(catalog)
+            cat_flux = zp*10**(-0.4*cat_mag)*collarea*efftot # photons/s
+            field = simulate_field(cat_x, cat_y, cat_flux, image, background,
+                                   noise, itime, nframes, radiusl,
+                                   shape=field_shape, rng=rng)
+            if verb > 1: print "Field: %i sources, median S/N = %.4f" % (len(cat_mag), np.nanmedian(field["snr"]))
+
+            if csv_output:
+                csvarr=np.array([cat_x,cat_y,cat_mag,field["signal"],field["noise"],field["snr"]]).T
+                np.savetxt(csv_output, csvarr, delimiter=',', header="x(pixels),y(pixels),Magnitude,Signal_Aperture,Noise_Aperture,SNR_Aperture", comments="",fmt='%.4f')
+
+            if products:
+                products.add("SIMFIELD_TOT", field["simImage_tot"], "electrons")
+
+        ##################################################
+        # Full detector frame, tiled and streamed to disk
+        ##################################################
+        if detector_output:
+            if catalog is not None:
+                det_x,det_y,det_flux = cat_x,cat_y,cat_flux
+            else:
+                det_x = field_shape[1]/2 + positions[0]
+                det_y = field_shape[0]/2 + positions[1]
+                det_flux = flux_phot*collarea*efftot
+            simulate_detector(detector_output, det_x, det_y, det_flux, image,
+                              background, darkcurrent, readnoise_frame,
+                              itime, nframes, gain, shape=field_shape,
+                              nthreads=nthreads, seed=seed)
+            if verb > 1: print "Detector frame written to %s" % detector_output
 
 
         ####################################################
@@ -1262,7 +1467,7 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
             #print np.mean(snrMap)
 
             if verb > 1:
-                fig = plt.figure()
+                fig = new_figure(figures)
                 p = fig.add_subplot(111)
                 #p.hist(snrMap)
 
@@ -1277,58 +1482,54 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
                 p.set_xlabel("Signal/Noise")
                 p.set_ylabel("Number of pixels")
                 p.set_yscale("log")
-                plt.show()
 
             if verb > 1:
-                fig = plt.figure()
+                fig = new_figure(figures)
                 p = fig.add_subplot(111)
                 p.imshow(snrMap,interpolation='none')
-                plt.show()
 
-            if verb > 2:
-                hdu = fits.PrimaryHDU(snrMap)
-                hdul = fits.HDUList([hdu])
-                hdul.writeto('snrImage.fits',clobber=True)
+            if products:
+                products.add("SNRIMAGE", snrMap)
 
             # model + background
             totalObserved = tmtImage*itime*nframes + background*itime*nframes + darkcurrent*itime*nframes + readnoise*itime*nframes
             #print totalObserved.shape
             #print totalObserved.dtype
 
-            if verb > 2:
-                hdu = fits.PrimaryHDU(totalObserved)
-                hdul = fits.HDUList([hdu])
-                hdul.writeto('new2.fits',clobber=True)
-
-            # model + background + noise
-            # [electrons]
-            simImage_tot = np.random.poisson(lam=totalObserved, size=totalObserved.shape).astype("float64")
-            #print simImage_tot.dtype
-
-            # divide back by total integration time to get the simulated image
-            simImage = simImage_tot/(itime*nframes) # [electrons/s]
-            simImage_DN = simImage_tot/gain # [DNs]
-
-            if simImage_DN.max() > sat_limit:
-                saturated=len(np.where(simImage_DN>sat_limit)[0])
-            else:
-                saturated=0     
-		
-            if verb > 2:
+            if nmc:
+                # S/N distribution from nmc realizations, in parallel
+                skyObserved = float(np.squeeze(background*itime*nframes + darkcurrent*itime*nframes + readnoise*itime*nframes))
+                mc = run_montecarlo(totalObserved, skyObserved,
+                                    maskl.to_image(totalObserved.shape)>0,
+                                    (ys,xs), nmc, seed=seed, nproc=nproc)
+                if verb > 1: print 'Monte-Carlo S/N (aperture = %.4f") = %.4f' % (sizel, mc["snr_empirical"])
+
+            if framestack:
+                # individual frames of the stack, one at a time
+                rate = tmtImage + background + darkcurrent
+                stack = stack_frames(generate_frames(rate, itime, nframes, readnoise_frame, rng),
+                                     nframes, stack_output, nsigma=clip_sigma,
+                                     model=frame_model(rate, itime, readnoise_frame))
+                stack_snrl = stack_snr(stack, float(np.squeeze(background + darkcurrent))*itime,
+                                       maskl.to_image(rate.shape)>0)
+                if verb > 1: print 'Frame stack S/N (aperture = %.4f") = %.4f' % (sizel, stack_snrl[0])
+
+            if products:
+                products.add("TOTALOBSERVED", totalObserved, "electrons")
+
+            if products:
+                # model + background + noise
                 # [electrons]
-                hdu = fits.PrimaryHDU(simImage_tot)
-                hdul = fits.HDUList([hdu])
-                hdul.writeto('simImage_tot.fits',clobber=True)
+                simImage_tot = rng.poisson(lam=totalObserved, size=totalObserved.shape).astype("float64")
+                #print simImage_tot.dtype
 
-                # [electrons/s]
-                hdu = fits.PrimaryHDU(simImage)
-                hdul = fits.HDUList([hdu])
-                hdul.writeto('simImage.fits',clobber=True)
+                # divide back by total integration time to get the simulated image
+                simImage = simImage_tot/(itime*nframes) # [electrons/s]
+                simImage_DN = simImage_tot/gain # [DNs]
 
-                # [DNs]
-                hdu = fits.PrimaryHDU(simImage_DN)
-                hdul = fits.HDUList([hdu])
-                hdul.writeto('simImage_DN.fits',clobber=True)
+                products.add("SIMIMAGE_TOT", simImage_tot, "electrons")
+                products.add("SIMIMAGE", simImage, "electrons/s")
+                products.add("SIMIMAGE_DN", simImage_DN, "DN")
 
             # Sky background counts
             #bkg_func = Background2D(simImage_DN,simImage_DN.shape)     # constant
@@ -1337,61 +1538,44 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
             #print bkg_func.background_rms_median
 
             #image = mask.to_image(shape=((200, 200)))
-            data_cutout = mask.cutout(snrMap)
-            data_cutoutl = maskl.cutout(snrMap)
-            if photutils.__version__ == "0.4":
-                data_cutout_aper = mask.multiply(snrMap) # in version 0.4 of photutils
-                data_cutout_aperl = maskl.multiply(snrMap) # in version 0.4 of photutils
-            else:
-                data_cutout_aper = mask.apply(snrMap)
-                data_cutout_aperl = maskl.apply(snrMap)
-
-            flatarray=np.ones(snrMap.shape)
-            if photutils.__version__ == "0.4":
-                maskimg= mask.multiply(flatarray)
-                masklimg= maskl.multiply(flatarray)
-            else:
-                maskimg= mask.apply(flatarray)
-                masklimg= maskl.apply(flatarray)
+            snr_aper = mask.values(snrMap)
+            snr_aperl = maskl.values(snrMap)
 
             #print np.min(snrMap)
             if verb > 1: print "Peak S/N = %.4f" % np.max(snrMap)
-            if verb > 1: print "Median S/N = %.4f" % np.median(data_cutout_aper)
-            if verb > 1: print "Mean S/N = %.4f" % np.mean(data_cutout_aper)
+            if verb > 1: print "Median S/N = %.4f" % np.median(snr_aper)
+            if verb > 1: print "Mean S/N = %.4f" % np.mean(snr_aper)
 
             if verb > 1:
-                fig = plt.figure()
+                fig = new_figure(figures)
                 p = fig.add_subplot(111)
-                p.imshow(data_cutout_aper,interpolation='none')
-                plt.show()
+                p.imshow(mask.apply(snrMap),interpolation='none')
 
-            phot_table = aperture_photometry(signal, aperturel, error=noisemap)
-            #print phot_table
             ###########################
             # summation of the aperture
             ###########################
-            snr_int = phot_table["aperture_sum"].quantity/phot_table["aperture_sum_err"].quantity
-            if verb > 1: print 'S/N (aperture = %.4f") = %.4f' % (sizel, snr_int[0])
+            # exact pixel overlap (photutils aperture_photometry)
+            aperturel = circular_aperture(subimage.shape, (xs,ys), radiusl, 'exact')
+            snr_int = aperturel.sum(signal)/np.sqrt(aperturel.sum(noisemap**2))
+            if verb > 1: print 'S/N (aperture = %.4f") = %.4f' % (sizel, snr_int)
             
             if verb > 1:
-                phot_table = aperture_photometry(signal, apertures, error=noisemap)
-                dn     = np.array([phot_table["aperture_sum_%i" % i] for i in range(len(radii))])
-                dn_err = np.array([phot_table["aperture_sum_err_%i" % i] for i in range(len(radii))])
-                #print phot_table
+                apertures = [circular_aperture(subimage.shape, (xs,ys), r, 'exact') for r in radii]
+                dn     = np.array([a.sum(signal) for a in apertures])
+                dn_err = np.array([np.sqrt(a.sum(noisemap**2)) for a in apertures])
 
-                fig = plt.figure()
+                fig = new_figure(figures)
                 p = fig.add_subplot(111)
                 p.errorbar(radii,dn,yerr=dn_err)
                 #p.scatter(radii,dn)
                 p.set_xlabel("Aperture radius [pixels]")
                 p.set_ylabel("Counts [photons/s/aperture]")
-                plt.show()
 
 	    peakSNR = str("%0.4f" % np.max(snrMap))
-	    medianSNR = str("%0.4f" % np.median(data_cutout_aper[np.where(maskimg>0)]))
-	    meanSNR = str("%0.4f" % np.mean(data_cutout_aper[np.where(maskimg>0)]))
-	    medianSNRl = str("%0.4f" % np.median(data_cutout_aperl[np.where(masklimg>0)]))
-	    meanSNRl = str("%0.4f" % np.mean(data_cutout_aperl[np.where(masklimg>0)]))	    
+	    medianSNR = str("%0.4f" % np.median(snr_aper))
+	    meanSNR = str("%0.4f" % np.mean(snr_aper))
+	    medianSNRl = str("%0.4f" % np.median(snr_aperl))
+	    meanSNRl = str("%0.4f" % np.mean(snr_aperl))
 	    totalSNRl = str("%0.4f" % snr_int)	                    # integrated aperture SNR at pre-defined fixed aperture
 
 	    minexptime = ""
@@ -1404,14 +1588,13 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
             #print np.min(snrMap)
 
             if verb > 1: print "Peak S/N = %.4f" % np.max(snrMap)
-            if verb > 1: print "Median S/N = %.4f" % np.median(data_cutout_aper)
-            if verb > 1: print "Mean S/N = %.4f" % np.mean(data_cutout_aper)
+            if verb > 1: print "Median S/N = %.4f" % np.median(snr_aper)
+            if verb > 1: print "Mean S/N = %.4f" % np.mean(snr_aper)
             
             if verb > 1:
-                fig = plt.figure()
+                fig = new_figure(figures)
                 p = fig.add_subplot(111)
-                p.imshow(data_cutout_aper,interpolation='none')
-                plt.show()
+                p.imshow(mask.apply(snrMap),interpolation='none')
             
             #simImage = dblarr(s[1], s[2])
             #for i = 0, s[1]-1 do begin
@@ -1440,29 +1623,14 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
 
             #print totime
             #print np.max(totime)
-            data_cutout = mask.cutout(totime)
-            data_cutoutl = maskl.cutout(totime)
-            if photutils.__version__ == "0.4":
-                data_cutout_aper = mask.multiply(totime) # in version 0.4 of photutils
-                data_cutout_aperl = maskl.multiply(totime) # in version 0.4 of photutils
-            else:
-                data_cutout_aper = mask.apply(totime)
-                data_cutout_aperl = maskl.apply(totime)
-
-
-            flatarray=np.ones(totime.shape)
-            if photutils.__version__ == "0.4":
-                maskimg= mask.multiply(flatarray)
-                masklimg= maskl.multiply(flatarray)
-            else:
-                maskimg= mask.apply(flatarray)
-                masklimg= maskl.apply(flatarray)
+            totime_aper = mask.values(totime)
+            totime_aperl = maskl.values(totime)
 
             minexptime= str("%0.4f" %np.min(totime))
-            medianexptime= str("%0.4f" %np.median(data_cutout_aper[np.where(maskimg>0)]))
-            meanexptime=  str("%0.4f" %np.mean(data_cutout_aper[np.where(maskimg>0)]))
-            medianexptimel= str("%0.4f" %np.median(data_cutout_aperl[np.where(masklimg>0)]))
-            meanexptimel=  str("%0.4f" %np.mean(data_cutout_aperl[np.where(masklimg>0)]))
+            medianexptime= str("%0.4f" %np.median(totime_aper))
+            meanexptime=  str("%0.4f" %np.mean(totime_aper))
+            medianexptimel= str("%0.4f" %np.median(totime_aperl))
+            meanexptimel=  str("%0.4f" %np.mean(totime_aperl))
             peakSNR=""
             medianSNR=""
             meanSNR=""
@@ -1472,48 +1640,24 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
 	    totalSNRl = ""	                    # integrated aperture SNR at pre-defined fixed aperture
 
             if verb > 1: print "Min time (peak flux) = %.4f seconds" % np.min(totime)
-            if verb > 1: print "Median time (median aperture flux) = %.4f seconds" % np.median(data_cutout_aper)
-            if verb > 1: print "Mean time (mean aperture flux) = %.4f seconds" % np.mean(data_cutout_aper)
+            if verb > 1: print "Median time (median aperture flux) = %.4f seconds" % np.median(totime_aper)
+            if verb > 1: print "Mean time (mean aperture flux) = %.4f seconds" % np.mean(totime_aper)
 
             if verb > 1:
                 print totime.shape
-                fig = plt.figure()
+                fig = new_figure(figures)
                 p = fig.add_subplot(111)
                 p.imshow(totime[0,:])
-                plt.show()
 
 
-            totalObserved = tmtImage*itime*nframes + background*itime*nframes + darkcurrent*itime*nframes + readnoise*itime*nframes
-            # model + background + noise
-            # [electrons]
-            simImage_tot = np.random.poisson(lam=totalObserved, size=totalObserved.shape).astype("float64")
-            # divide back by total integration time to get the simulated image
-            simImage = simImage_tot/(itime*nframes) # [electrons/s]
-            simImage_DN = simImage_tot/gain # [DNs]
-
-            if simImage_DN.max() > sat_limit:
-                saturated=len(np.where(simImage_DN>sat_limit)[0])
-            else:
-                saturated=0     
 
 
             flatarray=np.ones(tmtImage.shape)
             # exposure time for aperture
-            data_cutout = mask.cutout(tmtImage)
-            data_cutoutl = maskl.cutout(tmtImage)
-            #data_cutout_aper = mask.apply(tmtImage)
-            if photutils.__version__ == "0.4":
-                data_cutout_aper = mask.multiply(tmtImage) # in version 0.4 of photutils
-                data_cutout_aperl = maskl.multiply(tmtImage) # in version 0.4 of photutils
-		noise_cutout_aperl = maskl.multiply(flatarray)+noisetotal
-            else:
-                data_cutout_aper = mask.apply(tmtImage)
-                data_cutout_aperl = maskl.apply(tmtImage)
-		noise_cutout_aperl = maskl.apply(flatarray)+noisetotal
-	    
-	    
-            aper_totsuml = data_cutout_aperl.sum()+noise_cutout_aperl.sum()
-            aper_suml = data_cutout_aperl.sum()
+            noise_cutout_aperl = maskl.apply(flatarray)+noisetotal
+
+            aper_suml = maskl.sum(tmtImage)
+            aper_totsuml = aper_suml+noise_cutout_aperl.sum()
             ###########################
             # summation of the aperture
             ###########################
@@ -1522,6 +1666,35 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
 
 	    totalexptimel= str("%0.4f" %totimel) # integrated aperture exptime at pre-defined fixed aperture 
 
+        ##################################################################
+        # Case 3: find the limiting magnitude for a given s/n and time
+        ##################################################################
+        elif calc == "limmag":
+
+            if verb > 1: print "Case 3: find limiting magnitude for a given S/N and integration time"
+
+            totime = itime*nframes
+            noiserate = float(np.squeeze(noisetotal))
+
+            limmagpeak = mag - 2.5*log10(limiting_flux(tmtImage.max(), noiserate, totime, snr))
+            limmagl = mag - 2.5*log10(limiting_flux(maskl.sum(tmtImage), maskl.weights.sum()*noiserate, totime, snr))
+            if verb > 1: print 'Limiting magnitude (aperture = %.4f") = %.4f' % (sizel, limmagl)
+
+            peakSNR=""
+            medianSNR=""
+            meanSNR=""
+            medianSNRl=""
+            meanSNRl=""
+            totalSNRl=""
+            minexptime=""
+            medianexptime=""
+            meanexptime=""
+            medianexptimel=""
+            meanexptimel=""
+            totalexptimel=""
+            limmagpeak = str("%0.4f" % limmagpeak)
+            limmagtotl = str("%0.4f" % limmagl)
+
 
             
     #jsondict={'Magnitude of Source (Vega)':mag,'Peak Value of SNR':peakSNR,'Median Value of SNR (Aperture =0.4")':medianSNR,'Mean Value of SNR (Aperture =0.4")':meanSNR,'Median Value of SNR (Aperture = '+"{:.3f}".format(sizel)+'")':medianSNRl,'Median Value of SNR (Aperture = '+"{:.3f}".format(sizel)+'")':meanSNRl,'Exposure time (Minimum) ':minexptime,'Median Value of Exposure time (Aperture =0.4\")':medianexptime,'Mean Value of Exposure time (Aperture =0.4")':meanexptime,'Median Value of Exposure time (Aperture = '+"{:.3f}".format(sizel)+'")':medianexptimel,'Mean Value of Exposure time (Aperture = '+"{:.3f}".format(sizel)+'")':meanexptimel,"Flux density of Source":str("%0.4e" %flambda[0])}
@@ -1544,7 +1717,41 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
 	
 
     jsondict=OrderedDict([(inputstr,inputvalue),('Filter',str(filter)), ('Central Wavelength [microns]',"{:.3f}".format(lambdac[0]*.0001)),('Resolution',resolutionstr),('Magnitude of Source [Vega]'+magadd,str(mag)),("Flux density of Source [erg/s/cm^2/Ang]",str("%0.4e" %flambda)),('Peak Value of SNR',peakSNR),('Median Value of SNR (Aperture = '+"{:.3f}".format(sizel)+'")',medianSNRl),('Mean Value of SNR (Aperture = '+"{:.3f}".format(sizel)+'")',meanSNRl),('Median Value of SNR (Aperture =0.4")',medianSNR),('Mean Value of SNR (Aperture =0.4")',meanSNR),('SNR for Total Flux (Aperture = '+"{:.3f}".format(sizel)+'")',totalSNRl),('Total integration time [s] for Peak Flux ',minexptime),('Total integration time [s] for Median Flux (Aperture = '+"{:.3f}".format(sizel)+'")',medianexptimel),('Total integration time [s] for Mean Flux (Aperture = '+"{:.3f}".format(sizel)+'")',meanexptimel),('Total integration time [s] for Total Flux (Aperture = '+"{:.3f}".format(sizel)+'")',totalexptimel),('Saturated Pixels',saturatedstr)])
-    print(json.dumps(jsondict))
+    if mode.lower() == 'ifs' and calc == "snr":
+        for width in bin_widths or []:
+            jsondict['Maximum SNR for Total Flux in Bins of %i Channels (Aperture = ' % width+"{:.3f}".format(sizel)+'")'] = str("%0.4f" % np.max(bin_table[width][1]))
+        if velocity_window:
+            jsondict['SNR for Total Flux in %g km/s Window (Aperture = ' % velocity_window+"{:.3f}".format(sizel)+'")'] = str("%0.4f" % window_value)
+    if mode.lower() == 'ifs' and calc == "exptime":
+        for width in bin_widths or []:
+            jsondict['Minimum Total integration time [s] for Total Flux in Bins of %i Channels (Aperture = ' % width+"{:.3f}".format(sizel)+'")'] = str("%0.4f" % np.min(bin_table[width][1]))
+        if velocity_window:
+            jsondict['Total integration time [s] for Total Flux in %g km/s Window (Aperture = ' % velocity_window+"{:.3f}".format(sizel)+'")'] = str("%0.4f" % window_value)
+    if calc == "limmag":
+        jsondict['Magnitude of Source [Vega]'+magadd] = ''
+        jsondict["Flux density of Source [erg/s/cm^2/Ang]"] = ''
+        jsondict['Input SNR'] = str(snr)
+        jsondict['Limiting Magnitude [Vega] for Peak Flux'+magadd] = limmagpeak
+        jsondict['Limiting Magnitude [Vega] for Total Flux (Aperture = '+"{:.3f}".format(sizel)+'")'+magadd] = limmagtotl
+    if mode == 'imager':
+        jsondict['Saturated Pixels per Frame'] = str(int(round(float(sat["nsat"]))))
+        jsondict['Maximum Integration Time per Frame before Saturation [s]'] = str("%0.4f" % sat["max_itime"])
+        jsondict['Brightest Unsaturated Magnitude for Integration Time per Frame [Vega]'+magadd] = str("%0.4f" % sat["brightest_mag"])
+    if mode == 'imager' and catalog is not None:
+        jsondict['Number of Sources in Field'] = str(len(cat_mag))
+        jsondict['Median SNR of Field Sources (Aperture = '+"{:.3f}".format(sizel)+'")'] = str("%0.4f" % np.nanmedian(field["snr"]))
+    if nmc and calc == "snr":
+        jsondict['Monte-Carlo Realizations'] = str(nmc)
+        jsondict['Empirical SNR for Total Flux (Aperture = '+"{:.3f}".format(sizel)+'")'] = str("%0.4f" % mc["snr_empirical"])
+        jsondict['Empirical SNR for Peak Flux'] = str("%0.4f" % mc["snr_peak_empirical"])
+        jsondict['Mean SNR of Realizations (Aperture = '+"{:.3f}".format(sizel)+'")'] = str("%0.4f" % mc["snr_mean"])
+        for q in percentiles:
+            jsondict['SNR of Realizations, %g percentile' % q] = str("%0.4f" % mc["snr_percentiles"][q])
+    if framestack and calc == "snr":
+        jsondict['Frame Stack SNR for Total Flux (Aperture = '+"{:.3f}".format(sizel)+'")'] = str("%0.4f" % stack_snrl[0])
+        jsondict['Frame Stack SNR for Total Flux, Sigma-Clipped (Aperture = '+"{:.3f}".format(sizel)+'")'] = str("%0.4f" % stack_snrl[1])
+        jsondict['Frame Stack Rejected Pixels'] = str(stack.nrejected())
+    return jsondict
 
         #tmtImage_aper = aperture_photometry(tmtImage, aperture)
         #tmtImage_sum = tmtImage_aper["aperture_sum"]
@@ -1572,6 +1779,63 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
         #print simImage_sum
 
 
+def run_filters(filters=None, simdir='~/data/iris/sim/', psfdir='~/data/iris/sim/',
+                verb=0, **kwargs):
+    """
+    Evaluate the same source in every filter of filter_info.dat, or in
+    the list filters, in one call.  The PSF planes are loaded once per
+    distinct file and extension (load_psf), and the IFS background of
+    every filter comes from the same Gemini spectrum, read once.
+
+    Returns an OrderedDict of the IRIS_ETC results by filter, or
+    {"Error": message} for the filters which failed.
+    """
+    if not filters:
+        filters = filter_names(simdir)
+    results = OrderedDict()
+    for name in filters:
+        try:
+            results[name] = IRIS_ETC(filter=name, full_background=True,
+                                     simdir=simdir, psfdir=psfdir, verb=verb,
+                                     **kwargs)
+        except Exception as e:
+            results[name] = OrderedDict([("Error", "%s: %s" % (type(e).__name__, e))])
+    return results
+
+
+def run_redshifts(z, spectrum="Vega", filter="K", resolution=4000,
+                  simdir='~/data/iris/sim/', psfdir='~/data/iris/sim/',
+                  verb=0, **kwargs):
+    """
+    Evaluate a template spectrum (Vega or a user spectrum file) over the
+    redshift grid z (IFS mode).  The template is read and convolved once,
+    the observed spectra of all the redshifts are interpolated together
+    on the IFS grid, and the PSF, background and aperture products are
+    shared between the redshifts (memoize).
+
+    Returns an OrderedDict of the IRIS_ETC results by redshift, or
+    {"Error": message} for the redshifts which failed.  Raises ValueError
+    for a mode other than IFS.
+    """
+    mode = kwargs.setdefault("mode", "IFS")
+    if str(mode).lower() != "ifs":
+        raise ValueError("the redshift grid needs -mode IFS, not %s" % mode)
+    z = [float(zi) for zi in np.atleast_1d(z)]
+    name = "vega_all.fits" if str(spectrum).lower() == "vega" else spectrum
+    template = load_template(name, simdir, resolution, spectrum_digest(name))
+    template.rows(ifs_wave(filter, resolution, simdir), z)
+    results = OrderedDict()
+    for zi in z:
+        try:
+            results["%g" % zi] = IRIS_ETC(spectrum=spectrum, redshift=zi,
+                                          filter=filter, resolution=resolution,
+                                          simdir=simdir, psfdir=psfdir,
+                                          verb=verb, **kwargs)
+        except Exception as e:
+            results["%g" % zi] = OrderedDict([("Error", "%s: %s" % (type(e).__name__, e))])
+    return results
+
+
 # ~/python.linux/dev/iris/snr/iris_snr_sim.py
 # ~/python.linux/packages/IRIS_snr_sim/iris_snr_sim.py
 
@@ -1580,6 +1844,7 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
 #  Imager mode
 #    iris_snr_sim.py -mag 20.0 -filter K -scale 0.004 -mode imager -calc snr -nframes 2
 #    iris_snr_sim.py -mag 20.0 -filter K -scale 0.004 -mode imager -calc exptime -snr 10
+#    iris_snr_sim.py -filter K -scale 0.004 -mode imager -calc limmag -snr 10 -itime 900
 #  IFS mode
 #    Case 1 (Vega or Flat spectrum)
 #      iris_snr_sim.py -mag 20.0 -filter K -scale 0.004 -mode IFS -calc exptime -snr 50.0
@@ -1603,124 +1868,213 @@ def IRIS_ETC(filter = "K", mag = 21.0, flambda=1.62e-19, itime = 1.0,
 
 
 
-parser = argparse.ArgumentParser(description='TMT IRIS S/N exposure calculator')
-
-
-parser.add_argument('-filter', metavar='value', type=str, nargs='?',
-                    default="K", help='filter name')
-parser.add_argument('-scale', metavar='value', type=float, nargs='?',
-                    default=0.004, help='detector scale [arcsec]')
-parser.add_argument('-itime', metavar='value', type=float, nargs='?',
-                    default=1.0, help='integration time [seconds]')
-parser.add_argument('-resolution', metavar='value', type=int, nargs='?',
-                    default=4000, help='resolution of the instrument')
-parser.add_argument('-spectrum',  choices=['Vega','Flat','Emission'],
-                    default="Vega", help='input spectrum')
-parser.add_argument('-wavelength', metavar='value', type=float, nargs='?',
-                    default="2.22", help='emission line wavelength [microns]')
-parser.add_argument('-line-width', metavar='value', type=float, nargs='?',
-                    default="200.", help='emission line width in velocity [km/s]')
-parser.add_argument('-nframes', metavar='value', type=int, nargs='?',
-                    default=1, help='number of frames')
-parser.add_argument('-snr', metavar='value', type=float, nargs='?',
-                    default=10.0, help='signal-to-noise ratio')
-parser.add_argument('-calc', choices=['snr','exptime'], required=True,
-                    help='calculation performed')
-parser.add_argument('-mode', choices=['imager','IFS'], required=True,
-                    help='instrumental mode')
-parser.add_argument('-source', metavar='value', type=str, nargs='?',
-                    default="point_source", help='[point_source, extended]')
-parser.add_argument('-source_size', metavar='value', type=float, nargs='?',
-                    default="0.2", help='size of extended object in arcsecond')
-parser.add_argument('-zenith-angle', type=float, metavar='value', nargs='?',
-                    default=30., help='zenith angle of simulated PSF [degrees]')
-parser.add_argument('-atm-cond', type=float, metavar='value', nargs='?',
-                    default=50., help='atmosphere conditions of simulated PSF')
-parser.add_argument('-psf-loc', nargs=2, type=float, metavar='value',
-                    default=[8.8, 8.8], help='location of PSF on the focal plane of the instrument [arcsec]')
-
-parser.add_argument('-psf-old', action='store_true',
-                     help='use old PSFs')
-
-parser.add_argument('-o', nargs='?', metavar='value', default=None,
-                    help='Output file name, else display to screen')
-parser.add_argument('-csv', nargs='?', metavar='value', default=None,
-                    help='Output csv filename')
-
-group1 = parser.add_mutually_exclusive_group(required=True)
-group1.add_argument('-mag', metavar='value', type=float, nargs='?',
-                    default=None, help='magnitude of source [Vega]')
-group1.add_argument('-flambda', metavar='value', type=float, nargs='?',
-                    default=None, help='flux density of source [erg/s/cm^2/Ang]')
-
-
-if not os.path.exists('config.ini'):
-    print "Missing config.ini file!"
-    sys.exit()
-
-try:
-    #config = configparser.ConfigParser()
-    config = ConfigParser.ConfigParser()
-    config.read('config.ini')
-    simdir = config.get('CONFIG','simdir')
-    #simdir = config['CONFIG']['simdir']
-    psfdir = config.get('CONFIG','psfdir')
-    #psfdir = config['CONFIG']['psfdir']
-except:
-    print "Problem with config.ini file!"
-    print "Missing parameter?"
-    sys.exit()
-
-
-
-
-args = parser.parse_args()
-
-mag = args.mag
-flambda = args.flambda
-
-filter = args.filter
-scale = args.scale
-itime = args.itime
-resolution = args.resolution
-spectrum = args.spectrum
-wavelength = args.wavelength
-line_width = args.line_width
-
-
-zenith_angle = args.zenith_angle
-atm_cond = args.atm_cond
-psf_loc = args.psf_loc
-psf_old = args.psf_old
-
-nframes = args.nframes
-snr = args.snr
-
-mode = args.mode
-calc = args.calc
-source=args.source
-source_size=args.source_size
-png_output = args.o
-csv_output = args.csv                         
-
-
-#print mag
-#print flambda
-#sys.exit()
+def spectrum_arg(value):
+    # built-in spectrum or file of the user spectral library
+    if value in ['Vega','Flat','Emission'] or is_user_spectrum(value):
+        return value
+    raise argparse.ArgumentTypeError("invalid spectrum %s (Vega, Flat, Emission or a file)" % value)
+
+
+def etc_parser(parser_class=argparse.ArgumentParser):
+    # command line options, also used for the rows of the batch mode
+    parser = parser_class(description='TMT IRIS S/N exposure calculator')
+
+
+    parser.add_argument('-filter', metavar='value', type=str, nargs='?',
+                        default="K", help='filter name')
+    parser.add_argument('-scale', metavar='value', type=float, nargs='?',
+                        default=0.004, help='detector scale [arcsec]')
+    parser.add_argument('-itime', metavar='value', type=float, nargs='?',
+                        default=1.0, help='integration time [seconds]')
+    parser.add_argument('-resolution', metavar='value', type=int, nargs='?',
+                        default=4000, help='resolution of the instrument')
+    parser.add_argument('-spectrum', metavar='value', type=spectrum_arg,
+                        default="Vega", help='input spectrum: Vega, Flat, Emission or a FITS/ASCII file')
+    parser.add_argument('-wavelength', metavar='value', type=float, nargs='?',
+                        default="2.22", help='emission line wavelength [microns]')
+    parser.add_argument('-line-width', metavar='value', type=float, nargs='?',
+                        default="200.", help='emission line width in velocity [km/s]')
+    parser.add_argument('-nframes', metavar='value', type=int, nargs='?',
+                        default=1, help='number of frames')
+    parser.add_argument('-snr', metavar='value', type=float, nargs='?',
+                        default=10.0, help='signal-to-noise ratio')
+    parser.add_argument('-calc', choices=['snr','exptime','limmag'], required=True,
+                        help='calculation performed')
+    parser.add_argument('-mode', choices=['imager','IFS'], required=True,
+                        help='instrumental mode')
+    parser.add_argument('-source', metavar='value', type=str, nargs='?',
+                        default="point_source", help='[point_source, extended]')
+    parser.add_argument('-source_size', metavar='value', type=float, nargs='?',
+                        default="0.2", help='size of extended object in arcsecond')
+    parser.add_argument('-zenith-angle', type=float, metavar='value', nargs='?',
+                        default=30., help='zenith angle of simulated PSF [degrees]')
+    parser.add_argument('-atm-cond', type=float, metavar='value', nargs='?',
+                        default=50., help='atmosphere conditions of simulated PSF')
+    parser.add_argument('-psf-loc', nargs=2, type=float, metavar='value',
+                        default=[8.8, 8.8], help='location of PSF on the focal plane of the instrument [arcsec]')
+
+    parser.add_argument('-psf-old', action='store_true',
+                         help='use old PSFs')
+    parser.add_argument('-psf-interp', action='store_true',
+                         help='interpolate the IFS PSF in wavelength for every channel')
+
+    parser.add_argument('-catalog', metavar='value', type=str, default=None,
+                        help='imager field simulation from a catalog of sources (x, y [pixels], mag)')
+    parser.add_argument('-field-size', nargs=2, type=int, metavar='value',
+                        default=[4096, 4096], help='size of the simulated imager field [pixels]')
+    parser.add_argument('-detector-output', metavar='value', type=str, default=None,
+                        help='simulate the full imager detector frame into this FITS file')
+    parser.add_argument('-nthreads', metavar='value', type=int, default=None,
+                        help='number of threads (default: number of cores)')
+    parser.add_argument('-seed', metavar='value', type=int, default=None,
+                        help='seed of the random number generator')
+    parser.add_argument('-nmc', metavar='value', type=int, default=0,
+                        help='number of Monte-Carlo noise realizations')
+    parser.add_argument('-nproc', metavar='value', type=int, default=None,
+                        help='number of processes (default: number of cores)')
+    parser.add_argument('-framestack', action='store_true',
+                        help='simulate the individual frames of the stack')
+    parser.add_argument('-stack-output', metavar='value', type=str, default=None,
+                        help='FITS file of the simulated frames and co-add statistics')
+    parser.add_argument('-clip-sigma', metavar='value', type=float, default=3.0,
+                        help='sigma clipping threshold of the frame stack')
+    parser.add_argument('-product-output', metavar='value', type=str, default=None,
+                        help='multi-extension FITS file of the simulated products')
+    parser.add_argument('-compress', action='store_true',
+                        help='tile compress the FITS products (lossless)')
+    parser.add_argument('-cache', metavar='value', type=str, default=None,
+                        help='SQLite file of cached results')
+    parser.add_argument('-bin-widths', nargs='+', type=int, metavar='value',
+                        default=None, help='IFS spectral bin widths [channels]')
+    parser.add_argument('-velocity-window', metavar='value', type=float,
+                        default=None, help='IFS velocity window around the wavelength [km/s]')
+    parser.add_argument('-line-window', metavar='value', type=float,
+                        default=None, help='simulate only +-value line widths around an emission line')
+    parser.add_argument('-aperture-method', metavar='value', type=str,
+                        default='center', choices=['center', 'exact'],
+                        help='aperture pixels: center (default) or exact (fractional overlap)')
+    parser.add_argument('-airmass-background', action='store_true',
+                        help='scale the sky background with the airmass of the zenith angle')
+    parser.add_argument('-all-filters', nargs='*', metavar='filter', default=None,
+                        help='evaluate the source in all filters, or in the listed filters')
+    parser.add_argument('-redshift', metavar='value', type=float, default=None,
+                        help='redshift of the Vega or user template spectrum (IFS)')
+    parser.add_argument('-redshifts', nargs='+', type=float, metavar='value',
+                        default=None, help='evaluate the template over a redshift grid (IFS)')
+
+    parser.add_argument('-config', metavar='value', type=str, default='config.ini',
+                        help='configuration file of the data directories (default: config.ini)')
+
+    parser.add_argument('-o', nargs='?', metavar='value', default=None,
+                        help='Output file name, else display to screen')
+    parser.add_argument('-csv', nargs='?', metavar='value', default=None,
+                        help='Output csv filename')
+
+    # not required for limmag, checked in parse_etc_args
+    group1 = parser.add_mutually_exclusive_group()
+    group1.add_argument('-mag', metavar='value', type=float, nargs='?',
+                        default=None, help='magnitude of source [Vega]')
+    group1.add_argument('-flambda', metavar='value', type=float, nargs='?',
+                        default=None, help='flux density of source [erg/s/cm^2/Ang]')
+    return parser
+
+
+def read_config(filename='config.ini'):
+    # data directories, passed on to IRIS_ETC (simdir, psfdir)
+    if not os.path.exists(filename):
+        raise IOError("Missing %s file!" % filename)
+
+    try:
+        #config = configparser.ConfigParser()
+        config = ConfigParser.ConfigParser()
+        config.read(filename)
+        simdir = config.get('CONFIG','simdir')
+        #simdir = config['CONFIG']['simdir']
+        psfdir = config.get('CONFIG','psfdir')
+        #psfdir = config['CONFIG']['psfdir']
+    except ConfigParser.Error:
+        raise ValueError("Problem with %s file! Missing parameter?" % filename)
+    return simdir, psfdir
+
+
+def parse_etc_args(parser, argv=None):
+    # parse and check the command line options
+    args = parser.parse_args(argv)
+    if args.calc != "limmag" and args.mag is None and args.flambda is None:
+        parser.error("one of the arguments -mag -flambda is required")
+    return args
+
+
+def etc_kwargs(args):
+    # IRIS_ETC keywords from the parsed command line options
+    return dict(mode=args.mode, calc=args.calc, nframes=args.nframes,
+                snr=args.snr, itime=args.itime, mag=args.mag,
+                flambda=args.flambda, resolution=args.resolution,
+                filter=args.filter, scale=args.scale, spectrum=args.spectrum,
+                lam_obs=args.wavelength, line_width=args.line_width,
+                zenith_angle=args.zenith_angle, atm_cond=args.atm_cond,
+                psf_loc=args.psf_loc, png_output=args.o, source=args.source,
+                source_size=args.source_size, psf_old=args.psf_old,
+                psf_interp=args.psf_interp, catalog=args.catalog,
+                field_shape=args.field_size,
+                detector_output=args.detector_output, nthreads=args.nthreads,
+                seed=args.seed, nmc=args.nmc, nproc=args.nproc,
+                framestack=args.framestack or args.stack_output is not None,
+                stack_output=args.stack_output, clip_sigma=args.clip_sigma,
+                product_output=args.product_output, compress=args.compress,
+                bin_widths=args.bin_widths,
+                velocity_window=args.velocity_window,
+                line_window=args.line_window,
+                aperture_method=args.aperture_method,
+                airmass_background=args.airmass_background,
+                redshift=args.redshift, csv_output=args.csv)
+
 
 ###############################################################
 # verb = 0    No output
 # verb = 1    Normal verbosity (including basic plotting)
 # verb = 2    Diagnostic verbosity (all plots)
-# verb = 3    Additional diagnostics (writes all fits files)
+# verb = 3    Additional diagnostics (writes all products to
+#             iris_etc_products.fits unless -product-output is given)
 ###############################################################
 
-IRIS_ETC(mode=mode,calc=calc, nframes=nframes, snr=snr, itime=itime, mag=mag,
-         flambda=flambda, resolution=resolution, filter=filter, scale=scale,
-         simdir=simdir, spectrum=spectrum, lam_obs = wavelength,
-         line_width = line_width, zenith_angle=zenith_angle, atm_cond=atm_cond,
-         psf_loc=psf_loc, png_output=png_output, psfdir=psfdir, source=source,source_size=source_size,
-         psf_old=psf_old,csv_output=csv_output, verb=1)
+def main():
+    args = parse_etc_args(etc_parser())
+    try:
+        simdir, psfdir = read_config(args.config)
+    except (IOError, ValueError) as e:
+        sys.exit(str(e))
+    if args.all_filters is not None:
+        # results table of all the filters
+        kwargs = etc_kwargs(args)
+        kwargs.pop("filter")
+        print(json.dumps(run_filters(args.all_filters, simdir=simdir,
+                                     psfdir=psfdir, **kwargs)))
+    elif args.redshifts is not None:
+        # results table of the redshift grid
+        kwargs = etc_kwargs(args)
+        kwargs.pop("redshift")
+        try:
+            results = run_redshifts(args.redshifts, simdir=simdir,
+                                    psfdir=psfdir, **kwargs)
+        except ValueError as e:
+            sys.exit(str(e))
+        print(json.dumps(results))
+    elif args.cache:
+        # same calculation with the same data returned from the cache
+        etc = result_cache(IRIS_ETC, simdir, psfdir, path=args.cache)
+        print(json.dumps(etc(verb=1, **etc_kwargs(args))))
+        etc.close()
+    else:
+        figures = []
+        print(json.dumps(IRIS_ETC(simdir=simdir, psfdir=psfdir, verb=1,
+                                  figures=figures, **etc_kwargs(args))))
+        if not args.o:
+            show_figures(figures)
+
+
+if __name__ == "__main__":
+    main()
 
 
 
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+# Monte-Carlo noise realizations
+#
+# Draws N Poisson realizations of the expected counts (totalObserved
+# for the imager, totalObservedCube for the IFS) on a pool of worker
+# processes and summarizes the S/N measured in the aperture.  The
+# realizations are split in fixed size blocks, each block with its own
+# random stream spawned from the seed, so that the results only depend
+# on the seed and not on the number of processes.  Every worker keeps
+# running (Welford) statistics and holds a single realization at a time.
+
+import numpy as np
+from multiprocessing import Pool
+
+from random_streams import spawn_rngs
+
+percentiles = [2.5, 16., 50., 84., 97.5]
+
+# arrays shared with the worker processes, set once per process
+_shared = {}
+
+
+def _init_worker(totalObserved, skyObserved, apermask, peak):
+    _shared["totalObserved"] = totalObserved
+    _shared["skyObserved"] = skyObserved
+    _shared["apermask"] = apermask
+    _shared["peak"] = peak
+
+
+class running_stats():
+    # online mean and variance (Welford), mergeable between workers
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.
+        self.m2 = 0.
+
+    def add(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean = self.mean + delta/self.n
+        self.m2 = self.m2 + delta*(x - self.mean)
+
+    def merge(self, other):
+        if other.n == 0:
+            return
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta*other.n/float(n)
+        self.m2 = self.m2 + other.m2 + delta**2*self.n*other.n/float(n)
+        self.n = n
+
+    def std(self):
+        return np.sqrt(self.m2/max(self.n - 1, 1))
+
+
+def _run_block(args):
+    nreal, rng = args
+    totalObserved = _shared["totalObserved"]
+    skyObserved = _shared["skyObserved"]
+    apermask = _shared["apermask"]
+    peak = (Ellipsis,) + _shared["peak"]
+
+    # expected sky and variance in the aperture [electrons]
+    sky_aper = skyObserved*apermask.sum()
+    var_aper = totalObserved[..., apermask].sum(axis=-1)
+
+    flux = running_stats()
+    peakflux = running_stats()
+    snr = []
+    for i in range(nreal):
+        sim = rng.poisson(lam=totalObserved)
+        source = sim[..., apermask].sum(axis=-1) - sky_aper
+        flux.add(source)
+        peakflux.add(sim[peak] - skyObserved)
+        snr.append(np.sum(source)/np.sqrt(np.sum(var_aper)))
+        del sim
+
+    return flux, peakflux, snr
+
+
+def run_montecarlo(totalObserved, skyObserved, apermask, peak, nreal,
+                   seed=None, nproc=None, block=16):
+    """
+    S/N distribution from nreal Poisson realizations.
+
+    totalObserved - expected counts [electrons], image (ny, nx) or
+                    cube (nchan, ny, nx)
+    skyObserved   - expected counts [electrons] per pixel without the
+                    source, scalar or one value per channel
+    apermask      - boolean (ny, nx) aperture
+    peak          - (y, x) of the peak pixel
+    nreal         - number of realizations
+    seed          - seed of the random streams
+    nproc         - number of worker processes (default: number of cores)
+    block         - realizations per random stream
+
+    Returns a dictionary with the mean and standard deviation of the
+    source counts in the aperture (per channel for a cube), the
+    empirical S/N (mean/std over the realizations) in the aperture and
+    in the peak pixel, and the mean and percentiles of the S/N measured
+    in each realization.
+    """
+    apermask = np.asarray(apermask, dtype=bool)
+    skyObserved = np.asarray(skyObserved, dtype=float)
+
+    nblocks = int(np.ceil(nreal/float(block)))
+    sizes = [min(block, nreal - i*block) for i in range(nblocks)]
+    rngs = spawn_rngs(seed, nblocks)
+
+    pool = Pool(nproc, initializer=_init_worker,
+                initargs=(totalObserved, skyObserved, apermask, tuple(peak)))
+    try:
+        flux = running_stats()
+        peakflux = running_stats()
+        snr = []
+        # imap keeps the blocks in order, so the merge is deterministic
+        for f, p, s in pool.imap(_run_block, zip(sizes, rngs)):
+            flux.merge(f)
+            peakflux.merge(p)
+            snr.extend(s)
+    finally:
+        pool.close()
+        pool.join()
+
+    snr = np.array(snr)
+    flux_std = flux.std()
+    result = {"nreal": nreal,
+              "flux_mean": flux.mean, "flux_std": flux_std,
+              "snr_empirical": np.sum(flux.mean)/np.sqrt(np.sum(flux_std**2)),
+              "snr_peak_empirical": np.sum(peakflux.mean)/np.sqrt(np.sum(peakflux.std()**2)),
+              "snr_mean": snr.mean(),
+              "snr_percentiles": dict(zip(percentiles,
+                                          np.percentile(snr, percentiles)))}
+    if np.ndim(flux.mean) == 1:
+        result["snr_chl_empirical"] = flux.mean/flux_std
+    return result
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+# OH line list renderer
+#
+# Simulated OH sky spectrum from a line catalog (simdir/info/ohlineslist.dat,
+# columns: wavelength [Ang], line intensity [photons/s/m^2/arcsec^2]),
+# used by background_specs3 with ohsim instead of the Gemini spectrum.
+# The lines are sorted once and cached, so that rendering a band only
+# touches the lines inside it: they are binned onto the wavelength grid
+# in one pass and convolved once with the line spread function.
+
+import os
+
+import numpy as np
+
+from etc_cache import memoize
+
+
+def pixel_edges(wave):
+    # edges of the pixels of a (possibly non uniform) increasing grid
+    wave = np.asarray(wave, dtype=float)
+    mid = 0.5*(wave[1:] + wave[:-1])
+    return np.concatenate([[2*wave[0] - mid[0]], mid, [2*wave[-1] - mid[-1]]])
+
+
+class ohline_list():
+
+    def __init__(self, wave, intensity):
+        """
+        wave      - line wavelengths [Ang]
+        intensity - line intensities [photons/s/m^2/arcsec^2]
+        """
+        order = np.argsort(wave)
+        self.wave = np.asarray(wave, dtype=float)[order]
+        self.intensity = np.asarray(intensity, dtype=float)[order]
+        self.wave.flags.writeable = False
+        self.intensity.flags.writeable = False
+
+    def band(self, wmin, wmax):
+        # index range of the lines between wmin and wmax [Ang]
+        return (np.searchsorted(self.wave, wmin, side='left'),
+                np.searchsorted(self.wave, wmax, side='right'))
+
+    def render(self, wave, lsf=None):
+        """
+        OH spectrum [photons/s/m^2/um/arcsec^2] on the wavelength grid
+        wave [Ang]: every line is deposited in the pixel containing it,
+        then the spectrum is convolved with the normalized line spread
+        function lsf [pixels].
+        """
+        edges = pixel_edges(wave)
+        i0, i1 = self.band(edges[0], edges[-1])
+        pix = np.searchsorted(edges, self.wave[i0:i1], side='right') - 1
+        keep = (pix >= 0) & (pix < len(wave))
+        spec = np.bincount(pix[keep], weights=self.intensity[i0:i1][keep],
+                           minlength=len(wave)).astype(float)
+        spec /= np.diff(edges)/1e4   # per micron
+        if lsf is not None:
+            spec = np.convolve(spec, lsf, mode='same')
+        return spec
+
+
+@memoize(maxsize=4)
+def load_ohlines(simdir='~/data/iris/sim/'):
+    # sorted OH line catalog
+    ohfile = os.path.expanduser(simdir + "info/ohlineslist.dat")
+    data = np.genfromtxt(ohfile, usecols=(0, 1))
+    return ohline_list(data[:,0], data[:,1])
+
+
+def sim_ohlines(wave, simdir='~/data/iris/sim/', lsf=None):
+    """
+    Simulated OH spectrum [photons/s/m^2/um/arcsec^2] on the wavelength
+    grid wave [microns], optionally convolved with the line spread
+    function lsf [pixels].
+    """
+    return load_ohlines(simdir).render(np.asarray(wave)*1e4, lsf)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+# Packed PSF library
+#
+# The simulated PSFs live in a deep tree of
+# za*/evlpsfcl_1_x*_y*_*mas.fits files with one extension per
+# wavelength.  pack_psf_library() copies the whole grid into a handful
+# of .npy chunks (one per instrument, plate scale and plane shape) plus
+# a JSON index, stored in psfdir/psfs/psflib/.  Every plane is then a
+# contiguous block of a memory mapped chunk, so reading one PSF plane
+# is a single seek and no copy.
+#
+# The index is keyed by the same relative file name returned by
+# get_psf(), so a packed library is used transparently by read_psf().
+#
+# Usage:
+#   psf_library.py -psfdir /Volumes/data5/d2/data/iris/sim
+
+import os
+import json
+import itertools
+import argparse
+from collections import OrderedDict
+
+import numpy as np
+
+libname = "psflib"
+indexname = "index.json"
+
+# BITPIX -> numpy type of the stored planes
+bitpix_dtype = {8: "u1", 16: "i2", 32: "i4", 64: "i8", -32: "f4", -64: "f8"}
+
+_libraries = {}
+
+
+def library_dir(psfdir):
+    return os.path.expanduser(psfdir + "/psfs/" + libname + "/")
+
+
+class psf_library():
+
+    def __init__(self, libdir):
+
+        self.libdir = libdir
+        with open(os.path.join(libdir, indexname)) as f:
+            index = json.load(f)
+        self.files = index["files"]
+        self.chunks = index["chunks"]
+        self.wvls = index["wvls"]
+        self._maps = {}
+
+    def __contains__(self, psf_file):
+        return psf_file in self.files
+
+    def _chunk(self, name):
+        # np.load with mmap_mode only reads the .npy header
+        if name not in self._maps:
+            self._maps[name] = np.load(os.path.join(self.libdir, name),
+                                       mmap_mode='r')
+        return self._maps[name]
+
+    def plane(self, psf_file, ext=0):
+        """
+        Return extension ext of psf_file as a read-only memory map.
+        """
+        entry = self.files[psf_file]
+        if not 0 <= ext < entry["nplanes"]:
+            raise IndexError("%s has %i planes, requested %i" %
+                             (psf_file, entry["nplanes"], ext))
+        return self._chunk(entry["chunk"])[entry["start"] + ext]
+
+    def planes(self, psf_file):
+        """
+        Return all wavelength planes of psf_file as a (nwvl, ny, nx)
+        read-only memory map.
+        """
+        entry = self.files[psf_file]
+        start = entry["start"]
+        return self._chunk(entry["chunk"])[start:start + entry["nplanes"]]
+
+    def plane_at(self, mode, za, cond, time, x, y, scale, wvl):
+        """
+        Return the plane on the exact grid point (mode, za, cond, time,
+        x, y, scale [mas], wvl [nm]).
+        """
+        from get_psf import psf_grid, psf_filename
+
+        ins = psf_grid(mode)["ins"]
+        psf_file = psf_filename(za, cond, ins, time, x, y, scale)
+        return self.plane(psf_file, self.wvls[mode.lower()].index(wvl))
+
+
+def open_psf_library(psfdir):
+    """
+    Return the packed psf_library found under psfdir, or None if the
+    library has not been packed.  Libraries are opened once per process
+    and reopened when the index changes on disk.
+    """
+    libdir = library_dir(psfdir)
+    indexfile = os.path.join(libdir, indexname)
+    if not os.path.isfile(indexfile):
+        return None
+
+    mtime = os.path.getmtime(indexfile)
+    lib = _libraries.get(libdir)
+    if lib is None or lib[0] != mtime:
+        lib = (mtime, psf_library(libdir))
+        _libraries[libdir] = lib
+    return lib[1]
+
+
+def pack_psf_library(psfdir, outdir=None, verb=1):
+    """
+    Pack every FITS file of the PSF grid found under psfdir/psfs/ into
+    .npy chunks and write the JSON index.  Returns the index.
+    """
+    from astropy.io import fits
+    from get_psf import psf_grid, psf_filename
+
+    psfroot = os.path.expanduser(psfdir + "/psfs/")
+    if outdir is None:
+        outdir = library_dir(psfdir)
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    # first pass: headers only, to size the chunks
+    files = OrderedDict()
+    chunks = {}
+    wvls = {}
+    for mode in ["ifs", "imager"]:
+        grid = psf_grid(mode)
+        wvls[mode] = grid["wvl"]
+        for za, cond, time, x, y, scale in itertools.product(
+                grid["za"], grid["cond"], grid["time"], grid["x"],
+                grid["y"], grid["scale"]):
+
+            psf_file = psf_filename(za, cond, grid["ins"], time, x, y, scale)
+            if not os.path.isfile(psfroot + psf_file):
+                continue
+
+            pf = fits.open(psfroot + psf_file)
+            shape = pf[0].shape
+            dtype = bitpix_dtype[pf[0].header["BITPIX"]]
+            nplanes = len(pf)
+            for hdu in pf:
+                if hdu.shape != shape:
+                    raise ValueError("%s: planes of different shapes" % psf_file)
+            pf.close()
+
+            chunk = "%s_%imas_%ix%i_%s.npy" % (grid["ins"], scale, shape[0],
+                                               shape[1], dtype)
+            if chunk not in chunks:
+                chunks[chunk] = {"shape": [0, shape[0], shape[1]],
+                                 "dtype": dtype}
+            files[psf_file] = {"chunk": chunk,
+                               "start": chunks[chunk]["shape"][0],
+                               "nplanes": nplanes,
+                               "mode": mode, "za": za, "cond": cond,
+                               "time": time, "x": x, "y": y, "scale": scale}
+            chunks[chunk]["shape"][0] += nplanes
+
+    # second pass: fill the chunks plane by plane
+    maps = {}
+    for chunk, info in chunks.items():
+        maps[chunk] = np.lib.format.open_memmap(os.path.join(outdir, chunk),
+                                                mode='w+',
+                                                dtype=info["dtype"],
+                                                shape=tuple(info["shape"]))
+    for psf_file, entry in files.items():
+        if verb > 0: print("packing " + psf_file)
+        pf = fits.open(psfroot + psf_file)
+        for ext, hdu in enumerate(pf):
+            maps[entry["chunk"]][entry["start"] + ext] = hdu.data
+        pf.close()
+    for chunk in maps:
+        maps[chunk].flush()
+    del maps
+
+    index = {"files": files, "chunks": chunks, "wvls": wvls}
+    tmpfile = os.path.join(outdir, indexname + ".tmp")
+    with open(tmpfile, "w") as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+    os.rename(tmpfile, os.path.join(outdir, indexname))
+
+    return index
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Pack the IRIS PSF library')
+    parser.add_argument('-psfdir', metavar='value', type=str, default=None,
+                        help='PSF directory (default: psfdir of config.ini)')
+    parser.add_argument('-o', metavar='value', type=str, default=None,
+                        help='output directory (default: psfdir/psfs/psflib/)')
+    args = parser.parse_args()
+
+    psfdir = args.psfdir
+    if psfdir is None:
+        try:
+            import ConfigParser as configparser
+        except ImportError:
+            import configparser
+        config = configparser.ConfigParser()
+        config.read('config.ini')
+        psfdir = config.get('CONFIG', 'psfdir')
+
+    index = pack_psf_library(psfdir, args.o)
+    print("%i PSF files packed into %i chunks" % (len(index["files"]),
+                                                    len(index["chunks"])))
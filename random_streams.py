@@ -0,0 +1,18 @@
+
+import numpy as np
+
+def spawn_rngs(seed, n):
+    """
+    Return n statistically independent random generators derived from
+    seed.  Stream i only depends on (seed, i), so results are
+    reproducible whatever the order in which the streams are consumed.
+    Uses SeedSequence spawning when numpy provides it, and seeded
+    RandomState streams otherwise.
+    """
+    if hasattr(np.random, "SeedSequence"):
+        children = np.random.SeedSequence(seed).spawn(n)
+        return [np.random.default_rng(child) for child in children]
+
+    if seed is None:
+        seed = np.random.RandomState().randint(2**31)
+    return [np.random.RandomState([seed, i]) for i in range(n)]
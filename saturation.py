@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+# Analytic saturation limits
+#
+# Deterministic replacement of counting the saturated pixels of a
+# Poisson realization: from the expected count rate of every pixel
+# (source + background + dark current) and the gain, the longest
+# integration before the peak pixel reaches the saturation level, the
+# brightest magnitude that stays below it, and the expected number of
+# saturated pixels (sum over the pixels of the Poisson probability to
+# exceed the saturation level, with the read noise variance of the
+# frames added to the Poisson mean as in the simulated image).
+# Everything is vectorized over arrays of magnitudes, so that whole
+# catalogs can be screened at once.
+
+import numpy as np
+from scipy.special import gammainc
+
+sat_limit = 50000   # [DN]
+
+
+def source_rate(mag, zp, collarea, efftot):
+    # total source count rate through the telescope [e-/s]
+    return zp*10**(-0.4*np.asarray(mag, dtype=float))*collarea*efftot
+
+
+def max_itime(mag, psf_peak, zp, collarea, efftot, background, darkcurrent,
+              gain, sat_limit=sat_limit):
+    """
+    Longest integration [s] before the peak pixel reaches sat_limit [DN].
+
+    psf_peak    - fraction of the source flux in the peak pixel
+    background  - background per pixel [e-/s]
+    darkcurrent - dark current [e-/s]
+    """
+    rate = source_rate(mag, zp, collarea, efftot)*psf_peak + background + darkcurrent
+    return sat_limit*gain/rate
+
+
+def brightest_mag(itime, psf_peak, zp, collarea, efftot, background,
+                  darkcurrent, gain, sat_limit=sat_limit):
+    """
+    Brightest magnitude whose peak pixel stays below sat_limit [DN] in an
+    integration of itime [s] (array), NaN where the background and dark
+    current alone saturate.
+    """
+    itime = np.asarray(itime, dtype=float)
+    rate = sat_limit*gain/itime - background - darkcurrent
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mag = -2.5*np.log10(rate/(zp*collarea*efftot*psf_peak))
+    return np.where(rate > 0, mag, np.nan)
+
+
+def expected_saturated(mag, psf, zp, collarea, efftot, background,
+                       darkcurrent, itime, gain, sat_limit=sat_limit,
+                       chunk=1024, readnoise=0.0, nframes=1):
+    """
+    Expected number of pixels above sat_limit [DN] in an integration of
+    itime [s], for every magnitude of mag.
+
+    psf       - normalized PSF image (fraction of the source flux per pixel)
+    readnoise - read noise [e-], readnoise**2*nframes is added to the
+                Poisson mean of every pixel
+
+    Only the pixels which can reach the saturation level for the
+    brightest magnitude are evaluated, in chunks of magnitudes.
+    """
+    mag = np.asarray(mag, dtype=float)
+    flux = np.atleast_1d(source_rate(mag, zp, collarea, efftot)).ravel()
+    psf = np.asarray(psf, dtype=float).ravel()
+    sky = (background + darkcurrent)*itime + readnoise**2*nframes
+    k = np.floor(sat_limit*gain)
+
+    # pixels with a non negligible probability of exceeding k electrons
+    lam_max = flux.max()*psf*itime + sky
+    candidates = psf[lam_max > k - 10*np.sqrt(k) - 10]
+
+    nsat = np.zeros(len(flux))
+    if len(candidates):
+        for i0 in range(0, len(flux), chunk):
+            lam = flux[i0:i0+chunk, np.newaxis]*candidates*itime + sky
+            # P(N > k) for a Poisson variable N of mean lam
+            nsat[i0:i0+chunk] = gammainc(k + 1, lam).sum(axis=1)
+    return nsat.reshape(mag.shape)
+
+
+def saturation(mag, psf, zp, collarea, efftot, background, darkcurrent,
+               itime, gain, sat_limit=sat_limit, readnoise=0.0):
+    """
+    Saturation summary for the magnitudes mag and integrations of itime
+    [s]: peak pixel rate [e-/s], maximum itime [s], brightest unsaturated
+    magnitude and expected number of saturated pixels.
+    """
+    psf = np.asarray(psf, dtype=float)
+    psf_peak = psf.max()
+    return {"peak_rate": source_rate(mag, zp, collarea, efftot)*psf_peak
+                         + background + darkcurrent,
+            "max_itime": max_itime(mag, psf_peak, zp, collarea, efftot,
+                                   background, darkcurrent, gain, sat_limit),
+            "brightest_mag": brightest_mag(itime, psf_peak, zp, collarea,
+                                           efftot, background, darkcurrent,
+                                           gain, sat_limit),
+            "nsat": expected_saturated(mag, psf, zp, collarea, efftot,
+                                       background, darkcurrent, itime, gain,
+                                       sat_limit, readnoise=readnoise)}
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+# Spectrally binned and windowed S/N of IFS spectra
+#
+# The signal and variance rates summed over the aperture are accumulated
+# once per channel (cumulative sums), so that the S/N or the exposure
+# time of any range of channels, a bin of N channels or a velocity
+# window around a line, costs two lookups.  The noise models are the
+# ones of the IFS calculations, so that a bin of one channel gives the
+# per channel value and the whole range the aperture total:
+#
+#   S/N = sum(S)*sqrt(T)/sqrt(sum(V))
+#   T   = (S/N)^2*(sum(S) + sqrt(sum(N^2)))/sum(S)^2
+#
+# with S the source rate, V the variance rate (source + background +
+# detector) and N the background + detector noise [e-/s] in the
+# aperture, and T the total integration time.
+
+import numpy as np
+
+c_km = 2.9979E5      # km/s
+
+
+def check_bins(wave, widths=None, lam_obs=None, velocity=None):
+    # bin widths of 1 to nchan channels, velocity window centered in the
+    # grid wave [microns]
+    nchan = len(wave)
+    for width in widths or []:
+        if width < 1 or width > nchan:
+            raise ValueError("bin width of %s channels, the spectrum has %i channels" % (width, nchan))
+    if velocity is not None:
+        if velocity <= 0:
+            raise ValueError("velocity window of %s km/s" % velocity)
+        if lam_obs is None or not wave[0] <= lam_obs <= wave[-1]:
+            raise ValueError("velocity window centered at %s microns, outside %.5f - %.5f microns"
+                             % (lam_obs, wave[0], wave[-1]))
+
+
+class spectral_bins():
+
+    def __init__(self, wave, signal, variance=None, noise2=None):
+        """
+        wave     - wavelength of the channels [microns]
+        signal   - source rate in the aperture per channel [e-/s]
+        variance - source + background + detector rate in the aperture
+                   per channel [e-/s], for snr
+        noise2   - squared background + detector noise in the aperture
+                   per channel [e-/s], for exptime
+        """
+        self.wave = np.asarray(wave, dtype=float)
+        self.nchan = len(self.wave)
+        self.csignal = self._cumsum(signal)
+        self.cvariance = self._cumsum(variance)
+        self.cnoise2 = self._cumsum(noise2)
+
+    def _cumsum(self, x):
+        if x is None:
+            return None
+        return np.concatenate([[0.], np.cumsum(x, dtype=float)])
+
+    def _sum(self, c, i0, i1):
+        # sum of channels i0 to i1-1 (arrays allowed)
+        return c[i1] - c[i0]
+
+    def snr(self, i0, i1, totime):
+        signal = self._sum(self.csignal, i0, i1)
+        return signal*np.sqrt(totime)/np.sqrt(self._sum(self.cvariance, i0, i1))
+
+    def exptime(self, i0, i1, snr):
+        signal = self._sum(self.csignal, i0, i1)
+        noise = np.sqrt(self._sum(self.cnoise2, i0, i1))
+        return snr**2*(signal + noise)/signal**2
+
+    def bins(self, width):
+        # channel ranges of the bins of width channels, the last partial
+        # bin is dropped
+        check_bins(self.wave, [width])
+        i0 = np.arange(0, self.nchan - width + 1, width)
+        return i0, i0 + width
+
+    def window(self, lam_obs, velocity):
+        # channel range of the velocity window [km/s] centered on lam_obs
+        check_bins(self.wave, lam_obs=lam_obs, velocity=velocity)
+        half = 0.5*lam_obs*velocity/c_km
+        i0 = np.searchsorted(self.wave, lam_obs - half, side='left')
+        i1 = np.searchsorted(self.wave, lam_obs + half, side='right')
+        if i1 <= i0:
+            # window narrower than a channel
+            i1 = min(i0 + 1, self.nchan)
+        return i0, i1
+
+    def table(self, widths, totime=None, snr=None):
+        """
+        For every bin width (channels) of widths: the central wavelength
+        of the bins and their S/N for the integration time totime, or
+        their exposure time for the requested snr.
+        """
+        out = {}
+        for width in widths:
+            i0, i1 = self.bins(width)
+            wave = 0.5*(self.wave[i0] + self.wave[i1 - 1])
+            if snr is None:
+                out[width] = (wave, self.snr(i0, i1, totime))
+            else:
+                out[width] = (wave, self.exptime(i0, i1, snr))
+        return out
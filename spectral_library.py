@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+
+# User spectral library
+#
+# Template spectra (galaxies, stellar types, ...) from FITS or ASCII
+# files, given by their path with -spectrum:
+#
+#   FITS  - 1D image with CRVAL1/CDELT1 [Ang], or a 2 x N image of
+#           wavelength [Ang] and flux
+#   ASCII - two columns, wavelength [Ang] and flux
+#
+# The flux is in erg/s/cm^2/Ang, or in photons when the FITS BUNIT
+# keyword says so; it is converted to photons/s/m^2/um.  The spectrum
+# convolved with the instrumental resolution and resampled onto the IFS
+# wavelength grid of a filter is cached on disk, keyed by the content
+# hash of the file, the filter, the resolution and the grid, so that
+# repeated queries with the same template skip the convolution and the
+# interpolation.
+#
+# redshift_template holds a rest-frame template convolved once with the
+# line spread function on a log-wavelength grid (the IFS resolving power
+# is the same in the rest and observed frames), from which the observed
+# spectra of a whole redshift grid are interpolated in one vectorized
+# step.
+
+import hashlib, os, tempfile, threading
+from collections import OrderedDict
+
+import numpy as np
+from scipy import interpolate
+from astropy.io import fits
+from astropy.modeling import models
+
+from etc_cache import file_hash, memoize
+
+h = 6.626068E-27    # cm^2*g/s
+c = 2.9979E10       # cm/s
+Ang = 1E-8          # cm
+
+builtin_spectra = ["vega", "flat", "emission"]
+
+cache_dir = os.environ.get("IRIS_ETC_SPECTRA",
+                           os.path.expanduser("~/.cache/iris_etc/spectra"))
+
+
+def is_user_spectrum(spectrum):
+    return (str(spectrum).lower() not in builtin_spectra
+            and os.path.isfile(os.path.expanduser(str(spectrum))))
+
+
+def read_spectrum(path):
+    """
+    Wavelength [microns] and flux [photons/s/m^2/um] of a FITS or ASCII
+    spectrum file.
+    """
+    path = os.path.expanduser(path)
+    photons = False
+    if path.lower().endswith((".fits", ".fit", ".fits.gz")):
+        pf = fits.open(path)
+        data = np.asarray(pf[0].data, dtype=float)
+        head = pf[0].header
+        photons = "phot" in str(head.get("BUNIT", "")).lower()
+        if data.ndim == 1:
+            wave = np.arange(data.shape[0])*head["CDELT1"] + head["CRVAL1"]
+            flux = data
+        else:
+            wave, flux = data[0], data[1]
+        pf.close()
+    else:
+        data = np.genfromtxt(path, usecols=(0, 1))
+        wave, flux = data[:,0], data[:,1]
+
+    order = np.argsort(wave)
+    wave = wave[order]     # Angstrom
+    flux = flux[order]
+    if not photons:
+        E_phot = (h*c)/(wave*Ang) # erg
+        flux = flux*100*100*1e4/E_phot # -> photons/s/m^2/um
+    return wave/1e4, flux
+
+
+def spectrum_digest(spectrum):
+    # content hash of a user spectrum, None for the other spectra
+    if is_user_spectrum(spectrum):
+        return file_hash(os.path.expanduser(str(spectrum)))
+    return None
+
+
+@memoize(maxsize=16)
+def load_user_spectrum(path, digest):
+    # spectrum of the file with the content hash digest (read-only)
+    wave, flux = read_spectrum(path)
+    wave.flags.writeable = False
+    flux.flags.writeable = False
+    return wave, flux
+
+
+def lsf_convolve(spec, delt):
+    # convolve with a Gaussian of delt pixels (as the IFS model spectra)
+    if delt > 1:
+        stddev = delt/2*np.sqrt(2*np.log(2))
+        psf_func = models.Gaussian1D(amplitude=1.0, stddev=stddev)
+        x = np.arange(4*int(delt)+1)-2*int(delt)
+        psf = psf_func(x)
+        psf /= psf.sum() # normalize
+        spec = np.convolve(spec, psf, mode='same')
+    return spec
+
+
+def convolve_resample(specwave, spec, wave):
+    # convolve with the resolution of the grid wave and interpolate
+    delt = 2.0*(wave[1]-wave[0])/np.median(np.diff(specwave))
+    spec = lsf_convolve(spec, delt)
+    spec_func = interpolate.interp1d(specwave, spec, bounds_error=False,
+                                     fill_value=0.0)
+    return spec_func(wave)
+
+
+def resampled_spectrum(path, wave, filter, resolution, directory=None):
+    """
+    Spectrum of the file path on the wavelength grid wave [microns] of
+    filter and resolution, from the disk cache if available.
+    """
+    digest = file_hash(os.path.expanduser(path))
+    key = "%s %s %s %r %r %i" % (digest, filter, resolution, float(wave[0]),
+                                 float(wave[-1]), len(wave))
+    name = hashlib.sha1(key.encode("utf-8")).hexdigest() + ".npy"
+    directory = directory or cache_dir
+    cached = os.path.join(directory, name)
+    if os.path.exists(cached):
+        try:
+            spec = np.load(cached)
+            if spec.shape == (len(wave),):
+                return spec
+        except (IOError, OSError, ValueError):
+            pass
+
+    specwave, spec = load_user_spectrum(os.path.expanduser(path), digest)
+    spec = convolve_resample(specwave, spec, wave)
+
+    # written to a temporary file and renamed, for concurrent writers
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".npy")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, spec)
+        os.rename(tmp, cached)
+    except (IOError, OSError):
+        pass
+    return spec
+
+
+class redshift_template():
+
+    def __init__(self, specwave, spec, resolution, oversample=4, maxrows=4096):
+        """
+        specwave   - rest-frame wavelength [microns]
+        spec       - rest-frame spectrum [photons/s/m^2/um]
+        resolution - resolving power, the IFS channels are of
+                     1/(2 resolution) in ln(wavelength)
+        oversample - pixels of the log grid per IFS channel
+
+        The template is convolved with a Gaussian of 2 IFS channels, as
+        the spectra at a fixed redshift.
+        """
+        specwave = np.asarray(specwave, dtype=float)
+        dln = 1.0/(2.0*resolution*oversample)
+        self.lnwave = np.arange(np.log(specwave[0]), np.log(specwave[-1]), dln)
+        spec = np.interp(self.lnwave, np.log(specwave), np.asarray(spec, dtype=float))
+        self.spec = lsf_convolve(spec, 2.0*oversample)
+        self.lnwave.flags.writeable = False
+        self.spec.flags.writeable = False
+        self.maxrows = maxrows
+        self._rows = OrderedDict()
+        self._lock = threading.Lock()
+
+    def observed(self, wave, z):
+        """
+        Observed spectra [photons/s/m^2/um] on the grid wave [microns]
+        for the redshifts z, (nz, nwave), zero outside the template.
+        """
+        z = np.atleast_1d(np.asarray(z, dtype=float))
+        wave = np.ravel(wave)
+        lnrest = np.log(wave)[np.newaxis,:] - np.log1p(z)[:,np.newaxis]
+        spec = np.interp(lnrest.ravel(), self.lnwave, self.spec, left=0.0, right=0.0)
+        return spec.reshape(len(z), len(wave))/(1.0 + z[:,np.newaxis])
+
+    def rows(self, wave, z):
+        """
+        As observed, the spectra of the redshifts not computed yet for
+        this grid are interpolated together and kept for the next calls.
+        """
+        z = np.atleast_1d(np.asarray(z, dtype=float))
+        grid = (float(wave[0]), float(wave[-1]), len(wave))
+        with self._lock:
+            missing = sorted(set(float(zi) for zi in z
+                                 if (grid, float(zi)) not in self._rows))
+        if missing:
+            spectra = self.observed(wave, missing)
+            with self._lock:
+                for zi, row in zip(missing, spectra):
+                    row.flags.writeable = False
+                    self._rows[(grid, zi)] = row
+                while len(self._rows) > max(self.maxrows, len(z)):
+                    self._rows.popitem(last=False)
+        with self._lock:
+            return np.array([self._rows[(grid, float(zi))] for zi in z])
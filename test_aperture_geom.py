@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+# Tests of the circular aperture geometry (python -m pytest, or python -m
+# unittest)
+
+import unittest
+
+import numpy as np
+
+from aperture_geom import overlap_weights, aperture_mask, circular_aperture
+
+
+class test_aperture(unittest.TestCase):
+
+    def test_exact_area(self):
+        # the overlap weights add up to the area of the circle
+        for radius in [0.3, 1.0, 2.5, 7.3]:
+            for dx, dy in [(0.0, 0.0), (0.5, 0.5), (0.27, 0.81)]:
+                weights = overlap_weights(radius, dx, dy)
+                self.assertTrue(np.all((weights >= 0) & (weights <= 1)))
+                self.assertTrue(np.allclose(weights.sum(), np.pi*radius**2))
+
+    def test_exact_subpixels(self):
+        # and agree with a fine subpixel sampling
+        radius, dx, dy = 3.2, 0.3, 0.6
+        weights = overlap_weights(radius, dx, dy)
+        n = weights.shape[0]//2
+        sub = 50
+        s = (np.arange(sub) + 0.5)/sub - 0.5
+        for iy, ix in [(n, n), (n, n+3), (n+2, n-2), (n-3, n+1)]:
+            yy, xx = np.meshgrid(iy - n + s - dy, ix - n + s - dx, indexing='ij')
+            frac = (xx**2 + yy**2 < radius**2).mean()
+            self.assertTrue(abs(weights[iy, ix] - frac) < 0.02)
+
+    def test_mask(self):
+        image = np.random.RandomState(0).rand(2, 40, 50)
+        center = (20.3, 15.6)
+        mask = aperture_mask((40, 50), center, 5.0, 'center')
+        y, x = np.mgrid[0:40, 0:50]
+        inside = (x - center[0])**2 + (y - center[1])**2 < 25.0
+        self.assertEqual(mask.npix, inside.sum())
+        self.assertTrue(np.allclose(mask.sum(image), image[:, inside].sum(axis=1)))
+
+        exact = circular_aperture((40, 50), center, 5.0, 'exact')
+        self.assertTrue(np.allclose(exact.sum(np.ones((40, 50))), np.pi*25.0))
+        self.assertTrue(np.allclose(exact.to_image().sum(), np.pi*25.0))
+        self.assertTrue(circular_aperture((40, 50), center, 5.0, 'exact') is exact)
+
+    def test_edge(self):
+        # pixels outside the image are dropped, the cutout is zero padded
+        mask = aperture_mask((20, 20), (1.0, 1.0), 3.0, 'exact')
+        self.assertTrue(mask.weights.sum() < np.pi*9.0)
+        cutout = mask.cutout(np.ones((20, 20)))
+        self.assertEqual(cutout.shape, mask.weights_box.shape)
+        self.assertTrue(np.allclose((cutout*mask.weights_box).sum(), mask.weights.sum()))
+        self.assertRaises(ValueError, aperture_mask, (20, 20), (5, 5), 2.0, 'subpixel')
+
+
+if __name__ == "__main__":
+    unittest.main()
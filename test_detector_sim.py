@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+# Tests of the tiled detector simulation (python -m pytest, or python -m
+# unittest)
+
+import os, shutil, tempfile, unittest
+
+import numpy as np
+from astropy.io import fits
+
+from detector_sim import simulate_detector
+
+
+class test_detector(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        y, x = np.mgrid[-7:8, -7:8]
+        psf = np.exp(-(x**2 + y**2)/4.0)
+        self.psf = psf/psf.sum()
+        # sources on tile corners and edges
+        self.x = np.array([10.0, 63.0, 64.0, 100.5, 120.0])
+        self.y = np.array([12.0, 64.0, 63.0, 30.0, 96.0])
+        self.flux = np.array([100.0, 200.0, 300.0, 50.0, 80.0])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def simulate(self, name, **kwargs):
+        filename = os.path.join(self.tmpdir, name)
+        simulate_detector(filename, self.x, self.y, self.flux, self.psf,
+                          2.0, 0.01, 5.0, 10.0, 3, 2.0, shape=(128, 128),
+                          tile=32, seed=7, **kwargs)
+        return fits.getdata(filename)
+
+    def test_threads(self):
+        # the same frame for any number of threads
+        one = self.simulate("one.fits", nthreads=1)
+        four = self.simulate("four.fits", nthreads=4)
+        self.assertEqual(one.shape, (128, 128))
+        self.assertTrue(np.array_equal(one, four))
+
+    def test_counts(self):
+        # sources, background and dark current [DN]
+        frame = self.simulate("frame.fits", nthreads=2).astype(float)
+        totaltime, gain = 10.0*3, 2.0
+        expected = (self.flux.sum() + (2.0 + 0.01)*128*128)*totaltime/gain
+        noise = np.sqrt(expected/gain + 128*128*(5.0**2*3)/gain**2)
+        self.assertTrue(abs(frame.sum() - expected) < 5*noise)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+# Tests of the IRIS_ETC result cache (python -m pytest, or python -m
+# unittest)
+
+import os, shutil, tempfile, threading, time, unittest
+
+from etc_cache import result_cache, data_fingerprint
+
+
+class test_result_cache(unittest.TestCase):
+
+    def setUp(self):
+        # data directories with a filter list, a sky spectrum and a PSF
+        self.tmpdir = tempfile.mkdtemp()
+        self.simdir = self.tmpdir + "/sim/"
+        self.psfdir = self.tmpdir + "/psf/"
+        for d in ["info", "skyspectra", "model_spectra"]:
+            os.makedirs(self.simdir + d)
+        os.makedirs(self.psfdir + "psfs/za30")
+        self.write(self.simdir + "info/filter_info.dat", "K 2.0 2.4\nKbb 1.96 2.38\n")
+        self.write(self.simdir + "skyspectra/sky.txt", "1 2 3\n")
+        self.psf = self.psfdir + "psfs/za30/psf_4mas.fits"
+        self.write(self.psf, "psf plane")
+        self.calls = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, path, text):
+        with open(path, "w") as f:
+            f.write(text)
+
+    def etc(self, filter="K", mag=21.0, flambda=1.62e-19, itime=1.0,
+            mode="imager", spectrum="Vega", seed=None, nmc=0,
+            framestack=False, png_output=None, verb=1, rng=None,
+            figures=None, simdir=None, psfdir=None):
+        # stand-in for IRIS_ETC, counts the calculations
+        self.calls.append((filter, mag, itime, mode))
+        time.sleep(0.01)
+        return {"SNR": mag*itime}
+
+    def test_keys(self):
+        cache = result_cache(self.etc, self.simdir, self.psfdir)
+        cache(filter="K", mag=20.0)
+        # canonical case of the filter and mode, defaults filled in,
+        # flux density ignored when the magnitude is given
+        cache(filter="k", mag=20.0, mode="imager", flambda=1e-18)
+        cache(filter="K", mag=20.0 + 1e-13)
+        self.assertEqual(len(self.calls), 1)
+        cache(filter="Kbb", mag=20.0)
+        cache(filter="K", mag=20.0, itime=2.0)
+        self.assertEqual(len(self.calls), 3)
+        # outputs and random calculations without a seed are not cached
+        cache(filter="K", mag=20.0, png_output="out.png")
+        cache(filter="K", mag=20.0, nmc=10)
+        cache(filter="K", mag=20.0, nmc=10)
+        self.assertEqual(len(self.calls), 6)
+        cache(filter="K", mag=20.0, nmc=10, seed=1)
+        cache(filter="K", mag=20.0, nmc=10, seed=1)
+        self.assertEqual(len(self.calls), 7)
+        self.assertEqual(cache.lookup(filter="K", mag=20.0), ({"SNR": 20.0}, True))
+
+    def test_invalidation(self):
+        path = os.path.join(self.tmpdir, "cache.sqlite")
+        cache = result_cache(self.etc, self.simdir, self.psfdir, path=path,
+                             recheck=0.)
+        cache(filter="K", mag=20.0)
+        cache.close()
+
+        # persistent between processes
+        cache = result_cache(self.etc, self.simdir, self.psfdir, path=path,
+                             recheck=0.)
+        cache(filter="K", mag=20.0)
+        self.assertEqual((len(self.calls), cache.disk_hits), (1, 1))
+
+        # a replaced PSF file invalidates the results, on disk as well
+        fingerprint = data_fingerprint(self.simdir, self.psfdir)
+        self.write(self.psf, "another psf plane")
+        self.assertNotEqual(data_fingerprint(self.simdir, self.psfdir), fingerprint)
+        cache(filter="K", mag=20.0)
+        self.assertEqual(len(self.calls), 2)
+        cache.close()
+        cache = result_cache(self.etc, self.simdir, self.psfdir, path=path,
+                             recheck=0.)
+        cache(filter="K", mag=20.0)
+        self.assertEqual((len(self.calls), cache.disk_hits), (2, 1))
+
+        # and so does a changed ancillary file
+        self.write(self.simdir + "skyspectra/sky.txt", "1 2 4\n")
+        cache(filter="K", mag=20.0)
+        self.assertEqual(len(self.calls), 3)
+        cache.close()
+
+    def test_coalesced(self):
+        # identical concurrent calls run the calculation once
+        cache = result_cache(self.etc, self.simdir, self.psfdir)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+                       cache.lookup(filter="K", mag=19.0))) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(sorted(hit for result, hit in results), [False] + [True]*7)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+# Tests of the crowded field simulation (python -m pytest, or python -m
+# unittest)
+
+import unittest
+
+import numpy as np
+
+from field_sim import read_catalog, disk, render_field, aperture_sums, simulate_field
+
+
+class test_field(unittest.TestCase):
+
+    def setUp(self):
+        y, x = np.mgrid[-10:11, -10:11]
+        psf = np.exp(-(x**2 + y**2)/6.0)
+        self.psf = psf/psf.sum()
+
+    def test_render(self):
+        # every source keeps its flux, centered on its pixel
+        x = np.array([30.0, 60.4, 90.0])
+        y = np.array([40.0, 60.0, 20.0])
+        flux = np.array([1.0, 2.0, 3.0])
+        image = render_field((100, 120), self.psf, x, y, flux)
+        self.assertTrue(np.allclose(image.sum(), flux.sum()))
+        self.assertTrue(np.allclose(image[40, 30], self.psf[10, 10]))
+        self.assertTrue(np.allclose(image[60, 60], 2*self.psf[10, 10]))
+
+        # a source off the frame contributes its wings only
+        edge = render_field((100, 120), self.psf, np.array([-3.0]),
+                            np.array([50.0]), np.array([1.0]))
+        self.assertTrue(np.allclose(edge.sum(), self.psf[:, 13:].sum()))
+
+    def test_aperture_sums(self):
+        image = np.random.RandomState(0).rand(50, 60)
+        x = np.array([20.0, 40.0, 2.0])
+        y = np.array([25.0, 10.0, 25.0])
+        sums = aperture_sums(image, x, y, 4.5)
+        kernel = disk(4.5)
+        for i in range(2):
+            direct = (image[int(y[i])-5:int(y[i])+6, int(x[i])-5:int(x[i])+6]*kernel).sum()
+            self.assertTrue(np.allclose(sums[i], direct))
+        self.assertTrue(np.isnan(sums[2]))
+
+    def test_isolated(self):
+        # an isolated source has the S/N of the single source calculation
+        field = simulate_field([64.0], [64.0], [1000.0], self.psf, 5.0, 0.5,
+                               10.0, 4, 4.0, shape=(128, 128),
+                               rng=np.random.RandomState(1))
+        kernel = disk(4.0)
+        ee = (self.psf[6:15, 6:15]*kernel).sum()
+        signal = 1000.0*ee*np.sqrt(40.0)
+        noise = np.sqrt(1000.0*ee + kernel.sum()*5.5)
+        self.assertTrue(np.allclose(field["snr"], signal/noise))
+        self.assertEqual(field["simImage_tot"].shape, (128, 128))
+
+    def test_catalog(self):
+        x, y, mag = read_catalog(np.array([[1.0, 2.0, 20.0], [3.0, 4.0, 21.0]]))
+        self.assertTrue(np.array_equal(mag, [20.0, 21.0]))
+
+
+if __name__ == "__main__":
+    unittest.main()
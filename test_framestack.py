@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+# Tests of the frame stack statistics (python -m pytest, or python -m
+# unittest)
+
+import os, shutil, tempfile, unittest
+
+import numpy as np
+from astropy.io import fits
+
+from framestack import generate_frames, frame_model, stack_frames, stack_snr
+
+
+class test_stack_stats(unittest.TestCase):
+
+    def setUp(self):
+        # clean Poisson + read noise frames of a flat rate
+        self.rate = np.empty((40, 40))
+        self.rate.fill(5.0)
+        self.itime, self.readnoise = 10.0, 5.0
+        self.std = np.sqrt(5.0*10.0 + 5.0**2)
+
+    def stack(self, nframes, model=None, filename=None):
+        frames = generate_frames(self.rate, self.itime, nframes, self.readnoise,
+                                 np.random.RandomState(2))
+        return stack_frames(frames, nframes, filename, model=model)
+
+    def check_clean(self, stats):
+        # the clipped statistics reproduce the unclipped ones
+        rejected = stats.nrejected()/float(stats.n*stats.nclip.size)
+        self.assertTrue(rejected < 0.005, rejected)
+        std = np.sqrt(stats.var()).mean()
+        std_clip = np.sqrt(stats.var_clip()).mean()
+        self.assertTrue(abs(std/self.std - 1.0) < 0.01)
+        self.assertTrue(abs(std_clip/std - 1.0) < 0.01, (std_clip, std))
+        mask = np.zeros(self.rate.shape, dtype=bool)
+        mask[10:30, 10:30] = True
+        snr, snr_clip = stack_snr(stats, 0.0, mask)
+        self.assertTrue(abs(snr_clip/snr - 1.0) < 0.01, (snr_clip, snr))
+
+    def test_model(self):
+        model = frame_model(self.rate, self.itime, self.readnoise)
+        for nframes in [20, 100, 500]:
+            self.check_clean(self.stack(nframes, model))
+
+    def test_running(self):
+        # without a model, against the unclipped running statistics
+        self.check_clean(self.stack(500))
+
+    def test_outliers(self):
+        # hits far above the noise are rejected and do not bias the mean
+        model = frame_model(self.rate, self.itime, self.readnoise)
+        def frames():
+            rng = np.random.RandomState(3)
+            for frame in generate_frames(self.rate, self.itime, 100,
+                                         self.readnoise, rng):
+                frame[rng.rand(*frame.shape) < 0.01] += 1000.0
+                yield frame
+        stats = stack_frames(frames(), 100, model=model)
+        self.assertTrue(abs(stats.mean_clip.mean() - 50.0) < 0.2)
+        self.assertTrue(stats.mean.mean() > 55.0)
+
+    def test_output(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, "stack.fits")
+            stats = self.stack(8, filename=filename)
+            with fits.open(filename) as hdul:
+                self.assertEqual(hdul[0].data.shape, (8, 40, 40))
+                self.assertTrue(np.allclose(hdul["MEAN"].data, stats.mean, rtol=1e-6))
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+
+# Tests of the IRIS ETC (python -m pytest, or python -m unittest)
+#
+# The tests of complete calculations need the ancillary data of
+# config.ini (or of the file given by $IRIS_ETC_CONFIG) and are skipped
+# when they are missing.
+
+import json, os, shutil, tempfile, unittest
+
+import numpy as np
+from astropy.io import fits
+
+from background_specs import filter_band
+from fits_products import product_writer
+from spectral_bins import spectral_bins, check_bins
+import iris_snr_sim
+from iris_snr_sim import IRIS_ETC, read_config, run_filters, run_redshifts
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    # Python 2.7 without the futures backport
+    ThreadPoolExecutor = None
+    from multiprocessing.pool import ThreadPool
+
+
+def data_dirs():
+    # simdir, psfdir of the configuration, None if the data are missing
+    try:
+        simdir, psfdir = read_config(os.environ.get("IRIS_ETC_CONFIG", "config.ini"))
+    except (IOError, ValueError):
+        return None
+    sky = os.path.expanduser(simdir + "skyspectra/mk_skybg_zm_16_15_ph.fits")
+    if not os.path.exists(sky) or not os.path.isdir(os.path.expanduser(psfdir)):
+        return None
+    return simdir, psfdir
+
+
+class test_background_band(unittest.TestCase):
+
+    def test_covers_filter(self):
+        # the slice of the log grid includes the filter edges
+        resolution = 8000.
+        wi = 8000.
+        n = int(np.ceil(np.log10(25000./wi)/np.log10(1.0+1.0/resolution)))
+        wavelength = wi*(1.0+1.0/resolution)**np.arange(n)
+        specs = np.ones((3, n))
+        for lambdamin, lambdamax in [(8400., 10260.), (19750., 24120.),
+                                     (21500., 21800.), (8000., 25000.)]:
+            waves, backspecs = filter_band(wavelength, specs, wi, resolution,
+                                           lambdamin, lambdamax, noconvolve=True)
+            self.assertTrue(waves[0] <= lambdamin)
+            self.assertTrue(waves[-1] >= min(lambdamax, wavelength[-1]))
+            self.assertEqual(backspecs.shape, (3, len(waves)))
+
+
+class test_spectral_bins(unittest.TestCase):
+
+    def test_exptime_model(self):
+        # bins of one channel and of all the channels give the per channel
+        # and the total aperture exposure times of the IFS
+        rng = np.random.RandomState(0)
+        wave = np.linspace(2.0, 2.4, 200)
+        signal = rng.uniform(1.0, 5.0, 200)
+        noise = rng.uniform(0.5, 3.0, 200)
+        snr = 10.0
+        bins = spectral_bins(wave, signal, noise2=noise**2)
+        table = bins.table([1, 200], snr=snr)
+        totime_chl = (snr*np.sqrt(signal + noise)/signal)**2
+        totimel = (snr*np.sqrt(signal.sum() + np.sqrt((noise**2).sum()))/signal.sum())**2
+        self.assertTrue(np.allclose(table[1][1], totime_chl))
+        self.assertTrue(np.allclose(table[200][1], totimel))
+
+    def test_checks(self):
+        wave = np.linspace(2.0, 2.4, 200)
+        self.assertRaises(ValueError, check_bins, wave, [201])
+        self.assertRaises(ValueError, check_bins, wave, [0])
+        self.assertRaises(ValueError, check_bins, wave, None, 2.5, 300.0)
+        check_bins(wave, [1, 200], 2.2, 300.0)
+
+
+class test_product_writer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "products.fits")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_close(self):
+        products = product_writer(self.filename, header=[("MODE", "ifs", "imager or ifs")])
+        products.add("CUBE", np.ones((4, 3, 3)), "electrons")
+        self.assertEqual(products.close(), self.filename)
+        self.assertFalse(products._thread.is_alive())
+        self.assertTrue(os.path.exists(self.filename))
+
+    def test_compress(self):
+        # tile compression keeps the float32 values
+        data = np.random.RandomState(0).lognormal(size=(4, 16, 16)).astype(np.float32)
+        products = product_writer(self.filename, compress=True)
+        products.add("CUBE", data, "photons/s/m^2/um")
+        products.close()
+        with fits.open(self.filename) as hdul:
+            self.assertTrue(np.array_equal(hdul["CUBE"].data, data))
+            self.assertEqual(hdul["CUBE"].header["BUNIT"], "photons/s/m^2/um")
+
+    def test_abort(self):
+        # an IRIS_ETC that raises stops the writer, without a partial file
+        products = product_writer(self.filename)
+        products.add("CUBE", np.ones((4, 3, 3)), "electrons")
+        products.abort()
+        self.assertFalse(products._thread.is_alive())
+        self.assertFalse(os.path.exists(self.filename))
+
+
+class test_run_redshifts(unittest.TestCase):
+
+    def test_mode(self):
+        # the redshift grid is an IFS calculation only
+        self.assertRaises(ValueError, run_redshifts, [1.0, 2.0], mode="imager")
+
+
+@unittest.skipIf(data_dirs() is None, "IRIS ETC data (config.ini) not available")
+class test_run_filters(unittest.TestCase):
+
+    def test_ifs(self):
+        simdir, psfdir = data_dirs()
+        results = run_filters(["Zbb", "Jbb", "Hbb", "Kbb"], simdir=simdir,
+                              psfdir=psfdir, mode="IFS", calc="snr", mag=20.0,
+                              itime=900.0, nframes=1)
+        for name, result in results.items():
+            self.assertNotIn("Error", result, "%s: %s" % (name, result.get("Error")))
+            self.assertTrue(np.isfinite(float(result["Peak Value of SNR"])))
+
+
+
+@unittest.skipIf(data_dirs() is None, "IRIS ETC data (config.ini) not available")
+class test_imager_psf(unittest.TestCase):
+
+    def record(self, name, ipsf, **kwargs):
+        # the PSF argument ipsf of iris_snr_sim.<name> in an imager snr run
+        calls = []
+        func = getattr(iris_snr_sim, name)
+        def recorder(*args, **kw):
+            calls.append(np.array(args[ipsf]))
+            return func(*args, **kw)
+        simdir, psfdir = data_dirs()
+        setattr(iris_snr_sim, name, recorder)
+        try:
+            IRIS_ETC(mode="imager", calc="snr", filter="K", mag=18.0,
+                     itime=30.0, nframes=2, scale=0.004, field_shape=[256, 256],
+                     simdir=simdir, psfdir=psfdir, verb=0, seed=1, **kwargs)
+        finally:
+            setattr(iris_snr_sim, name, func)
+        self.assertEqual(len(calls), 1)
+        return calls[0]
+
+    def test_field(self):
+        # the field simulator gets the normalized PSF, not the source image
+        psf = self.record("simulate_field", 3, catalog=np.array([[128.0, 128.0, 18.0]]))
+        self.assertTrue(abs(psf.sum() - 1.0) < 1e-6)
+
+    def test_detector(self):
+        # and so does the tiled detector simulator
+        tmpdir = tempfile.mkdtemp()
+        try:
+            psf = self.record("simulate_detector", 4, nthreads=2,
+                              detector_output=os.path.join(tmpdir, "detector.fits"))
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertTrue(abs(psf.sum() - 1.0) < 1e-6)
+
+
+def thread_map(func, items, nthreads):
+    if ThreadPoolExecutor is not None:
+        pool = ThreadPoolExecutor(max_workers=nthreads)
+        try:
+            return list(pool.map(func, items))
+        finally:
+            pool.shutdown()
+    pool = ThreadPool(nthreads)
+    try:
+        return pool.map(func, items)
+    finally:
+        pool.close()
+
+
+@unittest.skipIf(data_dirs() is None, "IRIS ETC data (config.ini) not available")
+class test_concurrency(unittest.TestCase):
+
+    def test_threads(self):
+        # the same results serially and on a thread pool of one process
+        # (no shared random, plotting or output state)
+        simdir, psfdir = data_dirs()
+        queries = []
+        for i in range(16):
+            kwargs = dict(mode=["imager", "IFS"][i % 2],
+                          calc=["snr", "exptime", "limmag"][(i//2) % 3],
+                          filter="K" if i % 2 == 0 else "Kbb",
+                          mag=18.0 + 0.25*i, itime=30.0, nframes=4, snr=10.0,
+                          scale=0.004 if i % 2 == 0 else 0.05,
+                          simdir=simdir, psfdir=psfdir, verb=1)
+            if kwargs["calc"] == "snr" and i % 4 == 0:
+                kwargs.update(framestack=True, seed=i)
+            queries.append(kwargs)
+
+        def query(kwargs):
+            figures = []
+            result = IRIS_ETC(figures=figures, **kwargs)
+            return json.dumps(result), len(figures)
+
+        serial = [query(q) for q in queries]
+        parallel = thread_map(query, queries, 8)
+        for i in range(len(queries)):
+            self.assertEqual(parallel[i], serial[i], "query %i: %s" % (i, queries[i]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+# Tests of the Monte-Carlo noise realizations (python -m pytest, or
+# python -m unittest)
+
+import unittest
+
+import numpy as np
+
+from montecarlo import running_stats, run_montecarlo
+
+
+class test_montecarlo(unittest.TestCase):
+
+    def setUp(self):
+        # point source on a flat sky [electrons]
+        y, x = np.mgrid[0:21, 0:21]
+        self.sky = 200.0
+        self.source = 5000.0*np.exp(-((x - 10)**2 + (y - 10)**2)/8.0)/(8.0*np.pi)
+        self.total = self.source + self.sky
+        self.mask = (x - 10)**2 + (y - 10)**2 < 4.0**2
+
+    def test_running_stats(self):
+        # merged blocks give the statistics of the whole sample
+        data = np.random.RandomState(0).normal(3.0, 2.0, 1000)
+        stats = [running_stats() for i in range(3)]
+        for i, d in enumerate(data):
+            stats[i*3//len(data)].add(d)
+        stats[0].merge(stats[1])
+        stats[0].merge(stats[2])
+        self.assertEqual(stats[0].n, len(data))
+        self.assertTrue(np.allclose(stats[0].mean, data.mean()))
+        self.assertTrue(np.allclose(stats[0].std(), data.std(ddof=1)))
+
+    def test_nproc(self):
+        # the results only depend on the seed
+        one = run_montecarlo(self.total, self.sky, self.mask, (10, 10), 100,
+                             seed=3, nproc=1)
+        two = run_montecarlo(self.total, self.sky, self.mask, (10, 10), 100,
+                             seed=3, nproc=2)
+        self.assertEqual(one["snr_empirical"], two["snr_empirical"])
+        self.assertEqual(one["snr_percentiles"], two["snr_percentiles"])
+
+    def test_snr(self):
+        # the empirical S/N is the analytic one
+        mc = run_montecarlo(self.total, self.sky, self.mask, (10, 10), 400,
+                            seed=1, nproc=2)
+        signal = self.source[self.mask].sum()
+        snr = signal/np.sqrt(self.total[self.mask].sum())
+        self.assertTrue(abs(mc["flux_mean"] - signal) < 3*mc["flux_std"]/np.sqrt(400))
+        self.assertTrue(abs(mc["snr_empirical"]/snr - 1.0) < 0.1)
+        self.assertTrue(abs(mc["snr_mean"]/snr - 1.0) < 0.01)
+
+    def test_cube(self):
+        # per channel statistics of a cube
+        cube = np.array([self.total, 2*self.total])
+        mc = run_montecarlo(cube, [self.sky, 2*self.sky], self.mask, (10, 10),
+                            50, seed=2, nproc=1)
+        self.assertEqual(np.shape(mc["flux_mean"]), (2,))
+        self.assertEqual(np.shape(mc["snr_chl_empirical"]), (2,))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+# Tests of the OH line list renderer (python -m pytest, or python -m
+# unittest)
+
+import unittest
+
+import numpy as np
+
+from ohlines import pixel_edges, ohline_list
+
+
+class test_ohlines(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.lines = ohline_list(rng.uniform(19000., 25000., 300),
+                                 rng.uniform(1.0, 10.0, 300))
+
+    def test_edges(self):
+        wave = 20000.0*(1.0 + 1.0/4000)**np.arange(100)
+        edges = pixel_edges(wave)
+        self.assertEqual(len(edges), 101)
+        self.assertTrue(np.all((edges[:-1] < wave) & (wave < edges[1:])))
+
+    def test_flux(self):
+        # the lines inside the grid keep their intensity, before and after
+        # the line spread function
+        wave = np.linspace(20000., 24000., 4001)
+        edges = pixel_edges(wave)
+        inside = (self.lines.wave >= edges[0]) & (self.lines.wave < edges[-1])
+        total = self.lines.intensity[inside].sum()
+        for lsf in [None, np.array([0.25, 0.5, 0.25])]:
+            spec = self.lines.render(wave, lsf)
+            self.assertTrue(spec.min() >= 0)
+            # per micron
+            flux = (spec*np.diff(edges)/1e4).sum()
+            self.assertTrue(abs(flux/total - 1.0) < 1e-3)
+
+    def test_pixel(self):
+        # a line lands in the pixel containing it
+        lines = ohline_list([21000.2, 21003.9], [2.0, 3.0])
+        wave = np.arange(20990., 21010., 1.0)
+        spec = lines.render(wave)*1e-4
+        self.assertTrue(np.allclose(spec[10], 2.0))
+        self.assertTrue(np.allclose(spec[14], 3.0))
+        self.assertTrue(np.allclose(spec.sum(), 5.0))
+
+
+if __name__ == "__main__":
+    unittest.main()
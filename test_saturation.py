@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+# Tests of the analytic saturation limits (python -m pytest, or python -m
+# unittest)
+
+import unittest
+
+import numpy as np
+from scipy.special import gammainc
+
+from saturation import source_rate, max_itime, brightest_mag, expected_saturated
+
+
+class test_saturation(unittest.TestCase):
+
+    def setUp(self):
+        y, x = np.mgrid[-10:11, -10:11]
+        psf = np.exp(-(x**2 + y**2)/(2*1.5**2))
+        self.psf = psf/psf.sum()
+        self.zp, self.collarea, self.efftot = 1.0e8, 630.0, 0.4
+        self.background, self.darkcurrent, self.gain = 20.0, 0.002, 3.04
+
+    def test_read_noise(self):
+        # the Poisson mean of the simulated imager image: the read noise
+        # is scaled to readnoise**2/itime and multiplied by itime*nframes
+        mag, itime, nframes, readnoise, sat_limit = 15.0, 2.0, 3, 30.0, 2000
+        rate = source_rate(mag, self.zp, self.collarea, self.efftot)*self.psf
+        readnoise_rate = readnoise**2/itime
+        totalObserved = (rate*itime*nframes + self.background*itime*nframes
+                         + self.darkcurrent*itime*nframes
+                         + readnoise_rate*itime*nframes)
+        k = np.floor(sat_limit*self.gain)
+        expected = gammainc(k + 1, totalObserved).sum()
+        nsat = expected_saturated(mag, self.psf, self.zp, self.collarea,
+                                  self.efftot, self.background, self.darkcurrent,
+                                  itime*nframes, self.gain, sat_limit,
+                                  readnoise=readnoise, nframes=nframes)
+        nsat0 = expected_saturated(mag, self.psf, self.zp, self.collarea,
+                                   self.efftot, self.background, self.darkcurrent,
+                                   itime*nframes, self.gain, sat_limit)
+        self.assertTrue(expected > nsat0 + 1.0)
+        self.assertTrue(np.allclose(nsat, expected, rtol=1e-6))
+
+        # and the mean count of saturated pixels of Poisson draws
+        rng = np.random.RandomState(1)
+        draws = rng.poisson(totalObserved, (400,) + totalObserved.shape)
+        self.assertTrue(abs((draws > k).sum(axis=(1, 2)).mean() - nsat) < 0.5)
+
+    def test_limits(self):
+        # the brightest magnitude saturates the peak pixel in itime
+        itime = 10.0
+        peak = self.psf.max()
+        mag = brightest_mag(itime, peak, self.zp, self.collarea, self.efftot,
+                            self.background, self.darkcurrent, self.gain)
+        self.assertTrue(np.allclose(max_itime(mag, peak, self.zp, self.collarea,
+                                              self.efftot, self.background,
+                                              self.darkcurrent, self.gain), itime))
+        self.assertTrue(np.isnan(brightest_mag(1e6, peak, self.zp, self.collarea,
+                                               self.efftot, self.background,
+                                               self.darkcurrent, self.gain)))
+
+    def test_vectorized(self):
+        mags = np.array([[12.0, 14.0], [16.0, 18.0]])
+        nsat = expected_saturated(mags, self.psf, self.zp, self.collarea,
+                                  self.efftot, self.background, self.darkcurrent,
+                                  10.0, self.gain, chunk=3)
+        self.assertEqual(nsat.shape, mags.shape)
+        for m, n in zip(mags.ravel(), nsat.ravel()):
+            self.assertTrue(np.allclose(expected_saturated(m, self.psf, self.zp,
+                self.collarea, self.efftot, self.background, self.darkcurrent,
+                10.0, self.gain), n))
+        self.assertTrue(np.all(np.diff(nsat.ravel()) <= 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+# Tests of the user spectral library (python -m pytest, or python -m
+# unittest)
+
+import os, shutil, tempfile, unittest
+
+import numpy as np
+
+from spectral_library import (h, c, Ang, read_spectrum, convolve_resample,
+                              resampled_spectrum, redshift_template)
+
+
+class test_spectral_library(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        # continuum with an emission line at 1 micron [Ang, erg/s/cm^2/Ang]
+        self.wave = np.linspace(8000., 26000., 18001)
+        self.flux = 1e-17*(1.0 + 5.0*np.exp(-0.5*((self.wave - 10000.)/5.0)**2))
+        self.path = os.path.join(self.tmpdir, "template.txt")
+        np.savetxt(self.path, np.array([self.wave, self.flux]).T)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_read(self):
+        # ASCII spectrum converted to photons/s/m^2/um
+        wave, flux = read_spectrum(self.path)
+        self.assertTrue(np.allclose(wave, self.wave/1e4))
+        photons = self.flux*1e8/((h*c)/(self.wave*Ang))
+        self.assertTrue(np.allclose(flux, photons))
+
+    def test_resampled(self):
+        # cached on disk, the same as the direct convolution
+        grid = np.linspace(1.9, 2.4, 2000)
+        cache = os.path.join(self.tmpdir, "cache")
+        spec = resampled_spectrum(self.path, grid, "K", 4000, directory=cache)
+        self.assertEqual(len(os.listdir(cache)), 1)
+        wave, flux = read_spectrum(self.path)
+        self.assertTrue(np.allclose(spec, convolve_resample(wave, flux, grid)))
+        again = resampled_spectrum(self.path, grid, "K", 4000, directory=cache)
+        self.assertTrue(np.array_equal(again, spec))
+        # another grid is another entry
+        resampled_spectrum(self.path, grid[::2], "K", 4000, directory=cache)
+        self.assertEqual(len(os.listdir(cache)), 2)
+
+    def test_redshift(self):
+        wave, flux = read_spectrum(self.path)
+        template = redshift_template(wave, flux, 4000)
+        grid = np.linspace(1.9, 2.4, 4000)
+        z = [0.0, 1.0, 1.2]
+        spectra = template.observed(grid, z)
+        self.assertEqual(spectra.shape, (3, len(grid)))
+        # the line at 1 micron is observed at (1+z) micron, the flux
+        # density divided by 1+z
+        self.assertTrue(abs(grid[np.argmax(spectra[1])] - 2.0) < 2e-4)
+        self.assertTrue(abs(grid[np.argmax(spectra[2])] - 2.2) < 2e-4)
+        i = grid.searchsorted(2.3)
+        self.assertTrue(abs(spectra[1][i]*2.0/np.interp(grid[i]/2.0, wave, flux) - 1.0) < 1e-3)
+        self.assertTrue(np.allclose(spectra[0], np.interp(grid, wave, flux), rtol=1e-3))
+        # the rows are the observed spectra, kept for the next calls
+        self.assertTrue(np.allclose(template.rows(grid, z), spectra))
+        self.assertTrue(np.allclose(template.rows(grid, [1.2, 0.0]), spectra[[2, 0]]))
+
+
+if __name__ == "__main__":
+    unittest.main()